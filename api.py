@@ -1,24 +1,88 @@
 import collections
 import contextlib
 import logging.config
+import os
+import random
 import secrets
 import base64
 import time
 import sqlite3
-from typing import Optional
+import urllib.parse
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+import async_database
+import cache
 import database
+import fieldsets
+import metrics
+import promotion
+import responses
+import writer
 
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.routing import APIRoute
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
-from database import extract_row, get_db, fetch_rows, fetch_row
+from database import extract_row, fetch_rows, fetch_row
+from writer import WriterStats, get_writer
 
 from models import *
 from model_requests import *
 
 
 app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
+
+# The largest page that a list route will return at once.
+MAX_PAGE_SIZE = 1000
+
+# The most results that a search will return, and how many it returns by
+# default.
+MAX_SEARCH_RESULTS = 100
+DEFAULT_SEARCH_RESULTS = 20
+
+# The most waitlists that a student can be on at once.
+MAX_WAITLISTS = 3
+
+# Whether list routes serialize their pages themselves, instead of leaving
+# FastAPI to validate and serialize their results. See list_response. Off
+# unless FAST_RESPONSES=1 is set in the environment.
+FAST_RESPONSES = os.environ.get("FAST_RESPONSES") == "1"
+
+# The range of seconds that clients are told to wait before retrying a write
+# that couldn't get the database's write lock. Each response picks a random
+# delay, so that clients turned away together don't all come back together.
+BUSY_RETRY_AFTER = (1, 5)
+
+
+@app.on_event("startup")
+def start_promoter():
+    promotion.start_promoter()
+
+
+@app.on_event("shutdown")
+def close_database():
+    # The promoter queues work on the writer, and the writer holds a pooled
+    # connection, so they have to stop first.
+    promotion.stop_promoter()
+    writer.stop_writer()
+    async_database.shutdown_executor()
+    database.close_pools()
+
+
+@app.exception_handler(sqlite3.OperationalError)
+async def database_busy(request: Request, e: sqlite3.OperationalError):
+    """
+    Asks the client to come back later when the writer ran out of retries
+    waiting for another process to release the write lock.
+    """
+    if not database.is_busy(e):
+        raise e
+    return PlainTextResponse(
+        "Database is busy, try again later.",
+        status_code=503,
+        headers={"retry-after": str(random.randint(*BUSY_RETRY_AFTER))},
+    )
 
 
 # The API should allow students to:
@@ -73,299 +137,624 @@ app = FastAPI()
 #   X /sections/{section_id} (remove section, registrar only)
 
 
+@dataclass(frozen=True)
+class FieldParams:
+    fields: Optional[str] = None
+    expand: Optional[str] = None
+
+    @property
+    def sparse(self) -> bool:
+        return bool(self.fields or self.expand)
+
+    def shape(self, model: type[BaseModel]) -> fieldsets.Shape:
+        return fieldsets.parse(model, self.fields, self.expand)
+
+
+async def field_params(
+    fields: Optional[str] = Query(
+        None,
+        description="Comma-separated fields to include, such as "
+        "grade,section.day. Nested objects are given as their ids unless "
+        "expanded. The response has only these fields, whatever its schema.",
+    ),
+    expand: Optional[str] = Query(
+        None,
+        description="Comma-separated nested objects to include in full, such as "
+        "section,section.course. Given either this or fields, other nested "
+        "objects are given as their ids. Each must also be in fields, if "
+        "fields names any field at its level.",
+    ),
+) -> FieldParams:
+    """
+    Parameters shared by every read route that returns models, which pick the
+    fields of the response. Only the tables and columns that the response
+    needs are read.
+    """
+    return FieldParams(fields, expand)
+
+
+@dataclass
+class ListParams:
+    limit: Optional[int] = None
+    after: Optional[str] = None
+    stream: bool = False
+    ndjson: bool = False
+    sideload: bool = False
+    fieldset: FieldParams = FieldParams()
+
+    def shape(self, model: type[BaseModel]) -> fieldsets.Shape:
+        shape = self.fieldset.shape(model)
+        if self.sideload:
+            return fieldsets.sideloaded(model, shape)
+        return shape
+
+
+async def list_params(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    stream: bool = False,
+    sideload: bool = Query(
+        False,
+        description='Return {"data": [...], "included": {...}}, where '
+        "nested objects in data are given as their ids, and included has each "
+        "user, section, course and department they refer to once, by id. "
+        f"Sending Accept: {responses.SIDELOADED_MEDIA_TYPE} does the same.",
+    ),
+    fieldset: FieldParams = Depends(field_params),
+) -> ListParams:
+    """
+    Parameters shared by every list route. Results are paged by key: pass the
+    X-Next-Cursor header of one response as after to get the next page.
+    Without a limit, every result is returned.
+
+    With stream set, or when the client accepts NDJSON, results are serialized
+    as they are read from the database instead of all at once. An NDJSON client
+    gets one result per line, and anyone else gets the usual JSON array.
+
+    With sideload set, or when the client accepts side-loaded JSON, each
+    object that results refer to is sent once beside them rather than nested
+    in every result. Side-loaded responses can't be streamed.
+    """
+    accept = request.headers.get("accept", "")
+    ndjson = responses.NDJSON_MEDIA_TYPE in accept
+    sideload = sideload or responses.SIDELOADED_MEDIA_TYPE in accept
+    if sideload and (stream or ndjson):
+        raise HTTPException(
+            status_code=400, detail="Side-loaded responses can't be streamed."
+        )
+    return ListParams(
+        limit=limit,
+        after=after,
+        stream=stream or ndjson,
+        ndjson=ndjson,
+        sideload=sideload,
+        fieldset=fieldset,
+    )
+
+
+def set_next_cursor(response: Response, page: database.Page):
+    if page.next_cursor is not None:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+
+
+async def list_response(
+    response: Response,
+    params: ListParams,
+    query: database.ListQuery,
+) -> Any:
+    """
+    Runs a list query and returns its results, either as a list for FastAPI to
+    serialize or as a streaming response.
+
+    With FAST_RESPONSES on, a page is serialized straight to JSON.
+    FastAPI would otherwise validate every item again against the route's
+    return type before serializing it, although the items are already models
+    of that type. Sparse and side-loaded responses don't match the return type,
+    so they are always serialized here.
+
+    The representation depends on the Accept header as well as the URL, which
+    every response says with Vary, so that shared caches keep them apart.
+    """
+    if not params.stream:
+        page = await async_database.run(query.fetch)
+        if not FAST_RESPONSES and not params.fieldset.sparse and not params.sideload:
+            response.headers["Vary"] = "Accept"
+            set_next_cursor(response, page)
+            return page
+
+        # The response replaces the one whose headers set_next_cursor sets.
+        headers = {"Vary": "Accept"}
+        if page.next_cursor is not None:
+            headers["X-Next-Cursor"] = page.next_cursor
+        with metrics.phase("serialize"):
+            return responses.json_response(
+                page,
+                query.mapper.model,
+                headers,
+                page.included if params.sideload else None,
+            )
+
+    headers = {"Vary": "Accept"}
+    items: Iterable[Any]
+    if query.limit is None:
+        # Starlette iterates over the stream on its threadpool, holding a
+        # connection from the stream pool until the response has been sent.
+        items = query.stream_from_pool()
+    else:
+        # A page is bounded by MAX_PAGE_SIZE, and has to be read before the
+        # headers are sent to know its cursor.
+        page = await async_database.run(query.fetch)
+        if page.next_cursor is not None:
+            headers["X-Next-Cursor"] = page.next_cursor
+        items = page
+    return responses.stream_json(items, ndjson=params.ndjson, headers=headers)
+
+
+# Responses of the catalog routes, which change only when courses or sections
+# are added, updated or deleted. Entries are tagged with "courses" or
+# "sections" for listings, and "course:<id>" or "section:<id>" for single items.
+catalog_cache = cache.ResponseCache()
+
+# How often to check whether another worker process has changed the catalog,
+# in seconds. Requests in between are served from the cache without touching
+# the database, so another worker's changes can take this long to show. This
+# process's own changes invalidate the cache as soon as they commit.
+CATALOG_VERSION_INTERVAL = 1.0
+
+
+def cache_key(request: Request) -> str:
+    query = urllib.parse.urlencode(sorted(request.query_params.multi_items()))
+    return request.url.path + "?" + query
+
+
+async def cached_response(
+    request: Request,
+    tags: Iterable[str],
+    build: Callable[[sqlite3.Connection], BaseModel | database.Page],
+    sideload: bool = False,
+) -> Response:
+    """
+    Returns the response to a catalog request from the cache, building it with
+    build(db) and storing it on a miss. A client whose If-None-Match already
+    names the response gets an empty 304 instead. With sideload set, a page is
+    sent as a side-loaded document.
+    """
+    # Other worker processes can change the catalog without invalidating this
+    # process's cache, so the catalog version is checked every so often.
+    if catalog_cache.sync_due(CATALOG_VERSION_INTERVAL):
+        catalog_cache.sync(await async_database.run(database.catalog_version))
+    # A client can ask for a side-loaded response in its Accept header, which
+    # the URL doesn't show.
+    key = cache_key(request) + ("#sideload" if sideload else "")
+    entry = catalog_cache.get(key)
+    if entry is None:
+        generation = catalog_cache.generation
+        result = await async_database.run(build)
+        headers = {}
+        with metrics.phase("serialize"):
+            if isinstance(result, database.Page):
+                if sideload:
+                    body = responses.dump_sideloaded(result, result.included)
+                else:
+                    body = responses.dump_json(result)
+                if result.next_cursor is not None:
+                    headers["X-Next-Cursor"] = result.next_cursor
+            else:
+                body = result.model_dump_json().encode()
+        entry = cache.CachedResponse(
+            body=body,
+            etag=cache.make_etag(body),
+            headers=headers,
+            tags=frozenset(tags),
+        )
+        catalog_cache.put(key, entry, generation)
+
+    # Clients may keep the response, but must check that it is still current.
+    # List routes pick side-loading from the Accept header.
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept",
+        **entry.headers,
+    }
+    if cache.etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
+
+
+def invalidate_catalog(db: sqlite3.Connection, since: int, *tags: str):
+    """
+    Invalidates cached catalog responses once the request's changes commit.
+    Doing so any earlier would let a concurrent request cache the old data
+    again before the change is visible.
+
+    The change also moves the catalog version on, which would otherwise make
+    the next request clear the whole cache. since is the version that the
+    operation read before making its changes, and as the writer holds the
+    write lock, every change between that and the version now is its own.
+    """
+    version = database.catalog_version(db)
+
+    def invalidate():
+        catalog_cache.invalidate(tags)
+        catalog_cache.advance(since, version)
+
+    database.after_commit(db, invalidate)
+
+
+def request_promotion(db: sqlite3.Connection, section_id: int):
+    """
+    Asks the promoter to fill the section's free seats from its waitlist once
+    the request's changes commit, without waiting for it to do so.
+    """
+    database.after_commit(db, lambda: promotion.request_promotion(section_id))
+
+
 @app.get("/courses")
-def list_courses(
-    db: sqlite3.Connection = Depends(get_db),
+async def list_courses(
+    request: Request,
+    response: Response,
+    params: ListParams = Depends(list_params),
+) -> list[Course]:
+    query = database.courses_query(
+        limit=params.limit, after=params.after, shape=params.shape(Course)
+    )
+    if params.stream:
+        return await list_response(response, params, query)
+    return await cached_response(request, ["courses"], query.fetch, params.sideload)
+
+
+@app.get("/courses/search")
+async def search_courses(
+    request: Request,
+    q: str,
+    limit: int = Query(DEFAULT_SEARCH_RESULTS, ge=1, le=MAX_SEARCH_RESULTS),
+    fieldset: FieldParams = Depends(field_params),
 ) -> list[Course]:
-    return database.list_courses(db)
+    """
+    Finds courses with a word in their code, name or department starting with
+    each word of q, best matches first.
+    """
+    query = database.course_search_query(q, limit=limit, shape=fieldset.shape(Course))
+    return await cached_response(request, ["courses"], query.fetch)
 
 
 @app.get("/courses/{course_id}")
-def get_course(
+async def get_course(
     course_id: int,
-    db: sqlite3.Connection = Depends(get_db),
+    request: Request,
+    fieldset: FieldParams = Depends(field_params),
 ) -> Course:
-    courses = database.list_courses(db, [course_id])
-    if len(courses) == 0:
-        raise HTTPException(status_code=404, detail="Course not found")
-    return courses[0]
+    shape = fieldset.shape(Course)
+
+    def build(db: sqlite3.Connection) -> BaseModel:
+        courses = database.list_courses(db, [course_id], shape=shape)
+        if len(courses) == 0:
+            raise HTTPException(status_code=404, detail="Course not found")
+        return courses[0]
+
+    return await cached_response(request, [f"course:{course_id}"], build)
 
 
 @app.get("/courses/{course_id}/waitlist")
-def get_course_waitlist(
+async def get_course_waitlist(
     course_id: int,
-    db: sqlite3.Connection = Depends(get_db),
+    response: Response,
+    params: ListParams = Depends(list_params),
 ) -> list[Waitlist]:
-    rows = fetch_rows(
-        db,
-        """
-        SELECT waitlist.user_id, sections.id
-        FROM waitlist
-        INNER JOIN sections ON waitlist.section_id = sections.id
-        WHERE sections.course_id = ? AND sections.deleted = FALSE
-        """,
-        (course_id,),
-    )
-    return database.list_waitlist(
-        db,
-        [(row["waitlist.user_id"], row["sections.id"]) for row in rows],
+    query = database.waitlist_query(
+        course_id=course_id,
+        deleted=False,
+        limit=params.limit,
+        after=params.after,
+        shape=params.shape(Waitlist),
     )
+    return await list_response(response, params, query)
 
 
 @app.get("/sections")
-def list_sections(
+async def list_sections(
+    request: Request,
+    response: Response,
     course_id: Optional[int] = None,
-    db: sqlite3.Connection = Depends(get_db),
+    day: Optional[str] = None,
+    time_from: Optional[str] = None,
+    time_to: Optional[str] = None,
+    params: ListParams = Depends(list_params),
 ) -> list[Section]:
-    section_ids = fetch_rows(
-        db,
-        """
-        SELECT id
-        FROM sections
-        WHERE deleted = FALSE
-        """
-        + ("" if course_id is None else "AND course_id = :course_id"),
-        {"course_id": course_id},
+    """
+    Lists sections. day (such as Tuesday) keeps those that meet on that day,
+    and time_from and time_to (such as 1pm or 13:00) those that start and end
+    within that window.
+    """
+    query = database.sections_query(
+        course_id=course_id,
+        deleted=False,
+        day=None if day is None else parse_day(day),
+        time_from=None if time_from is None else parse_time(time_from),
+        time_to=None if time_to is None else parse_time(time_to),
+        limit=params.limit,
+        after=params.after,
+        shape=params.shape(Section),
     )
-    return database.list_sections(db, [row["sections.id"] for row in section_ids])
+    if params.stream:
+        return await list_response(response, params, query)
+    return await cached_response(request, ["sections"], query.fetch, params.sideload)
+
+
+def parse_day(text: str) -> int:
+    day = database.parse_day(text)
+    if day is None:
+        raise HTTPException(status_code=400, detail=f"Unknown day {text}.")
+    return day
+
+
+def parse_time(text: str) -> int:
+    minutes = database.parse_time(text)
+    if minutes is None:
+        raise HTTPException(status_code=400, detail=f"Can't parse time {text}.")
+    return minutes
+
+
+@app.get("/sections/search")
+async def search_sections(
+    request: Request,
+    q: str,
+    limit: int = Query(DEFAULT_SEARCH_RESULTS, ge=1, le=MAX_SEARCH_RESULTS),
+    fieldset: FieldParams = Depends(field_params),
+) -> list[Section]:
+    """
+    Finds sections with a word in their course's code, name or department,
+    their instructor's name or their classroom starting with each word of q,
+    best matches first.
+    """
+    query = database.section_search_query(q, limit=limit, shape=fieldset.shape(Section))
+    return await cached_response(request, ["sections"], query.fetch)
 
 
 @app.get("/sections/{section_id}")
-def get_section(
+async def get_section(
     section_id: int,
-    db: sqlite3.Connection = Depends(get_db),
+    request: Request,
+    fieldset: FieldParams = Depends(field_params),
 ) -> Section:
-    sections = database.list_sections(db, [section_id])
-    if len(sections) == 0:
-        raise HTTPException(status_code=404, detail="Section not found")
-    return sections[0]
+    shape = fieldset.shape(Section)
+
+    def build(db: sqlite3.Connection) -> BaseModel:
+        sections = database.list_sections(db, [section_id], shape=shape)
+        if len(sections) == 0:
+            raise HTTPException(status_code=404, detail="Section not found")
+        return sections[0]
+
+    return await cached_response(request, [f"section:{section_id}"], build)
 
 
 @app.get("/sections/{section_id}/enrollments")
-def list_section_enrollments(
+async def list_section_enrollments(
     section_id: int,
+    response: Response,
     status=EnrollmentStatus.ENROLLED,
-    db: sqlite3.Connection = Depends(get_db),
+    params: ListParams = Depends(list_params),
 ) -> list[ListSectionEnrollmentsItem]:
-    rows = fetch_rows(
-        db,
-        """
-        SELECT enrollments.user_id, enrollments.section_id
-        FROM enrollments
-        INNER JOIN sections ON sections.id = enrollments.section_id
-        WHERE
-            enrollments.status = ?
-            AND sections.deleted = FALSE
-            AND sections.id = ?
-        """,
-        (status, section_id),
-    )
-    rows = [extract_row(row, "enrollments") for row in rows]
-    enrollments = database.list_enrollments(
-        db,
-        [(row["user_id"], row["section_id"]) for row in rows],
+    query = database.enrollments_query(
+        section_id=section_id,
+        status=status,
+        deleted=False,
+        limit=params.limit,
+        after=params.after,
+        shape=params.shape(ListSectionEnrollmentsItem),
     )
-    return [
-        ListSectionEnrollmentsItem(**dict(enrollment)) for enrollment in enrollments
-    ]
+    return await list_response(response, params, query)
 
 
 @app.get("/sections/{section_id}/waitlist")
-def list_section_waitlist(
+async def list_section_waitlist(
     section_id: int,
-    db: sqlite3.Connection = Depends(get_db),
+    response: Response,
+    params: ListParams = Depends(list_params),
 ) -> list[ListSectionWaitlistItem]:
-    rows = fetch_rows(
-        db,
-        """
-        SELECT waitlist.user_id, waitlist.section_id
-        FROM waitlist
-        INNER JOIN sections ON sections.id = waitlist.section_id
-        WHERE waitlist.section_id = ? AND sections.deleted = FALSE
-        """,
-        (section_id,),
-    )
-    rows = [extract_row(row, "waitlist") for row in rows]
-    waitlist = database.list_waitlist(
-        db,
-        [(row["user_id"], row["section_id"]) for row in rows],
+    query = database.waitlist_query(
+        section_id=section_id,
+        deleted=False,
+        limit=params.limit,
+        after=params.after,
+        shape=params.shape(ListSectionWaitlistItem),
     )
-    return [ListSectionWaitlistItem(**dict(item)) for item in waitlist]
+    return await list_response(response, params, query)
 
 
 @app.get("/users")
-def list_users(
-    db: sqlite3.Connection = Depends(get_db),
+async def list_users(
+    response: Response,
+    params: ListParams = Depends(list_params),
 ) -> list[User]:
-    users_rows = fetch_rows(db, "SELECT * FROM users")
-    return [User(**dict(row)) for row in users_rows]
+    query = database.users_query(
+        limit=params.limit, after=params.after, shape=params.shape(User)
+    )
+    return await list_response(response, params, query)
 
 
 @app.get("/users/{user_id}")
-def get_user(
+async def get_user(
     user_id: int,
-    db: sqlite3.Connection = Depends(get_db),
 ) -> User:
-    user = fetch_row(db, "SELECT * FROM users WHERE id = ?", (user_id,))
+    user = await async_database.fetch_row(
+        "SELECT * FROM users WHERE id = ?", (user_id,)
+    )
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return User(**extract_row(user, "users"))
 
 
 @app.get("/users/{user_id}/enrollments")
-def list_user_enrollments(
+async def list_user_enrollments(
     user_id: int,
+    response: Response,
     status=EnrollmentStatus.ENROLLED,
-    db: sqlite3.Connection = Depends(get_db),
+    params: ListParams = Depends(list_params),
 ) -> list[Enrollment]:
-    rows = fetch_rows(
-        db,
-        """
-        SELECT enrollments.user_id, enrollments.section_id
-        FROM enrollments
-        INNER JOIN sections ON sections.id = enrollments.section_id
-        WHERE
-            enrollments.status = ?
-            AND sections.deleted = FALSE
-            AND enrollments.user_id = ?
-        """,
-        (status, user_id),
-    )
-    rows = [extract_row(row, "enrollments") for row in rows]
-    return database.list_enrollments(
-        db,
-        [(row["user_id"], row["section_id"]) for row in rows],
+    query = database.enrollments_query(
+        user_id=user_id,
+        status=status,
+        deleted=False,
+        limit=params.limit,
+        after=params.after,
+        shape=params.shape(Enrollment),
     )
+    return await list_response(response, params, query)
 
 
 @app.get("/users/{user_id}/sections")
-def list_user_sections(
+async def list_user_sections(
     user_id: int,
+    response: Response,
     type: ListUserSectionsType = ListUserSectionsType.ALL,
-    db: sqlite3.Connection = Depends(get_db),
+    params: ListParams = Depends(list_params),
 ) -> list[Section]:
-    q = """
-        SELECT sections.id
-        FROM sections
-        INNER JOIN enrollments ON enrollments.section_id = sections.id
-        WHERE sections.deleted = FALSE AND
-    """
-
-    wheres = []
-    q += "("
-    if type == ListUserSectionsType.ALL or type == ListUserSectionsType.ENROLLED:
-        wheres.append("enrollments.user_id = :user_id")
-    if type == ListUserSectionsType.ALL or type == ListUserSectionsType.INSTRUCTING:
-        wheres.append("sections.instructor_id = :user_id")
-    q += " OR ".join(wheres)
-    q += ")"
-
-    rows = fetch_rows(db, q, {"user_id": user_id})
-    return database.list_sections(db, [row["sections.id"] for row in rows])
+    enrolled = type == ListUserSectionsType.ALL or type == ListUserSectionsType.ENROLLED
+    instructing = (
+        type == ListUserSectionsType.ALL or type == ListUserSectionsType.INSTRUCTING
+    )
+    query = database.sections_query(
+        user_id=user_id if enrolled else None,
+        instructor_id=user_id if instructing else None,
+        deleted=False,
+        limit=params.limit,
+        after=params.after,
+        shape=params.shape(Section),
+    )
+    return await list_response(response, params, query)
 
 
 @app.get("/users/{user_id}/waitlist")
-def list_user_waitlist(
+async def list_user_waitlist(
     user_id: int,
-    db: sqlite3.Connection = Depends(get_db),
+    response: Response,
+    params: ListParams = Depends(list_params),
 ) -> list[Waitlist]:
-    section_ids = fetch_rows(
-        db,
-        """
-        SELECT waitlist.user_id, waitlist.section_id
-        FROM waitlist
-        INNER JOIN sections ON sections.id = waitlist.section_id
-        WHERE
-            sections.deleted = FALSE
-            AND (user_id = :user_id OR instructor_id = :user_id)
-        """,
-        {"user_id": user_id},
-    )
-    rows = [extract_row(row, "waitlist") for row in section_ids]
-    return database.list_waitlist(
-        db,
-        [(row["user_id"], row["section_id"]) for row in rows],
+    query = database.waitlist_query(
+        user_id=user_id,
+        instructor_id=user_id,
+        deleted=False,
+        limit=params.limit,
+        after=params.after,
+        shape=params.shape(Waitlist),
     )
+    return await list_response(response, params, query)
 
 
 @app.post("/users/{user_id}/enrollments")  # student attempt to enroll in class
-def create_enrollment(
+async def create_enrollment(
     user_id: int,
     enrollment: CreateEnrollmentRequest,
-    db: sqlite3.Connection = Depends(get_db),
 ) -> CreateEnrollmentResponse:
+    return await get_writer().run(create_enrollment_txn, user_id, enrollment)
+
+
+def create_enrollment_txn(
+    db: sqlite3.Connection,
+    user_id: int,
+    enrollment: CreateEnrollmentRequest,
+) -> CreateEnrollmentResponse:
+    """
+    Enrolls the user in the section if it has a free seat, or else puts them
+    on its waitlist if there is room. Each check is part of the statement that
+    inserts the row it guards, so no other request can take the seat or the
+    place in line in between. Neither is allowed if the section meets at the
+    same time as one the user is enrolled in.
+    """
     d = {
         "user": user_id,
         "section": enrollment.section,
+        "max_waitlists": MAX_WAITLISTS,
     }
 
     waitlist_position = None
 
-    # Verify that the class still has space.
-    id = fetch_row(
+    enrolled = fetch_row(
         db,
         """
-        SELECT id
-        FROM sections as s
-        WHERE s.id = :section
-        AND s.capacity > (SELECT COUNT(*) FROM enrollments WHERE section_id = :section)
-        AND s.freeze = FALSE
-        AND s.deleted = FALSE
-        """,
+        INSERT INTO enrollments (user_id, section_id, status, grade, date)
+        SELECT :user, sections.id, 'Enrolled', NULL, CURRENT_TIMESTAMP
+        FROM sections
+        WHERE
+            sections.id = :section
+            AND sections.capacity > sections.enrolled_count
+            AND sections.freeze = FALSE
+            AND sections.deleted = FALSE
+            AND EXISTS (SELECT 1 FROM users WHERE id = :user)
+            AND NOT EXISTS (
+                SELECT 1 FROM enrollments
+                WHERE user_id = :user AND section_id = :section
+            )
+            AND NOT EXISTS (%s)
+        RETURNING status
+        """
+        % database.schedule_conflicts_sql(":user", ":section"),
         d,
     )
-    if id:
-        # If there is space, enroll the student.
-        db.execute(
+    if enrolled:
+        result = "enrolled"
+    else:
+        # The section is full, or the request can't be admitted at all, in
+        # which case this finds no row either. Take the next ticket after the
+        # last one in the section.
+        ticket = fetch_row(
+            db,
             """
-            INSERT INTO enrollments (user_id, section_id, status, grade, date)
-            VALUES(:user, :section, 'Enrolled', NULL, CURRENT_TIMESTAMP)
-            """,
+            INSERT INTO waitlist (user_id, section_id, ticket, date)
+            SELECT
+                :user,
+                sections.id,
+                (
+                    SELECT COALESCE(MAX(ticket), 0) + 1
+                    FROM waitlist
+                    WHERE section_id = :section
+                ),
+                CURRENT_TIMESTAMP
+            FROM sections
+            WHERE
+                sections.id = :section
+                AND sections.waitlist_capacity > sections.waitlist_count
+                AND sections.freeze = FALSE
+                AND sections.deleted = FALSE
+                AND (SELECT waitlist_count FROM users WHERE id = :user)
+                    < :max_waitlists
+                AND NOT EXISTS (
+                    SELECT 1 FROM enrollments
+                    WHERE user_id = :user AND section_id = :section
+                )
+                AND NOT EXISTS (%s)
+            RETURNING ticket
+            """
+            % database.schedule_conflicts_sql(":user", ":section"),
             d,
         )
-    else:
-        # Otherwise, try to add them to the waitlist.
-        id = fetch_row(
+        if not ticket:
+            raise admission_error(db, d)
+        result = "waitlisted"
+
+        # The new entry is last in line, so its position is the size of the
+        # waitlist.
+        row = fetch_row(
             db,
+            "SELECT waitlist_count FROM sections WHERE id = :section",
+            d,
+        )
+        assert row
+        waitlist_position = row["sections.waitlist_count"]
+
+        # Ensure that there's also a waitlist enrollment.
+        db.execute(
             """
-            SELECT id
-            FROM sections as s
-            WHERE s.id = :section
-            AND s.waitlist_capacity > (SELECT COUNT(*) FROM waitlist WHERE section_id = :section)
-            AND (SELECT COUNT(*) FROM waitlist WHERE user_id = :user) < 3
-            AND s.freeze = FALSE
-            AND s.deleted = FALSE
+            INSERT INTO enrollments (user_id, section_id, status, grade, date)
+            VALUES(:user, :section, 'Waitlisted', NULL, CURRENT_TIMESTAMP)
             """,
             d,
         )
-        if id:
-            row = fetch_row(
-                db,
-                """
-                INSERT INTO waitlist (user_id, section_id, position, date)
-                VALUES(:user, :section, (SELECT COUNT(*) FROM waitlist WHERE section_id = :section), CURRENT_TIMESTAMP)
-                RETURNING position
-                """,
-                d,
-            )
 
-            # Read back the waitlist position.
-            assert row
-            waitlist_position = row["waitlist.position"]
-
-            # Ensure that there's also a waitlist enrollment.
-            db.execute(
-                """
-                INSERT INTO enrollments (user_id, section_id, status, grade, date)
-                VALUES(:user, :section, 'Waitlisted', NULL, CURRENT_TIMESTAMP)
-                """,
-                d,
-            )
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail="Section is full and waitlist is full.",
-            )
+    database.after_commit(db, lambda: metrics.enrollment_admissions.inc((result,)))
 
     enrollments = database.list_enrollments(db, [(d["user"], d["section"])])
     return CreateEnrollmentResponse(
@@ -374,11 +763,356 @@ def create_enrollment(
     )
 
 
+def admission_error(db: sqlite3.Connection, d: dict[str, Any]) -> HTTPException:
+    """
+    Explains why an enrollment was neither admitted nor waitlisted, in the
+    terms of the batch route's rejections, and counts the outcome.
+    """
+    row = fetch_row(
+        db,
+        """
+        SELECT
+            (SELECT waitlist_count FROM users WHERE id = :user),
+            (SELECT freeze FROM sections WHERE id = :section AND deleted = FALSE),
+            EXISTS (
+                SELECT 1 FROM enrollments
+                WHERE user_id = :user AND section_id = :section
+            ),
+            (%s LIMIT 1)
+        """
+        % database.schedule_conflicts_sql(":user", ":section"),
+        d,
+    )
+    assert row
+    waitlists, frozen, enrolled, conflict = row
+
+    if waitlists is None:
+        result, error = "not_found", HTTPException(404, "User not found.")
+    elif frozen is None:
+        result, error = "not_found", HTTPException(404, "Section not found.")
+    elif frozen:
+        result, error = "frozen", HTTPException(400, "Section is frozen.")
+    elif enrolled:
+        result = "duplicate"
+        error = HTTPException(409, "User is already enrolled in the section.")
+    elif conflict is not None:
+        result = "conflict"
+        error = HTTPException(
+            409, f"Section meets at the same time as section {conflict}."
+        )
+    elif waitlists >= d["max_waitlists"]:
+        result = "too_many_waitlists"
+        error = HTTPException(400, "User is on too many waitlists.")
+    else:
+        result = "full"
+        error = HTTPException(400, "Section is full and waitlist is full.")
+
+    metrics.enrollment_admissions.inc((result,))
+    return error
+
+
+@app.post("/enrollments")
+async def create_enrollments(
+    request: CreateEnrollmentsRequest,
+) -> list[CreateEnrollmentsResponseItem]:
+    return await get_writer().run(create_enrollments_txn, request)
+
+
+def create_enrollments_txn(
+    db: sqlite3.Connection,
+    request: CreateEnrollmentsRequest,
+) -> list[CreateEnrollmentsResponseItem]:
+    """
+    Enrolls or waitlists many users in many sections at once, as if each pair
+    had been requested in turn, and returns the result of each pair in order.
+
+    Every decision is made by a handful of statements over the whole batch.
+    Requests for a section are admitted in order while it has seats, and then
+    waitlisted in order while its waitlist has room. A user's waitlist limit
+    is applied before the section's waitlist capacity, so a request that is
+    turned away by a full waitlist may still have counted against the limit.
+    Likewise, a request whose section meets at the same time as one requested
+    earlier for the same user is rejected, even if the earlier one is only
+    waitlisted.
+    """
+    db.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS enrollment_batch (
+            seq INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            section_id INTEGER NOT NULL,
+            status TEXT,
+            reason TEXT,
+            ticket INTEGER,
+            position INTEGER
+        )
+        """
+    )
+    db.execute("DELETE FROM enrollment_batch")
+    db.executemany(
+        "INSERT INTO enrollment_batch (seq, user_id, section_id) VALUES (?, ?, ?)",
+        [(i, item.user, item.section) for i, item in enumerate(request.enrollments)],
+    )
+
+    # Reject the requests that can't be admitted whatever the section's room,
+    # keeping the first reason that applies to each. Each reason is counted
+    # under the same result as create_enrollment counts it.
+    rejections = [
+        ("User not found.", "not_found", "user_id NOT IN (SELECT id FROM users)"),
+        (
+            "Section not found.",
+            "not_found",
+            """
+            NOT EXISTS (
+                SELECT 1 FROM sections
+                WHERE
+                    sections.id = enrollment_batch.section_id
+                    AND sections.deleted = FALSE
+            )
+            """,
+        ),
+        (
+            "Section is frozen.",
+            "frozen",
+            """
+            EXISTS (
+                SELECT 1 FROM sections
+                WHERE
+                    sections.id = enrollment_batch.section_id
+                    AND sections.freeze = TRUE
+            )
+            """,
+        ),
+        (
+            "Duplicate request.",
+            "duplicate",
+            """
+            seq NOT IN (
+                SELECT MIN(seq) FROM enrollment_batch GROUP BY user_id, section_id
+            )
+            """,
+        ),
+        (
+            "User is already enrolled in the section.",
+            "duplicate",
+            """
+            EXISTS (
+                SELECT 1 FROM enrollments
+                WHERE
+                    enrollments.user_id = enrollment_batch.user_id
+                    AND enrollments.section_id = enrollment_batch.section_id
+            )
+            """,
+        ),
+        (
+            "Section meets at the same time as one the user is enrolled in.",
+            "conflict",
+            "EXISTS (%s)"
+            % database.schedule_conflicts_sql(
+                "enrollment_batch.user_id", "enrollment_batch.section_id"
+            ),
+        ),
+        (
+            "Section meets at the same time as one requested for the user "
+            "earlier in the batch.",
+            "conflict",
+            """
+            EXISTS (
+                SELECT 1
+                FROM enrollment_batch AS earlier
+                INNER JOIN sections AS target
+                    ON target.id = enrollment_batch.section_id
+                INNER JOIN sections AS other ON other.id = earlier.section_id
+                WHERE
+                    earlier.user_id = enrollment_batch.user_id
+                    AND earlier.seq < enrollment_batch.seq
+                    AND earlier.reason IS NULL
+                    AND other.id != target.id
+                    AND other.meeting_start < target.meeting_end
+                    AND other.meeting_end > target.meeting_start
+            )
+            """,
+        ),
+    ]
+    too_many_waitlists = "User is on too many waitlists."
+    full = "Section is full and waitlist is full."
+    reason_results = {reason: result for reason, result, _ in rejections}
+    reason_results[too_many_waitlists] = "too_many_waitlists"
+    reason_results[full] = "full"
+
+    for reason, _, condition in rejections:
+        db.execute(
+            f"""
+            UPDATE enrollment_batch SET reason = :reason
+            WHERE reason IS NULL AND {condition}
+            """,
+            {"reason": reason},
+        )
+
+    # Enroll the first requests for each section, up to its free seats.
+    db.execute(
+        """
+        UPDATE enrollment_batch SET status = 'Enrolled'
+        FROM (
+            SELECT
+                enrollment_batch.seq,
+                ROW_NUMBER() OVER (
+                    PARTITION BY enrollment_batch.section_id
+                    ORDER BY enrollment_batch.seq
+                ) AS rank,
+                sections.capacity - sections.enrolled_count AS seats
+            FROM enrollment_batch
+            INNER JOIN sections ON sections.id = enrollment_batch.section_id
+            WHERE enrollment_batch.reason IS NULL
+        ) AS ranked
+        WHERE enrollment_batch.seq = ranked.seq AND ranked.rank <= ranked.seats
+        """
+    )
+
+    # The rest will be waitlisted, unless that would put their user on too
+    # many waitlists.
+    db.execute(
+        """
+        UPDATE enrollment_batch SET reason = :reason
+        FROM (
+            SELECT
+                enrollment_batch.seq,
+                users.waitlist_count + ROW_NUMBER() OVER (
+                    PARTITION BY enrollment_batch.user_id
+                    ORDER BY enrollment_batch.seq
+                ) AS waitlists
+            FROM enrollment_batch
+            INNER JOIN users ON users.id = enrollment_batch.user_id
+            WHERE
+                enrollment_batch.reason IS NULL
+                AND enrollment_batch.status IS NULL
+        ) AS ranked
+        WHERE
+            enrollment_batch.seq = ranked.seq
+            AND ranked.waitlists > :max_waitlists
+        """,
+        {"max_waitlists": MAX_WAITLISTS, "reason": too_many_waitlists},
+    )
+
+    # Waitlist the remaining requests for each section, up to the room on its
+    # waitlist, with tickets following the section's last one.
+    db.execute(
+        """
+        UPDATE enrollment_batch
+        SET
+            status = 'Waitlisted',
+            ticket = ranked.last_ticket + ranked.rank,
+            position = ranked.waitlist_count + ranked.rank
+        FROM (
+            SELECT
+                enrollment_batch.seq,
+                ROW_NUMBER() OVER (
+                    PARTITION BY enrollment_batch.section_id
+                    ORDER BY enrollment_batch.seq
+                ) AS rank,
+                sections.waitlist_capacity - sections.waitlist_count AS room,
+                sections.waitlist_count,
+                (
+                    SELECT COALESCE(MAX(ticket), 0) FROM waitlist
+                    WHERE waitlist.section_id = enrollment_batch.section_id
+                ) AS last_ticket
+            FROM enrollment_batch
+            INNER JOIN sections ON sections.id = enrollment_batch.section_id
+            WHERE
+                enrollment_batch.reason IS NULL
+                AND enrollment_batch.status IS NULL
+        ) AS ranked
+        WHERE enrollment_batch.seq = ranked.seq AND ranked.rank <= ranked.room
+        """
+    )
+    db.execute(
+        """
+        UPDATE enrollment_batch SET reason = :reason
+        WHERE reason IS NULL AND status IS NULL
+        """,
+        {"reason": full},
+    )
+
+    db.execute(
+        """
+        INSERT INTO enrollments (user_id, section_id, status, grade, date)
+        SELECT user_id, section_id, status, NULL, CURRENT_TIMESTAMP
+        FROM enrollment_batch
+        WHERE status IS NOT NULL
+        ORDER BY seq
+        """
+    )
+    db.execute(
+        """
+        INSERT INTO waitlist (user_id, section_id, ticket, date)
+        SELECT user_id, section_id, ticket, CURRENT_TIMESTAMP
+        FROM enrollment_batch
+        WHERE status = 'Waitlisted'
+        ORDER BY seq
+        """
+    )
+
+    rows = fetch_rows(db, "SELECT * FROM enrollment_batch ORDER BY seq")
+    db.execute("DELETE FROM enrollment_batch")
+
+    outcomes = collections.Counter(
+        (
+            row["enrollment_batch.status"].lower()
+            if row["enrollment_batch.status"] is not None
+            else reason_results[row["enrollment_batch.reason"]]
+        )
+        for row in rows
+    )
+
+    def count_outcomes():
+        for result, n in outcomes.items():
+            metrics.enrollment_admissions.inc((result,), n)
+
+    database.after_commit(db, count_outcomes)
+
+    admitted = [
+        (row["enrollment_batch.user_id"], row["enrollment_batch.section_id"])
+        for row in rows
+        if row["enrollment_batch.status"] is not None
+    ]
+    enrollments = {
+        (enrollment.user.id, enrollment.section.id): enrollment
+        for enrollment in database.list_enrollments(db, admitted)
+    }
+
+    results = []
+    for row in rows:
+        pair = (row["enrollment_batch.user_id"], row["enrollment_batch.section_id"])
+        status = row["enrollment_batch.status"]
+        results.append(
+            CreateEnrollmentsResponseItem(
+                user=pair[0],
+                section=pair[1],
+                result=(
+                    CreateEnrollmentsResult(status)
+                    if status is not None
+                    else CreateEnrollmentsResult.REJECTED
+                ),
+                reason=row["enrollment_batch.reason"],
+                waitlist_position=row["enrollment_batch.position"],
+                enrollment=enrollments[pair] if status is not None else None,
+            )
+        )
+    return results
+
+
 @app.post("/courses")
-def add_course(
+async def add_course(
     course: AddCourseRequest,
-    db: sqlite3.Connection = Depends(get_db),
 ) -> Course:
+    return await get_writer().run(add_course_txn, course)
+
+
+def add_course_txn(
+    db: sqlite3.Connection,
+    course: AddCourseRequest,
+) -> Course:
+    since = database.catalog_version(db)
     try:
         row = fetch_row(
             db,
@@ -390,40 +1124,67 @@ def add_course(
             dict(course),
         )
         assert row
+        invalidate_catalog(db, since, "courses")
         courses = database.list_courses(db, [row["courses.id"]])
         return courses[0]
-    except Exception:
+    except sqlite3.IntegrityError:
         raise HTTPException(status_code=409, detail=f"Failed to add course:")
 
 
 @app.post("/sections")
-def add_section(
+async def add_section(
     section: AddSectionRequest,
-    db: sqlite3.Connection = Depends(get_db),
 ) -> Section:
+    return await get_writer().run(add_section_txn, section)
+
+
+def add_section_txn(
+    db: sqlite3.Connection,
+    section: AddSectionRequest,
+) -> Section:
+    since = database.catalog_version(db)
     try:
         row = fetch_row(
             db,
             """
             INSERT INTO sections(course_id, classroom, capacity, waitlist_capacity, day, begin_time, end_time, freeze, instructor_id)
             VALUES(:course_id, :classroom, :capacity, :waitlist_capacity, :day, :begin_time, :end_time, :freeze, :instructor_id)
-            RETURNING id
+            RETURNING id, meeting_start, meeting_end
             """,
             dict(section),
         )
-        assert row
-        sections = database.list_sections(db, [row["sections.id"]])
-        return sections[0]
     except Exception:
         raise HTTPException(status_code=409, detail=f"Failed to add course:")
 
+    # The meeting columns are NULL if the day or times can't be parsed.
+    assert row
+    start, end = row["sections.meeting_start"], row["sections.meeting_end"]
+    if start is None or end is None:
+        raise HTTPException(
+            status_code=400, detail="Can't parse the section's day and times."
+        )
+    if end <= start:
+        raise HTTPException(status_code=400, detail="Section ends before it begins.")
+
+    invalidate_catalog(db, since, "sections")
+    sections = database.list_sections(db, [row["sections.id"]])
+    return sections[0]
+
 
 @app.patch("/sections/{section_id}")
-def update_section(
+async def update_section(
+    section_id: int,
+    section: UpdateSectionRequest,
+) -> Section:
+    return await get_writer().run(update_section_txn, section_id, section)
+
+
+def update_section_txn(
+    db: sqlite3.Connection,
     section_id: int,
     section: UpdateSectionRequest,
-    db: sqlite3.Connection = Depends(get_db),
 ) -> Section:
+    since = database.catalog_version(db)
     q = """
     UPDATE sections
     SET
@@ -448,21 +1209,35 @@ def update_section(
     v["section_id"] = section_id
 
     try:
-        db.execute(q, v)
+        cursor = db.execute(q, v)
     except Exception as e:
         raise HTTPException(status_code=409, detail=f"Failed to update section:{e}")
+    if cursor.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Section not found")
 
+    # More seats, or a section that no longer turns students away, may let
+    # some off its waitlist.
+    if section.capacity is not None or section.freeze is False:
+        request_promotion(db, section_id)
+    invalidate_catalog(db, since, "sections", f"section:{section_id}")
     sections = database.list_sections(db, [section_id])
     return sections[0]
 
 
 @app.delete("/users/{user_id}/enrollments/{section_id}")
-def drop_user_enrollment(
+async def drop_user_enrollment(
     user_id: int,
     section_id: int,
-    db: sqlite3.Connection = Depends(get_db),
 ) -> Enrollment:
-    db.execute(
+    return await get_writer().run(drop_user_enrollment_txn, user_id, section_id)
+
+
+def drop_user_enrollment_txn(
+    db: sqlite3.Connection,
+    user_id: int,
+    section_id: int,
+) -> Enrollment:
+    cursor = db.execute(
         """
         UPDATE enrollments
         SET status = 'Dropped'
@@ -473,18 +1248,33 @@ def drop_user_enrollment(
         """,
         {"user_id": user_id, "section_id": section_id},
     )
+    if cursor.rowcount > 0:
+        request_promotion(db, section_id)
 
     enrollments = database.list_enrollments(db, [(user_id, section_id)])
+    if not enrollments:
+        raise HTTPException(
+            status_code=404,
+            detail="User is not enrolled in the section.",
+        )
     return enrollments[0]
 
 
 @app.delete("/users/{user_id}/waitlist/{section_id}")
-def drop_user_waitlist(
+async def drop_user_waitlist(
+    user_id: int,
+    section_id: int,
+):
+    return await get_writer().run(drop_user_waitlist_txn, user_id, section_id)
+
+
+def drop_user_waitlist_txn(
+    db: sqlite3.Connection,
     user_id: int,
     section_id: int,
-    db: sqlite3.Connection = Depends(get_db),
 ):
-    # Delete the entry from the waitlist, storing the position.
+    # Delete the entry from the waitlist. Positions are computed from the
+    # remaining tickets, so nothing else needs to change.
     row = fetch_row(
         db,
         """
@@ -492,7 +1282,7 @@ def drop_user_waitlist(
         WHERE
             user_id = :user_id
             AND section_id = :section_id
-        RETURNING position
+        RETURNING ticket
         """,
         {"user_id": user_id, "section_id": section_id},
     )
@@ -502,20 +1292,6 @@ def drop_user_waitlist(
             detail="User is not on the waitlist.",
         )
 
-    position = row["waitlist.position"]
-
-    # Ensure that every waitlist entry after this one has its position decremented.
-    db.execute(
-        """
-        UPDATE waitlist
-        SET position = position - 1
-        WHERE
-            section_id = :section_id
-            AND position > :position
-        """,
-        {"section_id": section_id, "position": position},
-    )
-
     # Delete the waitlist enrollment.
     db.execute(
         """
@@ -530,56 +1306,118 @@ def drop_user_waitlist(
 
 
 @app.delete("/sections/{section_id}/enrollments/{user_id}")
-def drop_section_enrollment(
+async def drop_section_enrollment(
     section_id: int,
     user_id: int,
-    db: sqlite3.Connection = Depends(get_db),
 ) -> Enrollment:
     # No auth so these two methods behave virtually identically.
-    return drop_user_enrollment(user_id, section_id, db)
+    return await get_writer().run(drop_user_enrollment_txn, user_id, section_id)
 
 
 @app.delete("/sections/{section_id}")
-def delete_section(section_id: int, db: sqlite3.Connection = Depends(get_db)):
-    # check validity of section_id
-    get_section(section_id, db)
+async def delete_section(section_id: int) -> DeleteSectionResponse:
+    return await get_writer().run(delete_section_txn, section_id)
 
-    # mark section as deleted
-    db.execute(
+
+def delete_section_txn(
+    db: sqlite3.Connection,
+    section_id: int,
+) -> DeleteSectionResponse:
+    since = database.catalog_version(db)
+    d = {"section_id": section_id}
+
+    # Mark the section as deleted.
+    row = fetch_row(
+        db,
         """
         UPDATE sections
         SET deleted = TRUE
         WHERE id = :section_id
+        RETURNING id
         """,
-        {"section_id": section_id},
+        d,
     )
+    if row is None:
+        raise HTTPException(status_code=404, detail="Section not found")
+    invalidate_catalog(db, since, "sections", f"section:{section_id}")
 
-    # drop enrolled users
-    ue = fetch_rows(
+    # Drop every enrolled user at once.
+    dropped = fetch_rows(
         db,
-        f"""
-        SELECT user_id FROM enrollments
-        WHERE 
+        """
+        UPDATE enrollments
+        SET status = 'Dropped'
+        WHERE
             section_id = :section_id
+            AND status = 'Enrolled'
+        RETURNING user_id
         """,
-        {"section_id": section_id},
+        d,
     )
-    for u in ue:
-        print(u)
-        drop_user_enrollment(u[0], section_id, db)
 
-    # drop waitlisted users
-    uw = fetch_rows(
+    # Empty the waitlist, along with its waitlist enrollments.
+    unwaitlisted = fetch_rows(
         db,
-        f"""
-        SELECT user_id FROM waitlist
-        WHERE 
+        """
+        DELETE FROM waitlist
+        WHERE section_id = :section_id
+        RETURNING user_id
+        """,
+        d,
+    )
+    db.execute(
+        """
+        DELETE FROM enrollments
+        WHERE
             section_id = :section_id
+            AND status = 'Waitlisted'
         """,
-        {"section_id": section_id},
+        d,
+    )
+
+    return DeleteSectionResponse(
+        section=section_id,
+        dropped=sorted(row[0] for row in dropped),
+        unwaitlisted=sorted(row[0] for row in unwaitlisted),
+    )
+
+
+@app.get("/stats/pools")
+async def get_pool_stats() -> dict[str, database.PoolStats]:
+    return {
+        "read_write": database.get_pool().stats(),
+        "read_only": database.get_pool(read_only=True).stats(),
+        "stream": database.get_stream_pool().stats(),
+    }
+
+
+@app.get("/stats/writer")
+async def get_writer_stats() -> WriterStats:
+    return get_writer().stats()
+
+
+@app.get("/stats/promotions")
+async def get_promotion_stats() -> promotion.PromoterStats:
+    promoter = promotion.get_promoter()
+    if promoter is None:
+        raise HTTPException(status_code=503, detail="The promoter has stopped.")
+    return promoter.stats()
+
+
+@app.get("/stats/cache")
+async def get_cache_stats() -> cache.CacheStats:
+    return catalog_cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> str:
+    """
+    Request and SQL statement metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(
+        metrics.render(),
+        media_type="text/plain; version=0.0.4",
     )
-    for u in uw:
-        drop_user_waitlist(u[0], section_id, db)
 
 
 # https://fastapi.tiangolo.com/advanced/path-operation-advanced-configuration/#using-the-path-operation-function-name-as-the-operationid
@@ -0,0 +1,100 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import sqlite3
+import threading
+from typing import Any, Callable, TypeVar
+
+import database
+from models import *
+
+# The number of threads that run SQLite calls for async routes. This bounds
+# the number of queries in flight at once, not the number of requests. It must
+# not exceed the size of the read-only pool, which only these threads use while
+# a call runs, so a thread never waits for a connection. Streamed responses,
+# which hold a connection while they wait on their clients, have a pool of
+# their own (database.get_stream_pool).
+SQLITE_EXECUTOR_THREADS = 16
+
+T = TypeVar("T")
+
+_executor: concurrent.futures.ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Returns the executor for SQLite calls, creating it on first use with
+    SQLITE_EXECUTOR_THREADS threads.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if SQLITE_EXECUTOR_THREADS > database.SQLITE_POOL_SIZE:
+                raise ValueError(
+                    "SQLITE_EXECUTOR_THREADS must not exceed SQLITE_POOL_SIZE"
+                )
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=SQLITE_EXECUTOR_THREADS,
+                thread_name_prefix="sqlite",
+            )
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def run_with_connection(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    with database.get_pool(read_only=True).connection() as db:
+        return fn(db, *args, **kwargs)
+
+
+async def run(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs fn(db, *args, **kwargs) on the executor with a pooled read-only
+    connection, which is returned to the pool before this completes, so no
+    connection is held while a request awaits anything else. Reads that must
+    see a consistent view of the database belong in one call.
+    """
+    loop = asyncio.get_running_loop()
+    # Like asyncio.to_thread, run in a copy of the caller's context, so that
+    # the queries are attributed to its request.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor(),
+        functools.partial(context.run, run_with_connection, fn, *args, **kwargs),
+    )
+
+
+async def fetch_rows(sql: str, params: Any = None) -> list[sqlite3.Row]:
+    return await run(database.fetch_rows, sql, params)
+
+
+async def fetch_row(sql: str, params: Any = None) -> sqlite3.Row | None:
+    return await run(database.fetch_row, sql, params)
+
+
+async def list_users(**kwargs: Any) -> database.Page[User]:
+    return await run(database.list_users, **kwargs)
+
+
+async def list_courses(*args: Any, **kwargs: Any) -> database.Page[Course]:
+    return await run(database.list_courses, *args, **kwargs)
+
+
+async def list_sections(*args: Any, **kwargs: Any) -> database.Page[Section]:
+    return await run(database.list_sections, *args, **kwargs)
+
+
+async def list_enrollments(*args: Any, **kwargs: Any) -> database.Page[Enrollment]:
+    return await run(database.list_enrollments, *args, **kwargs)
+
+
+async def list_waitlist(*args: Any, **kwargs: Any) -> database.Page[Waitlist]:
+    return await run(database.list_waitlist, *args, **kwargs)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Compares the throughput of the async routes in api.py against sync versions
+of the same routes, which hold one of Starlette's threadpool threads for the
+whole request, at increasing numbers of concurrent clients.
+
+Each app is served by uvicorn in its own process, against a scratch database
+with a few thousand enrollments.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import httpx
+import uvicorn
+from fastapi import Depends, FastAPI, HTTPException
+
+import database
+from check_query_plans import create_scratch_database
+from database import get_readonly_db
+from models import *
+from model_requests import *
+
+STUDENTS = 2000
+
+sync_app = FastAPI()
+
+
+@sync_app.get("/users/{user_id}")
+def get_user(
+    user_id: int,
+    db: sqlite3.Connection = Depends(get_readonly_db),
+) -> User:
+    user = database.fetch_row(db, "SELECT * FROM users WHERE id = ?", (user_id,))
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return User(**database.extract_row(user, "users"))
+
+
+@sync_app.get("/users/{user_id}/enrollments")
+def list_user_enrollments(
+    user_id: int,
+    db: sqlite3.Connection = Depends(get_readonly_db),
+) -> list[Enrollment]:
+    return database.list_enrollments(
+        db,
+        user_id=user_id,
+        status=EnrollmentStatus.ENROLLED,
+        deleted=False,
+    )
+
+
+@sync_app.get("/sections/{section_id}/waitlist")
+def list_section_waitlist(
+    section_id: int,
+    db: sqlite3.Connection = Depends(get_readonly_db),
+) -> list[ListSectionWaitlistItem]:
+    waitlist = database.list_waitlist(db, section_id=section_id, deleted=False)
+    return [ListSectionWaitlistItem(**dict(item)) for item in waitlist]
+
+
+def create_database(path: str):
+    create_scratch_database(path)
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE sections SET capacity = capacity + :n", {"n": STUDENTS})
+    for i in range(STUDENTS):
+        user_id = conn.execute(
+            """
+            INSERT INTO users (first_name, last_name, role)
+            VALUES (:first, 'Student', 'Student')
+            RETURNING id
+            """,
+            {"first": f"Student{i}"},
+        ).fetchone()[0]
+        conn.executemany(
+            """
+            INSERT INTO enrollments (user_id, section_id, status, grade, date)
+            VALUES (?, ?, 'Enrolled', NULL, CURRENT_TIMESTAMP)
+            """,
+            [(user_id, section_id) for section_id in (1, 2, 3)],
+        )
+    conn.commit()
+    conn.close()
+
+
+def serve(app: str, path: str, port: int):
+    database.SQLITE_DATABASE = path
+    if app == "sync":
+        target = sync_app
+    else:
+        import api
+
+        target = api.app
+    uvicorn.run(target, host="127.0.0.1", port=port, log_level="warning")
+
+
+def random_url(users: int) -> str:
+    kind = random.random()
+    if kind < 0.4:
+        return f"/users/{random.randint(1, users)}"
+    if kind < 0.8:
+        return f"/users/{random.randint(1, users)}/enrollments"
+    return f"/sections/{random.randint(1, 4)}/waitlist"
+
+
+async def load(base_url: str, concurrency: int, seconds: float, users: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client(http: httpx.AsyncClient):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await http.get(random_url(users))
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "concurrency": concurrency,
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(quantiles[49] * 1000, 2),
+        "p99_ms": round(quantiles[98] * 1000, 2),
+        "errors": errors,
+    }
+
+
+def wait_until_ready(base_url: str):
+    for _ in range(100):
+        try:
+            httpx.get(base_url + "/users/1")
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="benchmarks/concurrency.py",
+        description="Benchmark async routes against sync routes under load",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        help="Comma-separated numbers of concurrent clients",
+        default="1,16,64,256",
+    )
+    parser.add_argument(
+        "-s", "--seconds", help="Seconds per run", type=float, default=5
+    )
+    parser.add_argument("--port", help="Port to serve on", type=int, default=5099)
+    parser.add_argument("--serve", help=argparse.SUPPRESS, choices=["sync", "async"])
+    parser.add_argument("--database", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.database, args.port)
+        return
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "database.db")
+        create_database(path)
+        users = sqlite3.connect(path).execute("SELECT MAX(id) FROM users").fetchone()[0]
+
+        for app in ["sync", "async"]:
+            server = subprocess.Popen(
+                [
+                    sys.executable,
+                    __file__,
+                    "--serve",
+                    app,
+                    "--database",
+                    path,
+                    "--port",
+                    str(args.port),
+                ]
+            )
+            try:
+                wait_until_ready(base_url)
+                for concurrency in args.concurrency.split(","):
+                    result = asyncio.run(
+                        load(base_url, int(concurrency), args.seconds, users)
+                    )
+                    results.append({"app": app, **result})
+                    print(json.dumps(results[-1]), file=sys.stderr)
+            finally:
+                server.terminate()
+                server.wait()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Generates a database of a chosen size with random but reproducible data, for
+benchmarking the API at a realistic scale.
+
+Sections are filled in random order until every student has the requested
+number of enrollments or every section is full, and full sections then get
+waitlists of the requested depth.
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+from typing import Any, Iterator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import schema_init
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+TIMES = [("8am", "9:15am"), ("10am", "11:15am"), ("1pm", "2:15pm"), ("7pm", "9:45pm")]
+
+
+def generate(
+    path: str,
+    users: int = 10000,
+    departments: int = 20,
+    courses: int = 500,
+    sections_per_course: int = 3,
+    enrollments_per_user: int = 4,
+    capacity: int = 30,
+    waitlist_capacity: int = 15,
+    waitlist_depth: int = 5,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """
+    Creates a database at path and fills it, returning a summary of what was
+    generated. One user in twenty is an instructor, and the rest are students.
+    """
+    rng = random.Random(seed)
+    with open(os.path.join(ROOT, "schema.sql"), "r") as f:
+        schema_init.create_database(path, f.read())
+
+    instructors = list(range(1, max(1, users // 20) + 1))
+    students = list(range(len(instructors) + 1, users + 1))
+    sections = courses * sections_per_course
+
+    # Seats are handed out up front, so that the enrollment and waitlist rows
+    # can be streamed straight into the import.
+    seats = {section: capacity for section in range(1, sections + 1)}
+    enrolled: dict[int, set[int]] = {student: set() for student in students}
+    open_sections = list(seats)
+    for student in students:
+        for _ in range(enrollments_per_user):
+            while open_sections:
+                i = rng.randrange(len(open_sections))
+                section = open_sections[i]
+                if seats[section] == 0:
+                    open_sections[i] = open_sections[-1]
+                    open_sections.pop()
+                    continue
+                if section not in enrolled[student]:
+                    enrolled[student].add(section)
+                    seats[section] -= 1
+                break
+
+    waitlisted: dict[int, list[int]] = {}
+    waitlists = {student: 0 for student in students}
+    full = [section for section, free in seats.items() if free == 0]
+    depth = min(waitlist_depth, waitlist_capacity)
+    for section in full:
+        candidates = rng.sample(students, min(len(students), depth * 4))
+        line = []
+        for student in candidates:
+            if len(line) == depth:
+                break
+            if section not in enrolled[student] and waitlists[student] < 3:
+                line.append(student)
+                waitlists[student] += 1
+        waitlisted[section] = line
+
+    def user_records() -> Iterator[dict]:
+        for id in range(1, users + 1):
+            yield {
+                "id": id,
+                "first_name": rng.choice(["Ada", "Alan", "Grace", "Linus", "Barbara"]),
+                "last_name": f"User{id}",
+                "role": "Instructor" if id <= len(instructors) else "Student",
+            }
+
+    def section_records() -> Iterator[dict]:
+        for id in range(1, sections + 1):
+            begin_time, end_time = rng.choice(TIMES)
+            yield {
+                "id": id,
+                "course_id": (id - 1) // sections_per_course + 1,
+                "classroom": f"CS{100 + id % 400}",
+                "capacity": capacity,
+                "waitlist_capacity": waitlist_capacity,
+                "day": rng.choice(DAYS),
+                "begin_time": begin_time,
+                "end_time": end_time,
+                "instructor_id": rng.choice(instructors),
+                "freeze": False,
+            }
+
+    def enrollment_records() -> Iterator[dict]:
+        for student, student_sections in enrolled.items():
+            for section in sorted(student_sections):
+                yield {
+                    "user_id": student,
+                    "section_id": section,
+                    "status": "Enrolled",
+                    "grade": None,
+                }
+        for section, line in waitlisted.items():
+            for student in line:
+                yield {
+                    "user_id": student,
+                    "section_id": section,
+                    "status": "Waitlisted",
+                    "grade": None,
+                }
+
+    def waitlist_records() -> Iterator[dict]:
+        for section, line in waitlisted.items():
+            for ticket, student in enumerate(line, 1):
+                yield {"user_id": student, "section_id": section, "ticket": ticket}
+
+    conn = sqlite3.connect(path)
+    conn.executescript(schema_init.IMPORT_PRAGMA)
+    schema_init.import_records(
+        conn,
+        "departments",
+        ({"id": id, "name": f"Department {id}"} for id in range(1, departments + 1)),
+    )
+    schema_init.import_records(conn, "users", user_records())
+    schema_init.import_records(
+        conn,
+        "courses",
+        (
+            {
+                "id": id,
+                "code": f"CPSC {100 + id}",
+                "name": f"Course {id}",
+                "department_id": (id - 1) % departments + 1,
+            }
+            for id in range(1, courses + 1)
+        ),
+    )
+    schema_init.import_records(conn, "sections", section_records())
+    schema_init.import_records(conn, "enrollments", enrollment_records())
+    schema_init.import_records(conn, "waitlist", waitlist_records())
+    conn.close()
+
+    return {
+        "users": users,
+        "instructors": len(instructors),
+        "departments": departments,
+        "courses": courses,
+        "sections": sections,
+        "enrolled": sum(len(s) for s in enrolled.values()),
+        "full_sections": len(full),
+        "waitlisted": sum(len(line) for line in waitlisted.values()),
+        "seed": seed,
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--departments", type=int, default=20)
+    parser.add_argument("--courses", type=int, default=500)
+    parser.add_argument("--sections-per-course", type=int, default=3)
+    parser.add_argument(
+        "--enrollments-per-user",
+        help="Sections each student tries to enroll in",
+        type=int,
+        default=4,
+    )
+    parser.add_argument("--capacity", type=int, default=30)
+    parser.add_argument("--waitlist-capacity", type=int, default=15)
+    parser.add_argument(
+        "--waitlist-depth",
+        help="Students waitlisted in each full section",
+        type=int,
+        default=5,
+    )
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def generate_from_arguments(path: str, args: argparse.Namespace) -> dict[str, Any]:
+    return generate(
+        path,
+        users=args.users,
+        departments=args.departments,
+        courses=args.courses,
+        sections_per_course=args.sections_per_course,
+        enrollments_per_user=args.enrollments_per_user,
+        capacity=args.capacity,
+        waitlist_capacity=args.waitlist_capacity,
+        waitlist_depth=args.waitlist_depth,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="benchmarks/generate.py",
+        description="Generate a database of random data",
+    )
+    parser.add_argument("file", help="SQLite database file to create")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if os.path.exists(args.file):
+        print("Database file already exists.")
+        exit(1)
+    print(json.dumps(generate_from_arguments(args.file, args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
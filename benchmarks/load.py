@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Runs a scripted mix of traffic against api.app in-process and reports the
+throughput and latency of each endpoint as JSON, so that runs can be compared
+between commits.
+
+The database is generated by benchmarks/generate.py, or copied from an
+existing file, so the run never changes it. Both the data and the sequence of
+requests are determined by the seed, and the same arguments replay the same
+requests in the same order.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import httpx
+
+import async_database
+import database
+import generate
+import promotion
+import writer
+
+
+@dataclass
+class Dataset:
+    users: int
+    instructors: int
+    courses: int
+    sections: int
+
+    def student(self, rng: random.Random) -> int:
+        return rng.randint(self.instructors + 1, self.users)
+
+    def course(self, rng: random.Random) -> int:
+        return rng.randint(1, self.courses)
+
+    def section(self, rng: random.Random) -> int:
+        return rng.randint(1, self.sections)
+
+
+@dataclass
+class Call:
+    endpoint: str
+    method: str
+    url: str
+    json: Any = None
+
+
+# A scenario is a list of weighted functions, each of which makes a random
+# call to one endpoint.
+Scenario = list[tuple[float, Callable[[random.Random, Dataset], Call]]]
+
+
+def get(endpoint: str, url: str) -> Call:
+    return Call(endpoint, "GET", url)
+
+
+SCENARIOS: dict[str, Scenario] = {
+    # Registration opens: students enroll, check what they got, and drop.
+    "registration": [
+        (
+            40,
+            lambda rng, d: Call(
+                "POST /users/{user_id}/enrollments",
+                "POST",
+                f"/users/{d.student(rng)}/enrollments",
+                {"section": d.section(rng)},
+            ),
+        ),
+        (
+            10,
+            lambda rng, d: Call(
+                "DELETE /users/{user_id}/enrollments/{section_id}",
+                "DELETE",
+                f"/users/{d.student(rng)}/enrollments/{d.section(rng)}",
+            ),
+        ),
+        (
+            20,
+            lambda rng, d: get(
+                "GET /users/{user_id}/enrollments",
+                f"/users/{d.student(rng)}/enrollments",
+            ),
+        ),
+        (
+            15,
+            lambda rng, d: get(
+                "GET /users/{user_id}/waitlist",
+                f"/users/{d.student(rng)}/waitlist",
+            ),
+        ),
+        (
+            15,
+            lambda rng, d: get(
+                "GET /sections/{section_id}", f"/sections/{d.section(rng)}"
+            ),
+        ),
+    ],
+    # An ordinary day: students browse the catalog and their schedules.
+    "browse": [
+        (
+            10,
+            lambda rng, d: get("GET /courses", "/courses?limit=50"),
+        ),
+        (
+            20,
+            lambda rng, d: get("GET /courses/{course_id}", f"/courses/{d.course(rng)}"),
+        ),
+        (
+            15,
+            lambda rng, d: get(
+                "GET /sections?course_id=", f"/sections?course_id={d.course(rng)}"
+            ),
+        ),
+        (
+            20,
+            lambda rng, d: get(
+                "GET /sections/{section_id}", f"/sections/{d.section(rng)}"
+            ),
+        ),
+        (
+            25,
+            lambda rng, d: get(
+                "GET /users/{user_id}/sections",
+                f"/users/{d.student(rng)}/sections",
+            ),
+        ),
+        (
+            10,
+            lambda rng, d: get(
+                "GET /sections/{section_id}/waitlist",
+                f"/sections/{d.section(rng)}/waitlist",
+            ),
+        ),
+    ],
+    # Instructors review their rosters and manage their sections.
+    "instructor": [
+        (
+            40,
+            lambda rng, d: get(
+                "GET /sections/{section_id}/enrollments",
+                f"/sections/{d.section(rng)}/enrollments",
+            ),
+        ),
+        (
+            30,
+            lambda rng, d: get(
+                "GET /sections/{section_id}/waitlist",
+                f"/sections/{d.section(rng)}/waitlist",
+            ),
+        ),
+        (
+            20,
+            lambda rng, d: get(
+                "GET /courses/{course_id}/waitlist",
+                f"/courses/{d.course(rng)}/waitlist",
+            ),
+        ),
+        (
+            5,
+            lambda rng, d: Call(
+                "PATCH /sections/{section_id}",
+                "PATCH",
+                f"/sections/{d.section(rng)}",
+                {"freeze": rng.random() < 0.5, "instructor_id": None},
+            ),
+        ),
+        (
+            5,
+            lambda rng, d: Call(
+                "DELETE /sections/{section_id}/enrollments/{user_id}",
+                "DELETE",
+                f"/sections/{d.section(rng)}/enrollments/{d.student(rng)}",
+            ),
+        ),
+    ],
+}
+
+
+def make_calls(scenario: Scenario, dataset: Dataset, count: int, seed: int):
+    rng = random.Random(seed)
+    weights = [weight for weight, _ in scenario]
+    makers = [make for _, make in scenario]
+    return [rng.choices(makers, weights)[0](rng, dataset) for _ in range(count)]
+
+
+def summarize(latencies: list[float], statuses: dict[int, int], elapsed: float):
+    """
+    Server errors are counted as errors, as are requests that got no response
+    at all, which are listed under status 0. Client errors are expected, since
+    random calls ask for enrollments that are full or do not exist.
+    """
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    else:
+        quantiles = latencies * 99
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "errors": sum(
+            n for status, n in statuses.items() if status >= 500 or status == 0
+        ),
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(quantiles[49] * 1000, 3),
+        "p95_ms": round(quantiles[94] * 1000, 3),
+        "p99_ms": round(quantiles[98] * 1000, 3),
+    }
+
+
+async def run_calls(
+    calls: list[Call],
+    concurrency: int,
+    base_url: str | None = None,
+) -> dict[str, Any]:
+    """
+    Makes the calls from concurrency clients at once, against api.app
+    in-process, or against the server at base_url if one is given.
+    """
+    latencies: dict[str, list[float]] = defaultdict(list)
+    statuses: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    pending = iter(calls)
+
+    async def client(http: httpx.AsyncClient):
+        for call in pending:
+            start = time.perf_counter()
+            try:
+                response = await http.request(call.method, call.url, json=call.json)
+                status = response.status_code
+            except httpx.TransportError:
+                # uvicorn closes the connection after an unhandled exception,
+                # which can cut off a request already sent on it.
+                status = 0
+            latencies[call.endpoint].append(time.perf_counter() - start)
+            statuses[call.endpoint][status] += 1
+
+    if base_url is None:
+        import api
+
+        http = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=api.app, raise_app_exceptions=False),
+            base_url="http://bench",
+        )
+    else:
+        http = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=concurrency),
+            timeout=60,
+        )
+    async with http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    total: dict[int, int] = defaultdict(int)
+    for endpoint_statuses in statuses.values():
+        for status, n in endpoint_statuses.items():
+            total[status] += n
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "total": summarize(
+            [latency for values in latencies.values() for latency in values],
+            total,
+            elapsed,
+        ),
+        "endpoints": {
+            endpoint: summarize(latencies[endpoint], statuses[endpoint], elapsed)
+            for endpoint in sorted(latencies)
+        },
+    }
+
+
+def load_dataset(path: str) -> Dataset:
+    conn = sqlite3.connect(path)
+    users, instructors = conn.execute(
+        "SELECT COUNT(*), COUNT(*) FILTER (WHERE role = 'Instructor') FROM users"
+    ).fetchone()
+    courses = conn.execute("SELECT MAX(id) FROM courses").fetchone()[0]
+    sections = conn.execute("SELECT MAX(id) FROM sections").fetchone()[0]
+    conn.close()
+    return Dataset(users, instructors, courses, sections)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="benchmarks/load.py",
+        description="Benchmark the API in-process under a scripted traffic mix",
+    )
+    parser.add_argument(
+        "scenario", help="Traffic mix to run", choices=sorted(SCENARIOS)
+    )
+    parser.add_argument(
+        "-n", "--requests", help="Number of requests", type=int, default=5000
+    )
+    parser.add_argument(
+        "-c", "--concurrency", help="Concurrent clients", type=int, default=32
+    )
+    parser.add_argument(
+        "--warmup", help="Requests to make before measuring", type=int, default=500
+    )
+    parser.add_argument(
+        "--database",
+        help="Copy this database instead of generating one",
+    )
+    parser.add_argument("-o", "--output", help="Write the results to this file")
+    generate.add_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "database.db")
+        if args.database:
+            shutil.copyfile(args.database, path)
+            generated = None
+        else:
+            # Progress goes to stderr, leaving stdout for the results.
+            with contextlib.redirect_stdout(sys.stderr):
+                generated = generate.generate_from_arguments(path, args)
+        dataset = load_dataset(path)
+
+        scenario = SCENARIOS[args.scenario]
+        warmup = make_calls(scenario, dataset, args.warmup, args.seed + 1)
+        calls = make_calls(scenario, dataset, args.requests, args.seed)
+
+        database.SQLITE_DATABASE = path
+        try:
+            asyncio.run(run_calls(warmup, args.concurrency))
+            results = asyncio.run(run_calls(calls, args.concurrency))
+        finally:
+            promotion.stop_promoter()
+            writer.stop_writer()
+            async_database.shutdown_executor()
+            database.close_pools()
+
+    report = {
+        "commit": git_commit(),
+        "scenario": args.scenario,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "warmup": args.warmup,
+        "seed": args.seed,
+        "database": args.database,
+        "dataset": generated or vars(dataset),
+        **results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
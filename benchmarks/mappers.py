@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Compares the time taken to build models from joined rows by scanning column
+name prefixes with extract_row against the precompiled layouts in mappers.py.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import database
+import mappers
+from check_query_plans import create_scratch_database
+from database import extract_row
+from models import *
+
+
+def enrollment_from_row(row: sqlite3.Row) -> Enrollment:
+    """
+    Builds an enrollment the way database.py did before mappers.py.
+    """
+    return Enrollment(
+        **extract_row(row, "enrollments"),
+        user=User(**extract_row(row, "users")),
+        section=Section(
+            **extract_row(row, "sections"),
+            course=Course(
+                **extract_row(row, "courses"),
+                department=Department(**extract_row(row, "departments")),
+            ),
+            instructor=User(**extract_row(row, "instructors")),
+        ),
+    )
+
+
+def best_time(f: Callable[[], object], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="benchmarks/mappers.py",
+        description="Benchmark building enrollments from rows",
+    )
+    parser.add_argument("-n", "--rows", help="Rows per run", type=int, default=20000)
+    parser.add_argument("-r", "--repeat", help="Runs of each", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "database.db")
+        create_scratch_database(path)
+        pool = database.ConnectionPool(path, size=1)
+        with pool.connection() as db:
+            query = database.enrollments_query()
+            sample = database.fetch_rows(db, query.sql, query.params)
+        pool.close()
+
+    # Mapping a row doesn't depend on what else was fetched, so the sample is
+    # repeated rather than generating a large database.
+    rows = (sample * (args.rows // len(sample) + 1))[: args.rows]
+
+    old = [enrollment_from_row(row) for row in sample]
+    new = [mappers.enrollments(query.sql, row) for row in sample]
+    assert old == new, "mappers.enrollments disagrees with extract_row"
+
+    results = {
+        "extract_row": best_time(
+            lambda: [enrollment_from_row(row) for row in rows], args.repeat
+        ),
+        "mappers": best_time(
+            lambda: [mappers.enrollments(query.sql, row) for row in rows],
+            args.repeat,
+        ),
+    }
+    for name, seconds in results.items():
+        print(
+            f"{name:12} {seconds * 1e6 / args.rows:8.2f} us/row"
+            f" {args.rows / seconds:12,.0f} rows/s"
+        )
+    print(f"speedup      {results['extract_row'] / results['mappers']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
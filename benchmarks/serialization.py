@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Compares the CPU time taken by each list route when FastAPI validates and
+serializes its results against the return type, and when the route serializes
+its models itself (api.FAST_RESPONSES).
+
+Requests are made one at a time against api.app in-process, so the process's
+CPU time divided by the number of requests is the cost of a response,
+including its queries, which both ways share.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import httpx
+
+import api
+import async_database
+import database
+import generate
+import load
+
+# The list routes that take the fast path, with the URL of each. Ids are
+# filled in at random for each request.
+ROUTES = [
+    "/users?limit={limit}",
+    "/users/{student}/enrollments",
+    "/users/{instructor}/sections",
+    "/users/{student}/waitlist",
+    "/courses/{course}/waitlist",
+    "/sections/{section}/enrollments",
+    "/sections/{section}/waitlist",
+]
+
+
+def make_url(route: str, rng: random.Random, d: load.Dataset, limit: int) -> str:
+    return route.format(
+        limit=limit,
+        student=d.student(rng),
+        instructor=rng.randint(1, d.instructors),
+        course=d.course(rng),
+        section=d.section(rng),
+    )
+
+
+async def cpu_per_request(client: httpx.AsyncClient, urls: list[str]) -> float:
+    start = time.process_time()
+    for url in urls:
+        response = await client.get(url)
+        response.raise_for_status()
+    return (time.process_time() - start) / len(urls)
+
+
+async def fetch_bodies(client: httpx.AsyncClient, urls: list[str]) -> list[bytes]:
+    return [(await client.get(url)).content for url in urls]
+
+
+async def run(urls: list[str], repeat: int) -> dict[bool, float]:
+    """
+    Returns the least CPU time per request over repeat runs, with and without
+    the fast path. Runs of the two alternate, so that neither is favoured by
+    whatever else the machine is doing.
+    """
+    best = {True: float("inf"), False: float("inf")}
+    fast_responses = api.FAST_RESPONSES
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://api") as client:
+        bodies = {}
+        for fast in best:
+            api.FAST_RESPONSES = fast
+            bodies[fast] = await fetch_bodies(client, urls)
+        assert bodies[True] == bodies[False], "the fast path changes responses"
+
+        for _ in range(repeat):
+            for fast in best:
+                api.FAST_RESPONSES = fast
+                best[fast] = min(best[fast], await cpu_per_request(client, urls))
+    api.FAST_RESPONSES = fast_responses
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="benchmarks/serialization.py",
+        description="Benchmark the CPU time of list responses with and without "
+        "the fast serialization path",
+    )
+    parser.add_argument(
+        "-n", "--requests", help="Requests per route and run", type=int, default=200
+    )
+    parser.add_argument("-r", "--repeat", help="Runs of each", type=int, default=5)
+    parser.add_argument(
+        "-l", "--limit", help="Page size of /users", type=int, default=1000
+    )
+    parser.add_argument(
+        "--database",
+        help="Copy this database instead of generating one",
+    )
+    generate.add_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "database.db")
+        if args.database:
+            shutil.copyfile(args.database, path)
+        else:
+            with contextlib.redirect_stdout(sys.stderr):
+                generate.generate_from_arguments(path, args)
+        dataset = load.load_dataset(path)
+
+        database.SQLITE_DATABASE = path
+        rng = random.Random(args.seed)
+        print(f"{'route':32} {'fastapi':>10} {'fast':>10} {'saved':>10}")
+        try:
+            for route in ROUTES:
+                urls = [
+                    make_url(route, rng, dataset, args.limit)
+                    for _ in range(args.requests)
+                ]
+                best = asyncio.run(run(urls, args.repeat))
+                saved = best[False] - best[True]
+                print(
+                    f"{route:32} {best[False] * 1e6:8.0f}us {best[True] * 1e6:8.0f}us"
+                    f" {saved * 1e6:8.0f}us ({saved / best[False]:.0%})"
+                )
+        finally:
+            async_database.shutdown_executor()
+            database.close_pools()
+
+
+if __name__ == "__main__":
+    main()
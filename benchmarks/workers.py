@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Measures how throughput scales with the number of uvicorn worker processes
+sharing one database, under a traffic mix from benchmarks/load.py.
+
+Each worker count is served from a fresh copy of the same generated database,
+and replays the same requests. Server errors would include any "database is
+locked" failures from workers contending for SQLite's write lock.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import httpx
+
+import generate
+import load
+
+
+def wait_until_ready(base_url: str):
+    for _ in range(300):
+        try:
+            httpx.get(base_url + "/courses/1")
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="benchmarks/workers.py",
+        description="Benchmark throughput against the number of worker processes",
+    )
+    parser.add_argument(
+        "scenario",
+        help="Traffic mix to run",
+        choices=sorted(load.SCENARIOS),
+        nargs="?",
+        default="registration",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Comma-separated numbers of worker processes",
+        default="1,2,4",
+    )
+    parser.add_argument(
+        "-n", "--requests", help="Requests per run", type=int, default=5000
+    )
+    parser.add_argument(
+        "-c", "--concurrency", help="Concurrent clients", type=int, default=64
+    )
+    parser.add_argument(
+        "--warmup", help="Requests to make before measuring", type=int, default=500
+    )
+    parser.add_argument("--port", help="Port to serve on", type=int, default=5098)
+    generate.add_arguments(parser)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, "template.db")
+        with contextlib.redirect_stdout(sys.stderr):
+            generated = generate.generate_from_arguments(template, args)
+        dataset = load.load_dataset(template)
+        scenario = load.SCENARIOS[args.scenario]
+        warmup = load.make_calls(scenario, dataset, args.warmup, args.seed + 1)
+        calls = load.make_calls(scenario, dataset, args.requests, args.seed)
+
+        for workers in [int(n) for n in args.workers.split(",")]:
+            path = os.path.join(tmp, f"workers-{workers}.db")
+            shutil.copyfile(template, path)
+            server = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "uvicorn",
+                    "api:app",
+                    "--port",
+                    str(args.port),
+                    "--workers",
+                    str(workers),
+                    "--log-level",
+                    "warning",
+                ],
+                env={**os.environ, "SQLITE_DATABASE": path},
+            )
+            try:
+                wait_until_ready(base_url)
+                asyncio.run(load.run_calls(warmup, args.concurrency, base_url))
+                run = asyncio.run(load.run_calls(calls, args.concurrency, base_url))
+            finally:
+                server.terminate()
+                server.wait()
+
+            results.append({"workers": workers, **run["total"]})
+            print(json.dumps(results[-1]), file=sys.stderr)
+
+    report = {
+        "commit": load.git_commit(),
+        "scenario": args.scenario,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "cpus": os.cpu_count(),
+        "dataset": generated,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import collections
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Iterable
+
+# The number of responses kept by the catalog cache. Entries are a few
+# kilobytes each, except for unpaged listings of the whole catalog.
+CATALOG_CACHE_SIZE = 1024
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str
+    headers: dict[str, str] = field(default_factory=dict)
+    tags: frozenset[str] = frozenset()
+
+
+@dataclass
+class CacheStats:
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Returns whether an If-None-Match header matches the given strong ETag.
+    Following RFC 9110, weak tags match by their opaque value.
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """
+    A size-bounded LRU cache of serialized responses. Each entry is stored with
+    a set of tags naming the data it was built from, and invalidating a tag
+    removes exactly the entries that carry it.
+
+    A response built while data is changing could be stored after the change
+    invalidated it. To prevent that, callers take the generation before
+    building a response and pass it to put, which discards the response if
+    anything was invalidated in between.
+    """
+
+    def __init__(self, size: int = CATALOG_CACHE_SIZE):
+        self.max_size = size
+        self._entries: collections.OrderedDict[
+            str, CachedResponse
+        ] = collections.OrderedDict()
+        self._keys_by_tag: dict[str, set[str]] = collections.defaultdict(set)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._version: int | None = None
+        self._synced = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: str) -> CachedResponse | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry
+
+    def put(self, key: str, entry: CachedResponse, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._remove(key)
+            self._entries[key] = entry
+            for tag in entry.tags:
+                self._keys_by_tag[tag].add(key)
+
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def invalidate(self, tags: Iterable[str]):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+                    self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def sync_due(self, interval: float) -> bool:
+        """
+        Returns whether the version was last checked more than interval
+        seconds ago, in which case the caller is expected to check it and
+        call sync. Only one of the callers that arrive together is told to.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._version is not None and now - self._synced < interval:
+                return False
+            self._synced = now
+            return True
+
+    def sync(self, version: int):
+        """
+        Clears the cache if the version of the data it holds has changed since
+        the last call, to catch changes that weren't invalidated by tag, such as
+        those made by another process.
+        """
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._clear()
+
+    def advance(self, since: int, version: int):
+        """
+        Records that the changes to the data from version since up to version
+        were made by this process, which invalidates them by tag, so that sync
+        needn't clear the cache for them. Does nothing if the cache hasn't
+        seen version since, as another process may have changed the data in
+        between.
+        """
+        with self._lock:
+            if self._version is not None and self._version >= since:
+                self._version = max(self._version, version)
+
+    def _clear(self):
+        self._generation += 1
+        self._entries.clear()
+        self._keys_by_tag.clear()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._keys_by_tag[tag]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tag[tag]
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                size=len(self._entries),
+                max_size=self.max_size,
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                invalidations=self._invalidations,
+            )
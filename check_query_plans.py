@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Runs every route in api.py against a scratch copy of the schema and test data,
+records each SQL statement it executes, and checks the EXPLAIN QUERY PLAN of
+every statement for full-table scans of the large tables.
+
+Exits with a non-zero status if any such scan is found.
+"""
+
+import argparse
+import asyncio
+import inspect
+import os
+import re
+import sqlite3
+import tempfile
+from typing import Any, Callable
+
+from fastapi import HTTPException, Request, Response
+
+import api
+import async_database
+import database
+import schema_init
+from models import *
+from model_requests import *
+
+# Tables that grow with the number of students, and so must never be scanned.
+LARGE_TABLES = {"users", "sections", "enrollments", "waitlist"}
+
+# Aliases used by the queries in database.py.
+TABLE_ALIASES = {"instructors": "users"}
+
+# Calls that list every row of a table, where a scan is expected.
+FULL_LISTINGS: list[tuple[Callable, dict[str, Any]]] = [
+    (api.list_courses, {}),
+    (api.list_sections, {"course_id": None}),
+    (api.list_users, {}),
+]
+
+# The routes to run, along with the arguments to run them with. Write routes
+# are represented by the operations they hand to the writer.
+ROUTE_CALLS: list[tuple[Callable, dict[str, Any]]] = FULL_LISTINGS + [
+    (api.get_course, {"course_id": 1}),
+    (api.get_course_waitlist, {"course_id": 1}),
+    (api.list_sections, {"course_id": 1}),
+    (api.get_section, {"section_id": 1}),
+    (
+        api.list_section_enrollments,
+        {"section_id": 1, "status": EnrollmentStatus.ENROLLED},
+    ),
+    (api.list_section_waitlist, {"section_id": 1}),
+    (api.get_user, {"user_id": 1}),
+    (
+        api.list_user_enrollments,
+        {"user_id": 5, "status": EnrollmentStatus.ENROLLED},
+    ),
+    (api.list_user_sections, {"user_id": 2, "type": ListUserSectionsType.ALL}),
+    (api.list_user_sections, {"user_id": 5, "type": ListUserSectionsType.ENROLLED}),
+    (
+        api.list_user_sections,
+        {"user_id": 2, "type": ListUserSectionsType.INSTRUCTING},
+    ),
+    (api.list_user_waitlist, {"user_id": 9}),
+    # Paged reads must seek straight to the cursor.
+    (api.list_users, {"params": api.ListParams(limit=2, after="WzJd")}),
+    (
+        api.list_sections,
+        {"course_id": None, "params": api.ListParams(limit=1, after="WzFd")},
+    ),
+    # Searches read the full-text index and look up each match by id.
+    (api.search_courses, {"q": "cpsc 44", "limit": 20}),
+    (api.search_sections, {"q": "web", "limit": 20}),
+    # A day and times are a range of the meeting time index.
+    (
+        api.list_sections,
+        {"course_id": None, "day": "Tuesday", "time_from": "9am", "time_to": "5pm"},
+    ),
+    (
+        api.list_section_enrollments,
+        {
+            "section_id": 1,
+            "status": EnrollmentStatus.ENROLLED,
+            "params": api.ListParams(limit=2, after="WzVd"),
+        },
+    ),
+    (
+        api.list_user_enrollments,
+        {
+            "user_id": 5,
+            "status": EnrollmentStatus.ENROLLED,
+            "params": api.ListParams(limit=1, after="WzFd"),
+        },
+    ),
+    (
+        api.list_section_waitlist,
+        {"section_id": 1, "params": api.ListParams(limit=1, after="WzFd")},
+    ),
+    # Sparse fieldsets join only the tables they read, and those that filters
+    # need.
+    (
+        api.list_user_enrollments,
+        {
+            "user_id": 5,
+            "status": EnrollmentStatus.ENROLLED,
+            "params": api.ListParams(fieldset=api.FieldParams(fields="grade,section")),
+        },
+    ),
+    (
+        api.list_section_waitlist,
+        {
+            "section_id": 1,
+            "params": api.ListParams(fieldset=api.FieldParams(fields="position")),
+        },
+    ),
+    (
+        api.list_user_sections,
+        {
+            "user_id": 2,
+            "type": ListUserSectionsType.ALL,
+            "params": api.ListParams(fieldset=api.FieldParams(expand="course")),
+        },
+    ),
+    # Side-loaded responses read the ids of nested objects as well as the
+    # objects themselves.
+    (
+        api.get_course_waitlist,
+        {"course_id": 1, "params": api.ListParams(sideload=True)},
+    ),
+    (
+        api.create_enrollment_txn,
+        {"user_id": 1, "enrollment": CreateEnrollmentRequest(section=1)},
+    ),
+    (
+        api.create_enrollments_txn,
+        {
+            "request": CreateEnrollmentsRequest(
+                enrollments=[
+                    CreateEnrollmentsRequestItem(user=1, section=1),
+                    CreateEnrollmentsRequestItem(user=2, section=3),
+                ]
+            )
+        },
+    ),
+    # A batch also checks each user's requests against their earlier ones.
+    (
+        api.create_enrollments_txn,
+        {
+            "request": CreateEnrollmentsRequest(
+                enrollments=[
+                    CreateEnrollmentsRequestItem(user=1, section=1),
+                    CreateEnrollmentsRequestItem(user=1, section=2),
+                    CreateEnrollmentsRequestItem(user=1, section=4),
+                ]
+            )
+        },
+    ),
+    (
+        api.add_course_txn,
+        {"course": AddCourseRequest(code="TEST 101", name="Test", department_id=1)},
+    ),
+    (
+        api.add_section_txn,
+        {
+            "section": AddSectionRequest(
+                course_id=1,
+                classroom="CS101",
+                capacity=1,
+                waitlist_capacity=1,
+                day="Friday",
+                begin_time="1pm",
+                end_time="2pm",
+                instructor_id=2,
+            )
+        },
+    ),
+    (
+        api.update_section_txn,
+        {
+            "section_id": 1,
+            "section": UpdateSectionRequest(freeze=True, instructor_id=None),
+        },
+    ),
+    (api.drop_user_enrollment_txn, {"user_id": 5, "section_id": 1}),
+    (api.drop_user_waitlist_txn, {"user_id": 11, "section_id": 1}),
+    (api.drop_user_enrollment_txn, {"user_id": 9, "section_id": 2}),
+    (api.delete_section_txn, {"section_id": 3}),
+]
+
+SCAN_RE = re.compile(r"^SCAN (\w+)")
+
+
+def create_scratch_database(path: str):
+    with open("schema.sql", "r") as f:
+        schema_sql = f.read()
+    with open("schema_testdata.sql", "r") as f:
+        schema_testdata_sql = f.read()
+
+    conn = sqlite3.connect(path)
+    conn.executescript(schema_sql)
+    conn.executescript(schema_testdata_sql)
+    conn.commit()
+    schema_init.migrate(conn)
+    conn.close()
+
+
+def trace_route(
+    db: sqlite3.Connection,
+    statements: list[str],
+    route: Callable,
+    kwargs: dict[str, Any],
+) -> list[str]:
+    """
+    Runs the route and returns every statement it executed, with its
+    parameters expanded. Async routes take their connections from the pools,
+    while write operations run on db. Either way, statements are recorded in
+    statements by the connections' trace callbacks. The route's changes are
+    rolled back afterwards.
+    """
+    # Fill in the parameters that FastAPI would otherwise provide.
+    parameters = inspect.signature(route).parameters
+    if "response" in parameters:
+        kwargs = {"response": Response(), **kwargs}
+    if "params" in parameters:
+        kwargs = {"params": api.ListParams(), **kwargs}
+    if "fieldset" in parameters:
+        kwargs = {"fieldset": api.FieldParams(), **kwargs}
+    if "request" in parameters:
+        scope = {"type": "http", "path": "/", "query_string": b"", "headers": []}
+        kwargs = {"request": Request(scope), **kwargs}
+
+    # Cached responses would hide the statements behind them.
+    api.catalog_cache.clear()
+
+    statements.clear()
+    try:
+        if inspect.iscoroutinefunction(route):
+            asyncio.run(route(**kwargs))
+        else:
+            route(**kwargs, db=db)
+    except HTTPException:
+        pass
+    finally:
+        db.rollback()
+
+    return [s for s in statements if re.match(r"\s*(SELECT|INSERT|UPDATE|DELETE)", s)]
+
+
+def full_scans(db: sqlite3.Connection, statement: str) -> list[str]:
+    """
+    Returns the large tables that the statement's query plan scans. Scanning
+    through an index still visits every row, so it counts as well.
+    """
+    tables = []
+    for row in db.execute("EXPLAIN QUERY PLAN " + statement):
+        match = SCAN_RE.match(row[3])
+        if match is None:
+            continue
+        table = TABLE_ALIASES.get(match.group(1), match.group(1))
+        if table in LARGE_TABLES:
+            tables.append(table)
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="check_query_plans.py",
+        description="Check the query plans of every route for full-table scans",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="Print the query plan of every statement",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "database.db")
+        create_scratch_database(path)
+
+        # With one connection in each pool, every statement runs on a
+        # connection that is being traced.
+        database.SQLITE_DATABASE = path
+        database.SQLITE_POOL_SIZE = 1
+        async_database.SQLITE_EXECUTOR_THREADS = 1
+
+        statements: list[str] = []
+        with database.get_pool(read_only=True).connection() as reader:
+            reader.set_trace_callback(statements.append)
+
+        with database.get_pool().connection() as db:
+            db.set_trace_callback(statements.append)
+            for route, kwargs in ROUTE_CALLS:
+                for statement in trace_route(db, statements, route, kwargs):
+                    scans = full_scans(db, statement)
+                    if args.verbose:
+                        print(f"{route.__name__}: {' '.join(statement.split())}")
+                        for row in db.execute("EXPLAIN QUERY PLAN " + statement):
+                            print("    " + row[3])
+
+                    if scans and (route, kwargs) not in FULL_LISTINGS:
+                        failures += 1
+                        print(f"{route.__name__}: full scan of {', '.join(scans)}")
+                        print("    " + " ".join(statement.split()))
+            db.set_trace_callback(None)
+
+        async_database.shutdown_executor()
+        database.close_pools()
+
+    if failures:
+        print(f"{failures} statement(s) scan large tables.")
+        exit(1)
+    print("No full-table scans found.")
+
+
+if __name__ == "__main__":
+    main()
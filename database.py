@@ -1,17 +1,57 @@
+import base64
+import collections
 import contextlib
+import itertools
+import json
+import os
+import pathlib
+import queue
+import re
 import sqlite3
+import threading
 import time
-from typing import Any, Generator, Iterable, Type
+from dataclasses import dataclass
+from typing import Any, Callable, Generator, Generic, Iterable, Iterator, Type, TypeVar
+import fieldsets
+import mappers
+import metrics
 from models import *
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-SQLITE_DATABASE = "database.db"
+# Worker processes started by uvicorn --workers can only be configured through
+# the environment.
+SQLITE_DATABASE = os.environ.get("SQLITE_DATABASE", "database.db")
+
+# The maximum number of connections kept by each pool. This matches the size of
+# Starlette's default threadpool, so a request never waits on a connection
+# unless it is also waiting on a thread.
+SQLITE_POOL_SIZE = 40
+
+# The most responses that can stream rows from the database at once. Others
+# wait for one of them to finish. See get_stream_pool.
+SQLITE_STREAM_POOL_SIZE = 16
+
+# The number of seconds to wait for a pooled connection before giving up.
+SQLITE_POOL_TIMEOUT = 30
+
+# The number of prepared statements each connection keeps, by SQL text. This
+# should exceed the number of distinct statements the routes run, so that
+# every statement is prepared once per connection.
+SQLITE_STATEMENT_CACHE_SIZE = 256
+
+# The number of seconds a connection waits for another process to release
+# SQLite's write lock before failing with "database is locked".
+SQLITE_BUSY_TIMEOUT = 5
 
 SQLITE_PRAGMA = """
 -- Permit SQLite to be concurrently safe.
 PRAGMA journal_mode = WAL;
 
+-- Truncate the WAL after checkpoints once it exceeds 64 MiB, so that a burst
+-- of writes doesn't leave it large for good.
+PRAGMA journal_size_limit = 67108864;
+
 -- Enable foreign key constraints.
 PRAGMA foreign_keys = ON;
 
@@ -24,23 +64,339 @@ PRAGMA full_column_names = ON;
 PRAGMA short_column_names = OFF;
 """
 
+SQLITE_READ_PRAGMA = """
+-- Refuse to modify the database, even if the file is writable.
+PRAGMA query_only = ON;
+
+-- Force queries to prefix column names with table names.
+PRAGMA full_column_names = ON;
+PRAGMA short_column_names = OFF;
+"""
+
+
+@dataclass
+class PoolStats:
+    size: int
+    max_size: int
+    idle: int
+    in_use: int
+    acquisitions: int
+    waits: int
+    total_wait_seconds: float
+    max_wait_seconds: float
+    statement_cache_size: int
+    statement_cache_hits: int
+    statement_cache_misses: int
+
+
+class Connection(sqlite3.Connection):
+    """
+    A connection that can run callbacks once its current transaction commits,
+    for work that must not happen if the transaction is rolled back, or that
+    must not happen before other connections can see its changes.
+
+    Statements are timed and counted against the current request. Statements
+    run through fetch_rows and the like are timed there instead, so that the
+    time to fetch their rows is included.
+
+    sqlite3 keeps an LRU cache of prepared statements by SQL text, but doesn't
+    report how well it works, so the connection counts hits and misses by
+    keeping an LRU of the same size itself.
+    """
+
+    def __init__(self, *args, cached_statements: int = 128, **kwargs):
+        super().__init__(*args, cached_statements=cached_statements, **kwargs)
+        self.commit_hooks: list[Callable[[], None]] = []
+        self.cached_statements = cached_statements
+        self.statement_cache_hits = 0
+        self.statement_cache_misses = 0
+        self._statements: collections.OrderedDict[str, None] = collections.OrderedDict()
+
+    def _count_statement(self, sql: str):
+        if sql in self._statements:
+            self._statements.move_to_end(sql)
+            self.statement_cache_hits += 1
+            return
+        self.statement_cache_misses += 1
+        self._statements[sql] = None
+        if len(self._statements) > self.cached_statements:
+            self._statements.popitem(last=False)
+
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        self._count_statement(sql)
+        with metrics.statement(sql):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters: Any, /) -> sqlite3.Cursor:
+        self._count_statement(sql)
+        with metrics.statement(sql):
+            return super().executemany(sql, parameters)
+
+    def commit(self):
+        super().commit()
+        hooks, self.commit_hooks = self.commit_hooks, []
+        for hook in hooks:
+            hook()
+
+    def rollback(self):
+        super().rollback()
+        self.commit_hooks.clear()
+
+
+def is_busy(e: Exception) -> bool:
+    """
+    Returns whether e means that another connection held a lock for longer
+    than the busy timeout.
+    """
+    return (
+        isinstance(e, sqlite3.OperationalError)
+        and getattr(e, "sqlite_errorcode", None) is not None
+        and e.sqlite_errorcode & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    )
 
-def get_db() -> Generator[sqlite3.Connection, None, None]:
-    read_only = False  # TODO: split to a different function
-    with sqlite3.connect(SQLITE_DATABASE) as db:
-        db.row_factory = sqlite3.Row
 
-        # These pragmas are only relevant for write operations.
-        cur = db.executescript(SQLITE_PRAGMA)
+def after_commit(db: sqlite3.Connection, hook: Callable[[], None]):
+    """
+    Runs hook after the current transaction on a pooled connection commits.
+    """
+    assert isinstance(db, Connection)
+    db.commit_hooks.append(hook)
+
+
+class ConnectionPool:
+    """
+    A bounded pool of long-lived SQLite connections. Connections are opened
+    lazily and have their pragmas applied once when they are opened, rather than
+    on every request.
+
+    Read-only pools open the database with mode=ro and query_only, so their
+    connections can never take SQLite's write lock.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        size: int | None = None,
+        read_only: bool = False,
+    ):
+        self.database = database
+        # Read when the pool is made, so that setting SQLITE_POOL_SIZE after
+        # import takes effect.
+        self.max_size = SQLITE_POOL_SIZE if size is None else size
+        self.read_only = read_only
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._in_use = 0
+        self._acquisitions = 0
+        self._waits = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        # Every open connection, idle or not, for their statement cache counts.
+        self._connections: set[Connection] = set()
+        self._closed_hits = 0
+        self._closed_misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections are handed between Starlette's worker threads, but the
+        # pool guarantees that only one thread uses a connection at a time.
+        if self.read_only:
+            uri = pathlib.Path(self.database).absolute().as_uri() + "?mode=ro"
+            db = sqlite3.connect(
+                uri,
+                uri=True,
+                check_same_thread=False,
+                timeout=SQLITE_BUSY_TIMEOUT,
+                factory=Connection,
+                cached_statements=SQLITE_STATEMENT_CACHE_SIZE,
+            )
+            pragma = SQLITE_READ_PRAGMA
+        else:
+            db = sqlite3.connect(
+                self.database,
+                check_same_thread=False,
+                timeout=SQLITE_BUSY_TIMEOUT,
+                factory=Connection,
+                cached_statements=SQLITE_STATEMENT_CACHE_SIZE,
+            )
+            pragma = SQLITE_PRAGMA
+
+        db.row_factory = sqlite3.Row
+        cur = db.executescript(pragma)
         cur.close()
+        with self._lock:
+            self._connections.add(db)
+        return db
 
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Takes a connection out of the pool, opening a new one if the pool has
+        not reached its maximum size yet. Otherwise, this blocks until another
+        request releases its connection.
+        """
+        start = time.perf_counter()
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._size < self.max_size
+                if grow:
+                    self._size += 1
+            if grow:
+                try:
+                    db = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                    raise
+            else:
+                try:
+                    db = self._idle.get(timeout=SQLITE_POOL_TIMEOUT)
+                except queue.Empty:
+                    raise HTTPException(
+                        status_code=503,
+                        detail="Timed out waiting for a database connection.",
+                    )
+
+                waited = time.perf_counter() - start
+                with self._lock:
+                    self._waits += 1
+                    self._total_wait += waited
+                    self._max_wait = max(self._max_wait, waited)
+
+        with self._lock:
+            self._in_use += 1
+            self._acquisitions += 1
+        return db
+
+    def release(self, db: sqlite3.Connection):
+        """
+        Returns a connection to the pool. Any transaction still open on the
+        connection is rolled back.
+        """
+        if db.in_transaction:
+            db.rollback()
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(db)
+
+    @contextlib.contextmanager
+    def connection(self) -> Generator[sqlite3.Connection, None, None]:
+        db = self.acquire()
         try:
             yield db
         finally:
-            if read_only:
-                db.rollback()
-            else:
-                db.commit()
+            self.release(db)
+
+    def close(self):
+        """
+        Closes all idle connections in the pool.
+        """
+        while True:
+            try:
+                db = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            db.close()
+            with self._lock:
+                self._size -= 1
+                self._connections.discard(db)
+                self._closed_hits += db.statement_cache_hits
+                self._closed_misses += db.statement_cache_misses
+
+    def stats(self) -> PoolStats:
+        with self._lock:
+            return PoolStats(
+                size=self._size,
+                max_size=self.max_size,
+                idle=self._idle.qsize(),
+                in_use=self._in_use,
+                acquisitions=self._acquisitions,
+                waits=self._waits,
+                total_wait_seconds=self._total_wait,
+                max_wait_seconds=self._max_wait,
+                statement_cache_size=SQLITE_STATEMENT_CACHE_SIZE,
+                statement_cache_hits=self._closed_hits
+                + sum(db.statement_cache_hits for db in self._connections),
+                statement_cache_misses=self._closed_misses
+                + sum(db.statement_cache_misses for db in self._connections),
+            )
+
+
+_pools: dict[tuple[str, str], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(read_only: bool = False) -> ConnectionPool:
+    """
+    Returns the connection pool for SQLITE_DATABASE, creating it on first use.
+    """
+    if read_only:
+        return _get_pool("read_only", read_only=True)
+    return _get_pool("read_write")
+
+
+def get_stream_pool() -> ConnectionPool:
+    """
+    Returns the read-only pool for streamed responses, which hold a connection
+    while they wait on their clients. Keeping them apart means slow clients
+    can only hold up other streams, never the queries that the executor in
+    async_database.py runs.
+    """
+    return _get_pool("stream", read_only=True, size=SQLITE_STREAM_POOL_SIZE)
+
+
+def _get_pool(name: str, **kwargs: Any) -> ConnectionPool:
+    key = (SQLITE_DATABASE, name)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(SQLITE_DATABASE, **kwargs)
+            _pools[key] = pool
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def catalog_version(db: sqlite3.Connection) -> int:
+    """
+    Returns the number of changes made to the catalog so far, by any process.
+    """
+    row = fetch_row(db, "SELECT version FROM catalog_version WHERE id = 1")
+    assert row
+    return row["catalog_version.version"]
+
+
+def get_db() -> Generator[sqlite3.Connection, None, None]:
+    """
+    Yields a pooled read-write connection. The request's changes are committed
+    once the request completes, or rolled back if it fails.
+    """
+    with get_pool().connection() as db:
+        try:
+            yield db
+        except Exception:
+            db.rollback()
+            raise
+        else:
+            db.commit()
+
+
+def get_readonly_db() -> Generator[sqlite3.Connection, None, None]:
+    """
+    Yields a pooled read-only connection. Nothing is ever committed through it.
+    """
+    with get_pool(read_only=True).connection() as db:
+        yield db
+
+
+# The number of rows read from a cursor at a time when iterating over a result.
+FETCH_SIZE = 500
 
 
 def fetch_rows(
@@ -48,10 +404,37 @@ def fetch_rows(
     sql: str,
     params: Any = None,
 ) -> list[sqlite3.Row]:
-    cursor = db.execute(sql, params if params is not None else ())
-    rows = cursor.fetchall()
-    cursor.close()
-    return [row for row in rows]
+    with metrics.statement(sql):
+        cursor = db.execute(sql, params if params is not None else ())
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+
+def iter_rows(
+    db: sqlite3.Connection,
+    sql: str,
+    params: Any = None,
+    size: int = FETCH_SIZE,
+) -> Generator[sqlite3.Row, None, None]:
+    """
+    Yields the rows of a query a batch at a time, so that only one batch is
+    held in memory however large the result is.
+    """
+    # The rows are fetched between yields, so each step is timed on its own.
+    timer = metrics.StatementTimer(sql)
+    with timer:
+        cursor = db.execute(sql, params if params is not None else ())
+    try:
+        while True:
+            with timer:
+                rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+        timer.record()
 
 
 def fetch_row(
@@ -59,9 +442,10 @@ def fetch_row(
     sql: str,
     params: Any = None,
 ) -> sqlite3.Row | None:
-    cursor = db.execute(sql, params if params is not None else ())
-    row = cursor.fetchone()
-    cursor.close()
+    with metrics.statement(sql):
+        cursor = db.execute(sql, params if params is not None else ())
+        row = cursor.fetchone()
+        cursor.close()
     return row
 
 
@@ -88,161 +472,711 @@ def exclude_dict(d: dict, keys: Iterable[str]) -> dict:
     return {k: v for k, v in d.items() if k not in keys}
 
 
-def list_courses(
-    db: sqlite3.Connection,
-    course_ids: list[int] | None = None,
-) -> list[Course]:
-    courses_rows = fetch_rows(
-        db,
+def where_clause(conditions: list[str]) -> str:
+    """
+    Joins the given conditions into a WHERE clause, or returns an empty string
+    if there are no conditions.
+    """
+    if not conditions:
+        return ""
+    return "WHERE " + " AND ".join(conditions)
+
+
+T = TypeVar("T")
+
+
+class Page(list[T]):
+    """
+    A page of results. next_cursor is set if there may be more results after
+    this page, and can be passed as the after argument to fetch them. included
+    holds the side-loaded models that the results refer to, by collection and
+    id.
+    """
+
+    def __init__(
+        self,
+        items: Iterable[T] = (),
+        next_cursor: str | None = None,
+        included: dict[str, dict[int, BaseModel]] | None = None,
+    ):
+        super().__init__(items)
+        self.next_cursor = next_cursor
+        self.included = included or {}
+
+
+def encode_cursor(values: list[Any]) -> str:
+    """
+    Encodes the sort key of the last row of a page into an opaque cursor.
+    """
+    data = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int) -> list[Any]:
+    """
+    Decodes a cursor made by encode_cursor, or raises a 400 if it isn't a list
+    of length values that SQLite can bind.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except ValueError:
+        values = None
+    if (
+        not isinstance(values, list)
+        or len(values) != length
+        or not all(is_cursor_value(value) for value in values)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return values
+
+
+def is_cursor_value(value: Any) -> bool:
+    if isinstance(value, int):
+        # SQLite integers are 64 bits.
+        return -(2**63) <= value < 2**63
+    return value is None or isinstance(value, (float, str))
+
+
+def keyset_clause(
+    p: dict,
+    wheres: list[str],
+    keys: list[str],
+    limit: int | None,
+    after: str | None,
+) -> str:
+    """
+    Orders a query by the given key columns and pages through it by key rather
+    than by offset, so each page is a range read on an index ordered by those
+    columns. Adds the condition for rows after the cursor to wheres, and
+    returns the ORDER BY and LIMIT clauses. One row more than the limit is
+    fetched so that page_rows can tell whether there is another page.
+    """
+    if after is not None:
+        values = decode_cursor(after, len(keys))
+        placeholders = []
+        for i, value in enumerate(values):
+            p[f"after_{i}"] = value
+            placeholders.append(f":after_{i}")
+        wheres.append("(%s) > (%s)" % (", ".join(keys), ", ".join(placeholders)))
+
+    clause = "\nORDER BY " + ", ".join(keys)
+    if limit is not None:
+        clause += "\nLIMIT :limit"
+        p["limit"] = limit + 1
+    return clause
+
+
+def page_rows(
+    rows: list[sqlite3.Row],
+    keys: list[str],
+    limit: int | None,
+) -> tuple[list[sqlite3.Row], str | None]:
+    """
+    Trims the extra row fetched by keyset_clause, returning the rows of the page
+    and the cursor of the next page, if there is one.
+    """
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1][key] for key in keys])
+
+
+def json_list(params: dict, name: str, values: Iterable[Any]) -> str:
+    """
+    Binds the values to params as one JSON array and returns a subquery of
+    them, for use in an IN (...) expression. The SQL is the same however many
+    values there are, so its prepared statement is reused from the cache.
+    """
+    params[name] = json.dumps(list(values))
+    return f"SELECT value FROM json_each(:{name})"
+
+
+# How the table of each nested model is joined to its parent's table, and the
+# column of the parent's table that holds its id.
+JOINS: dict[tuple[str, str], tuple[str, str]] = {
+    ("enrollments", "user"): (
+        "INNER JOIN users ON users.id = enrollments.user_id",
+        "enrollments.user_id",
+    ),
+    ("enrollments", "section"): (
+        "INNER JOIN sections ON sections.id = enrollments.section_id",
+        "enrollments.section_id",
+    ),
+    ("waitlist", "user"): (
+        "INNER JOIN users ON users.id = waitlist.user_id",
+        "waitlist.user_id",
+    ),
+    ("waitlist", "section"): (
+        "INNER JOIN sections ON sections.id = waitlist.section_id",
+        "waitlist.section_id",
+    ),
+    ("sections", "course"): (
+        "INNER JOIN courses ON courses.id = sections.course_id",
+        "sections.course_id",
+    ),
+    ("sections", "instructor"): (
+        "INNER JOIN users AS instructors ON instructors.id = sections.instructor_id",
+        "sections.instructor_id",
+    ),
+    ("courses", "department"): (
+        "INNER JOIN departments ON departments.id = courses.department_id",
+        "courses.department_id",
+    ),
+}
+
+
+def select_shape(
+    mapper: mappers.RowMapper,
+    shape: fieldsets.Shape,
+    keys: list[str],
+    required: Iterable[str] = (),
+    computed: dict[str, str] | None = None,
+) -> str:
+    """
+    Returns the SELECT list and joins of a query from mapper's table that reads
+    the fields of shape, and the key columns. Only the tables of expanded
+    nested models are joined, along with the required tables that filters
+    refer to. computed gives expressions for fields that aren't columns.
+    """
+    required = set(required)
+    computed = computed or {}
+    columns: dict[str, str] = {}
+    joins: list[str] = []
+
+    def visit(mapper: mappers.RowMapper, shape: fieldsets.Shape):
+        for name in shape.scalars:
+            column = f"{mapper.table}.{name}"
+            columns[column] = computed.get(column, column)
+
+        for name, nested in mapper.nested.items():
+            join, reference = JOINS[(mapper.table, name)]
+            if name in shape.refs:
+                columns[f"{mapper.table}.{name}"] = reference
+            child = shape.child(name)
+            if child is not None or required & nested.tables():
+                joins.append(join)
+                visit(nested, child or fieldsets.EMPTY)
+
+    visit(mapper, shape)
+    for key in keys:
+        columns.setdefault(key, key)
+
+    # Every column is named explicitly, since full_column_names would name the
+    # columns of an aliased table after the table rather than the alias.
+    return "SELECT\n    %s\nFROM %s\n%s\n" % (
+        ",\n    ".join(f'{expr} AS "{name}"' for name, expr in columns.items()),
+        mapper.table,
+        "\n".join(joins),
+    )
+
+
+@dataclass
+class ListQuery(Generic[T]):
+    """
+    A list query that has been built but not yet run. fetch reads a page of
+    results at once, while stream yields results one at a time as they are
+    read from the cursor.
+    """
+
+    sql: str
+    params: dict[str, Any]
+    keys: list[str]
+    limit: int | None
+    mapper: mappers.RowMapper
+
+    def fetch(self, db: sqlite3.Connection) -> Page[T]:
+        rows = fetch_rows(db, self.sql, self.params)
+        rows, next_cursor = page_rows(rows, self.keys, self.limit)
+        included: dict[str, dict[int, BaseModel]] = {}
+        with metrics.phase("hydrate"):
+            results = [self.mapper(self.sql, row) for row in rows]
+            if self.mapper.included:
+                for row in rows:
+                    self.mapper.include(self.sql, row, included)
+        return Page(results, next_cursor, included)
+
+    def stream(self, db: sqlite3.Connection) -> Iterator[T]:
         """
-        SELECT
-            courses.*,
-            departments.*
-        FROM courses
-        INNER JOIN departments ON departments.id = courses.department_id
+        Yields every result without building a list of them. There is no way
+        to learn the next cursor from a stream, so a limit only truncates it.
         """
-        + (
-            "WHERE courses.id IN (%s)" % ",".join(["?"] * len(course_ids))
-            if course_ids is not None
-            else ""
-        ),
-        course_ids,
-    )
-    return [
-        Course(
-            **extract_row(row, "courses"),
-            department=Department(**extract_row(row, "departments")),
-        )
-        for row in courses_rows
-    ]
+        rows: Iterator[sqlite3.Row] = iter_rows(db, self.sql, self.params)
+        if self.limit is not None:
+            rows = itertools.islice(rows, self.limit)
+        return (self.mapper(self.sql, row) for row in rows)
+
+    def stream_from_pool(self) -> Generator[T, None, None]:
+        """
+        Like stream, but on a read-only connection that is taken from the
+        stream pool when the first result is read and returned once the stream
+        ends.
+        """
+        with get_stream_pool().connection() as db:
+            yield from self.stream(db)
 
 
-def list_sections(
-    db: sqlite3.Connection,
-    section_ids: list[int] | None = None,
-) -> list[Section]:
+def users_query(
+    *,
+    limit: int | None = None,
+    after: str | None = None,
+    shape: fieldsets.Shape | None = None,
+) -> ListQuery[User]:
+    """
+    Lists users. shape, like that of every list query, picks the fields that
+    are read, and defaults to every field of the model.
+    """
+    p: dict[str, Any] = {}
+    wheres: list[str] = []
+    keys = ["users.id"]
+    order = keyset_clause(p, wheres, keys, limit, after)
+
+    shape = shape or fieldsets.full(User)
+    q = select_shape(mappers.users, shape, keys) + where_clause(wheres) + order
+    return ListQuery(q, p, keys, limit, mappers.partial(mappers.users, shape))
+
+
+def list_users(db: sqlite3.Connection, **kwargs) -> Page[User]:
+    return users_query(**kwargs).fetch(db)
+
+
+def courses_query(
+    course_ids: list[int] | None = None,
+    *,
+    limit: int | None = None,
+    after: str | None = None,
+    shape: fieldsets.Shape | None = None,
+) -> ListQuery[Course]:
+    p: dict[str, Any] = {}
+    wheres = []
+    if course_ids is not None:
+        wheres.append("courses.id IN (%s)" % json_list(p, "course_ids", course_ids))
+
+    keys = ["courses.id"]
+    order = keyset_clause(p, wheres, keys, limit, after)
+
+    shape = shape or fieldsets.full(Course)
+    q = select_shape(mappers.courses, shape, keys) + where_clause(wheres) + order
+    return ListQuery(q, p, keys, limit, mappers.partial(mappers.courses, shape))
+
+
+def list_courses(db: sqlite3.Connection, *args, **kwargs) -> Page[Course]:
+    return courses_query(*args, **kwargs).fetch(db)
+
+
+def deleted_condition(deleted: bool) -> str:
+    # The literal is written out rather than bound so that SQLite can match the
+    # condition against partial indexes on sections.
+    return "sections.deleted = TRUE" if deleted else "sections.deleted = FALSE"
+
+
+# Meeting times are stored as minutes since Monday midnight, in the
+# meeting_start and meeting_end columns that migration 0006 generates from
+# each section's day and times.
+MEETING_DAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_day(text: str) -> int | None:
+    """
+    Returns the index of a day of the week, counting from Monday, or None.
+    """
+    try:
+        return MEETING_DAYS.index(text.strip().lower())
+    except ValueError:
+        return None
+
+
+def parse_time(text: str) -> int | None:
+    """
+    Returns the minutes since midnight of a time such as '7pm', '9:45pm' or
+    '19:00', or None, accepting the same forms as the meeting_start column.
+    """
+    text = text.replace(" ", "").lower()
+    match = re.fullmatch(r"(\d{1,2})(?::([0-5]\d))?([ap]m)?", text)
+    if match is None:
+        return None
+    hour, minute, suffix = match.groups()
+    if suffix is not None and 1 <= int(hour) <= 12:
+        return int(hour) % 12 * 60 + int(minute or 0) + (720 if suffix == "pm" else 0)
+    if suffix is None and minute is not None and int(hour) < 24:
+        return int(hour) * 60 + int(minute)
+    return None
+
+
+def schedule_conflicts_sql(user: str, section: str) -> str:
+    """
+    Returns a query for the sections that user is enrolled in whose meetings
+    overlap that of section, where both are SQL expressions for ids. A meeting
+    doesn't cross midnight, so only sections that start on the same day can
+    overlap, which bounds the range read from the sections_meeting index.
+    """
+    return f"""
+        SELECT other.id
+        FROM sections AS target
+        JOIN sections AS other
+            ON other.meeting_start >= target.meeting_start / 1440 * 1440
+            AND other.meeting_start < target.meeting_end
+            AND other.meeting_end > target.meeting_start
+        JOIN enrollments ON enrollments.section_id = other.id
+        WHERE
+            target.id = {section}
+            AND other.id != target.id
+            AND other.deleted = FALSE
+            AND enrollments.user_id = {user}
+            AND enrollments.status = 'Enrolled'
+        """
+
+
+def schedule_conflicts(
+    db: sqlite3.Connection, user_id: int, section_id: int
+) -> list[int]:
+    """
+    Returns the ids of the sections that the user is enrolled in that meet at
+    the same time as the section.
+    """
     rows = fetch_rows(
         db,
-        """
-        SELECT
-            sections.*,
-            courses.*,
-            departments.*,
-            instructors.*
-        FROM sections
-        INNER JOIN courses ON courses.id = sections.course_id
-        INNER JOIN departments ON departments.id = courses.department_id
-        INNER JOIN users AS instructors ON instructors.id = sections.instructor_id
-        """
-        + (
-            "WHERE sections.id IN (%s)" % ",".join(["?"] * len(section_ids))
-            if section_ids is not None
-            else ""
-        ),
-        section_ids,
+        schedule_conflicts_sql(":user", ":section"),
+        {"user": user_id, "section": section_id},
     )
-    return [
-        Section(
-            **extract_row(row, "sections"),
-            course=Course(
-                **extract_row(row, "courses"),
-                department=Department(
-                    **extract_row(row, "departments"),
-                ),
-            ),
-            instructor=User(**extract_row(row, "instructors")),
+    return [row[0] for row in rows]
+
+
+def sections_query(
+    section_ids: list[int] | None = None,
+    *,
+    course_id: int | None = None,
+    user_id: int | None = None,
+    instructor_id: int | None = None,
+    deleted: bool | None = None,
+    day: int | None = None,
+    time_from: int | None = None,
+    time_to: int | None = None,
+    limit: int | None = None,
+    after: str | None = None,
+    shape: fieldsets.Shape | None = None,
+) -> ListQuery[Section]:
+    """
+    Lists sections matching all of the given filters. user_id matches sections
+    that the user has an enrollment in, and instructor_id matches sections that
+    the user teaches. If both are given, sections matching either are listed.
+
+    day (counting from Monday) matches sections that meet on that day, and
+    time_from and time_to (in minutes since midnight) those whose meetings
+    start no earlier and end no later. Given a day, they are a range of the
+    sections_meeting index, which only covers sections that aren't deleted.
+    """
+    p: dict[str, Any] = {}
+    wheres = []
+    if section_ids is not None:
+        wheres.append("sections.id IN (%s)" % json_list(p, "section_ids", section_ids))
+    if course_id is not None:
+        wheres.append("sections.course_id = :course_id")
+        p["course_id"] = course_id
+    if deleted is not None:
+        wheres.append(deleted_condition(deleted))
+    if day is not None:
+        p["meeting_from"] = day * MINUTES_PER_DAY + (time_from or 0)
+        p["meeting_to"] = day * MINUTES_PER_DAY + (
+            MINUTES_PER_DAY if time_to is None else time_to
+        )
+        wheres.append("sections.meeting_start >= :meeting_from")
+        wheres.append("sections.meeting_start < :meeting_to")
+        if time_to is not None:
+            wheres.append("sections.meeting_end <= :meeting_to")
+    else:
+        # Times of day on any day can't be a single range of the index.
+        if time_from is not None:
+            wheres.append("sections.meeting_start % 1440 >= :time_from")
+            p["time_from"] = time_from
+        if time_to is not None:
+            wheres.append(
+                "sections.meeting_end - sections.meeting_start / 1440 * 1440"
+                " <= :time_to"
+            )
+            p["time_to"] = time_to
+
+    members = []
+    if user_id is not None:
+        members.append(
+            """
+            sections.id IN (
+                SELECT section_id FROM enrollments WHERE user_id = :user_id
+            )
+            """
         )
-        for row in rows
-    ]
+        p["user_id"] = user_id
+    if instructor_id is not None:
+        members.append("sections.instructor_id = :instructor_id")
+        p["instructor_id"] = instructor_id
+    if members:
+        wheres.append("(%s)" % " OR ".join(members))
 
+    keys = ["sections.id"]
+    order = keyset_clause(p, wheres, keys, limit, after)
 
-def list_enrollments(
-    db: sqlite3.Connection,
+    shape = shape or fieldsets.full(Section)
+    q = select_shape(mappers.sections, shape, keys) + where_clause(wheres) + order
+    return ListQuery(q, p, keys, limit, mappers.partial(mappers.sections, shape))
+
+
+def list_sections(db: sqlite3.Connection, *args, **kwargs) -> Page[Section]:
+    return sections_query(*args, **kwargs).fetch(db)
+
+
+def match_expression(text: str) -> str | None:
+    """
+    Returns an FTS5 query that matches rows with a word starting with each word
+    of text, or None if text has no words. Each word is quoted, so nothing in
+    text is read as FTS5 syntax.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_query(
+    mapper: mappers.RowMapper,
+    index: str,
+    weights: list[float],
+    text: str,
+    wheres: list[str],
+    limit: int,
+    shape: fieldsets.Shape,
+) -> ListQuery:
+    """
+    Returns the rows of mapper's table that match text in the full-text index,
+    best first by BM25 with a weight for each column of the index. Search
+    results aren't paged, since their order isn't a key.
+    """
+    p: dict[str, Any] = {"limit": limit}
+    match = match_expression(text)
+    if match is None:
+        wheres = wheres + ["FALSE"]
+    else:
+        wheres = wheres + [f"{index} MATCH :match"]
+        p["match"] = match
+
+    q = (
+        select_shape(mapper, shape, [f"{mapper.table}.id"])
+        + f"INNER JOIN {index} ON {index}.rowid = {mapper.table}.id\n"
+        + where_clause(wheres)
+        + "\nORDER BY bm25(%s, %s)" % (index, ", ".join(map(str, weights)))
+        + "\nLIMIT :limit"
+    )
+    return ListQuery(q, p, [], None, mappers.partial(mapper, shape))
+
+
+def course_search_query(
+    text: str, *, limit: int, shape: fieldsets.Shape | None = None
+) -> ListQuery[Course]:
+    """
+    Searches courses by code, name and department.
+    """
+    return search_query(
+        mappers.courses,
+        "course_search",
+        [10.0, 5.0, 1.0],
+        text,
+        [],
+        limit,
+        shape or fieldsets.full(Course),
+    )
+
+
+def section_search_query(
+    text: str, *, limit: int, shape: fieldsets.Shape | None = None
+) -> ListQuery[Section]:
+    """
+    Searches sections that aren't deleted by their course's code, name and
+    department, their instructor's name and their classroom.
+    """
+    return search_query(
+        mappers.sections,
+        "section_search",
+        [10.0, 5.0, 1.0, 3.0, 3.0],
+        text,
+        [deleted_condition(False)],
+        limit,
+        shape or fieldsets.full(Section),
+    )
+
+
+def user_section_condition(
+    p: dict,
+    table: str,
+    user_section_ids: list[tuple[int, int]],
+) -> str:
+    """
+    Returns a condition matching rows of table whose (user_id, section_id) pair
+    is one of user_section_ids. The pairs are bound as one JSON array, since
+    SQLite can search the primary key for each pair of a json_each subquery but
+    not for each row of a VALUES list.
+    """
+    p["user_section_ids"] = json.dumps(user_section_ids)
+    return """
+        (%s.user_id, %s.section_id) IN (
+            SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]')
+            FROM json_each(:user_section_ids)
+        )
+        """ % (
+        table,
+        table,
+    )
+
+
+def enrollments_query(
     user_section_ids: list[tuple[int, int]] | None = None,
-) -> list[Enrollment]:
-    q = """
-        SELECT
-            courses.*,
-            sections.*,
-            enrollments.*,
-            departments.*,
-            users.*,
-            instructors.*
-        FROM enrollments
-        INNER JOIN users ON users.id = enrollments.user_id
-        INNER JOIN sections ON sections.id = enrollments.section_id
-        INNER JOIN courses ON courses.id = sections.course_id
-        INNER JOIN departments ON departments.id = courses.department_id
-        INNER JOIN users AS instructors ON instructors.id = sections.instructor_id
-    """
-    p = []
+    *,
+    user_id: int | None = None,
+    section_id: int | None = None,
+    course_id: int | None = None,
+    status: EnrollmentStatus | None = None,
+    deleted: bool | None = None,
+    limit: int | None = None,
+    after: str | None = None,
+    shape: fieldsets.Shape | None = None,
+) -> ListQuery[Enrollment]:
+    """
+    Lists enrollments matching all of the given filters. deleted filters on
+    whether the enrollment's section has been deleted.
+    """
+    p: dict[str, Any] = {}
+    wheres = []
     if user_section_ids is not None:
-        q += "WHERE (users.id, sections.id) IN (%s)" % ",".join(
-            ["(?, ?)"] * len(user_section_ids)
-        )
-        p = [item for sublist in user_section_ids for item in sublist]  # flatten list
-
-    rows = fetch_rows(db, q, p)
-    return [
-        Enrollment(
-            **extract_row(row, "enrollments"),
-            user=User(**extract_row(row, "users")),
-            section=Section(
-                **extract_row(row, "sections"),
-                course=Course(
-                    **extract_row(row, "courses"),
-                    department=Department(
-                        **extract_row(row, "departments"),
-                    ),
-                ),
-                instructor=User(**extract_row(row, "instructors")),
-            ),
-        )
-        for row in rows
-    ]
+        wheres.append(user_section_condition(p, "enrollments", user_section_ids))
+    if user_id is not None:
+        wheres.append("enrollments.user_id = :user_id")
+        p["user_id"] = user_id
+    if section_id is not None:
+        wheres.append("enrollments.section_id = :section_id")
+        p["section_id"] = section_id
+    if course_id is not None:
+        wheres.append("sections.course_id = :course_id")
+        p["course_id"] = course_id
+    if status is not None:
+        wheres.append("enrollments.status = :status")
+        p["status"] = status
+    if deleted is not None:
+        wheres.append(deleted_condition(deleted))
 
+    # Page on whichever half of the key the filters leave open, so that the
+    # cursor becomes a range on the index that serves the filters.
+    if section_id is not None:
+        keys = ["enrollments.user_id"]
+    elif user_id is not None:
+        keys = ["enrollments.section_id"]
+    else:
+        keys = ["enrollments.section_id", "enrollments.user_id"]
+    order = keyset_clause(p, wheres, keys, limit, after)
 
-def list_waitlist(
-    db: sqlite3.Connection,
+    # The filters on the section need it joined even if it isn't read.
+    required = ["sections"] if course_id is not None or deleted is not None else []
+    shape = shape or fieldsets.full(Enrollment)
+    q = select_shape(mappers.enrollments, shape, keys, required)
+    return ListQuery(
+        q + where_clause(wheres) + order,
+        p,
+        keys,
+        limit,
+        mappers.partial(mappers.enrollments, shape),
+    )
+
+
+def list_enrollments(db: sqlite3.Connection, *args, **kwargs) -> Page[Enrollment]:
+    return enrollments_query(*args, **kwargs).fetch(db)
+
+
+def waitlist_query(
     user_section_ids: list[tuple[int, int]] | None = None,
-) -> list[Waitlist]:
-    q = """
-        SELECT
-            waitlist.*,
-            sections.*,
-            courses.*,
-            departments.*,
-            users.*,
-            instructors.*
-        FROM waitlist
-        INNER JOIN users ON users.id = waitlist.user_id
-        INNER JOIN sections ON sections.id = waitlist.section_id
-        INNER JOIN courses ON courses.id = sections.course_id
-        INNER JOIN departments ON departments.id = courses.department_id
-        INNER JOIN users AS instructors ON instructors.id = sections.instructor_id
-    """
-    p = []
+    *,
+    user_id: int | None = None,
+    section_id: int | None = None,
+    course_id: int | None = None,
+    instructor_id: int | None = None,
+    deleted: bool | None = None,
+    limit: int | None = None,
+    after: str | None = None,
+    shape: fieldsets.Shape | None = None,
+) -> ListQuery[Waitlist]:
+    """
+    Lists waitlist entries matching all of the given filters. user_id matches
+    the waitlisted user, and instructor_id matches the instructor of the
+    section. If both are given, entries matching either are listed.
+    """
+    p: dict[str, Any] = {}
+    wheres = []
     if user_section_ids is not None:
-        q += "WHERE (users.id, sections.id) IN (%s)" % ",".join(
-            ["(?, ?)"] * len(user_section_ids)
-        )
-        p = [item for sublist in user_section_ids for item in sublist]  # flatten list
-
-    rows = fetch_rows(db, q, p)
-    return [
-        Waitlist(
-            **extract_row(row, "waitlist"),
-            user=User(**extract_row(row, "users")),
-            section=Section(
-                **extract_row(row, "sections"),
-                course=Course(
-                    **extract_row(row, "courses"),
-                    department=Department(
-                        **extract_row(row, "departments"),
-                    ),
-                ),
-                instructor=User(**extract_row(row, "instructors")),
-            ),
+        wheres.append(user_section_condition(p, "waitlist", user_section_ids))
+    if section_id is not None:
+        wheres.append("waitlist.section_id = :section_id")
+        p["section_id"] = section_id
+    if course_id is not None:
+        wheres.append("sections.course_id = :course_id")
+        p["course_id"] = course_id
+    if deleted is not None:
+        wheres.append(deleted_condition(deleted))
+
+    members = []
+    if user_id is not None:
+        members.append("waitlist.user_id = :user_id")
+        p["user_id"] = user_id
+    if instructor_id is not None:
+        # Written against waitlist.section_id so that SQLite can answer each
+        # side of the OR with an index on waitlist.
+        members.append(
+            """
+            waitlist.section_id IN (
+                SELECT id FROM sections WHERE instructor_id = :instructor_id
+            )
+            """
         )
-        for row in rows
-    ]
+        p["instructor_id"] = instructor_id
+    if members:
+        wheres.append("(%s)" % " OR ".join(members))
+
+    if section_id is not None:
+        keys = ["waitlist.ticket"]
+    elif user_id is not None and instructor_id is None:
+        keys = ["waitlist.section_id"]
+    else:
+        keys = ["waitlist.section_id", "waitlist.ticket"]
+    order = keyset_clause(p, wheres, keys, limit, after)
+
+    # An entry's position is the number of entries in its section with a ticket
+    # up to and including its own, which the (section_id, ticket) index counts
+    # without visiting the table.
+    position = """(
+        SELECT COUNT(*) FROM waitlist AS ahead
+        WHERE ahead.section_id = waitlist.section_id AND ahead.ticket <= waitlist.ticket
+    )"""
+    required = ["sections"] if course_id is not None or deleted is not None else []
+    shape = shape or fieldsets.full(Waitlist)
+    q = select_shape(
+        mappers.waitlist,
+        shape,
+        keys,
+        required,
+        {"waitlist.position": position},
+    )
+    return ListQuery(
+        q + where_clause(wheres) + order,
+        p,
+        keys,
+        limit,
+        mappers.partial(mappers.waitlist, shape),
+    )
+
+
+def list_waitlist(db: sqlite3.Connection, *args, **kwargs) -> Page[Waitlist]:
+    return waitlist_query(*args, **kwargs).fetch(db)
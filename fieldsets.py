@@ -0,0 +1,197 @@
+import functools
+from dataclasses import dataclass
+from typing import Any, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel, create_model
+
+# The most partial models kept at once. Each distinct combination of fields
+# and expansions that clients ask for makes one for every level it reaches.
+MAX_PARTIAL_MODELS = 256
+
+
+@dataclass(frozen=True)
+class Shape:
+    """
+    The fields of a model that a response includes. Fields of nested models
+    are either expanded into objects with shapes of their own, or collapsed to
+    the id of the object they refer to. A field that is both is collapsed, and
+    the object it refers to is side-loaded with the shape given.
+    """
+
+    scalars: tuple[str, ...]
+    refs: tuple[str, ...] = ()
+    nested: tuple[tuple[str, "Shape"], ...] = ()
+
+    def child(self, name: str) -> "Shape | None":
+        return dict(self.nested).get(name)
+
+
+# The shape of a nested model that is only joined, not selected.
+EMPTY = Shape(())
+
+
+def nested_model(model: Type[BaseModel], name: str) -> Type[BaseModel] | None:
+    """
+    Returns the model of the field name if it holds a nested model.
+    """
+    annotation = model.model_fields[name].annotation
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    return None
+
+
+@functools.cache
+def full(model: Type[BaseModel]) -> Shape:
+    """
+    Returns the shape of model with every field included and expanded.
+    """
+    scalars = []
+    nested = []
+    for name in model.model_fields:
+        child = nested_model(model, name)
+        if child is None:
+            scalars.append(name)
+        else:
+            nested.append((name, full(child)))
+    return Shape(tuple(scalars), (), tuple(nested))
+
+
+@functools.lru_cache(maxsize=MAX_PARTIAL_MODELS)
+def sideloaded(model: Type[BaseModel], shape: Shape | None = None) -> Shape:
+    """
+    Returns shape, by default the full shape of model, with every nested model
+    collapsed to its id and side-loaded in full, along with the models that
+    it refers to in turn.
+    """
+    shape = shape or full(model)
+    names = shape.refs + tuple(name for name, _ in shape.nested)
+    refs = [name for name in model.model_fields if name in names]
+    nested = []
+    for name in refs:
+        child = nested_model(model, name)
+        assert child is not None
+        nested.append((name, sideloaded(child)))
+    return Shape(shape.scalars, tuple(refs), tuple(nested))
+
+
+def split(value: str | None) -> list[str]:
+    return [name.strip() for name in (value or "").split(",") if name.strip()]
+
+
+def parse(model: Type[BaseModel], fields: str | None, expand: str | None) -> Shape:
+    """
+    Returns the shape of model that the fields and expand query parameters ask
+    for, or the full shape if neither is given.
+
+    Both are comma-separated lists of dotted paths. Given either, nested models
+    are collapsed to their ids unless their path is in expand. A level with
+    paths in fields includes only those fields, and naming a field of a nested
+    model, or expanding one, expands the models above it. Raises a 400 for
+    paths that don't exist, and for expanding a field that fields leaves out.
+    """
+    field_paths = split(fields)
+    expand_paths = split(expand)
+    if not field_paths and not expand_paths:
+        return full(model)
+
+    expanded = set(expand_paths)
+    for path in field_paths + expand_paths:
+        parts = path.split(".")
+        expanded.update(".".join(parts[:i]) for i in range(1, len(parts)))
+
+    for path in field_paths:
+        resolve(model, path)
+    for path in expanded:
+        if resolve(model, path) is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Field {path} is not an object and can't be expanded.",
+            )
+    for path in expand_paths:
+        parts = path.split(".")
+        for i in range(len(parts)):
+            prefix = "".join(part + "." for part in parts[:i])
+            if not included(frozenset(field_paths), prefix, parts[i]):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Field {path} is expanded but not in fields.",
+                )
+
+    return build(model, frozenset(field_paths), frozenset(expanded), "")
+
+
+def resolve(model: Type[BaseModel], path: str) -> Type[BaseModel] | None:
+    """
+    Returns the model of the field at path if it holds a nested model, or
+    raises a 400 if there is no such field.
+    """
+    current: Type[BaseModel] | None = model
+    for name in path.split("."):
+        if current is None or name not in current.model_fields:
+            raise HTTPException(status_code=400, detail=f"Unknown field {path}.")
+        current = nested_model(current, name)
+    return current
+
+
+def named(fields: frozenset[str], prefix: str) -> set[str]:
+    """
+    Returns the fields named by the paths in fields at the level of prefix,
+    which is empty or ends with a dot.
+    """
+    return {
+        path[len(prefix) :].split(".")[0] for path in fields if path.startswith(prefix)
+    }
+
+
+def included(fields: frozenset[str], prefix: str, name: str) -> bool:
+    """
+    Returns whether the field name at the level of prefix is included, which
+    it is if fields names it or names nothing at that level.
+    """
+    names = named(fields, prefix)
+    return not names or name in names
+
+
+def build(
+    model: Type[BaseModel],
+    fields: frozenset[str],
+    expanded: frozenset[str],
+    prefix: str,
+) -> Shape:
+    scalars = []
+    refs = []
+    nested = []
+    for name in model.model_fields:
+        if not included(fields, prefix, name):
+            continue
+        child = nested_model(model, name)
+        if child is None:
+            scalars.append(name)
+        elif prefix + name in expanded:
+            nested.append((name, build(child, fields, expanded, prefix + name + ".")))
+        else:
+            refs.append(name)
+    return Shape(tuple(scalars), tuple(refs), tuple(nested))
+
+
+@functools.lru_cache(maxsize=MAX_PARTIAL_MODELS)
+def partial_model(model: Type[BaseModel], shape: Shape) -> Type[BaseModel]:
+    """
+    Returns a model with only the fields of shape, in the order of model, with
+    collapsed nested models as ints. The full shape gives back model itself.
+    """
+    if shape == full(model):
+        return model
+
+    definitions: dict[str, Any] = {}
+    for name, field in model.model_fields.items():
+        if name in shape.scalars:
+            definitions[name] = (field.annotation, ...)
+        elif name in shape.refs:
+            definitions[name] = (int, ...)
+        elif (child := shape.child(name)) is not None:
+            child_model = nested_model(model, name)
+            assert child_model is not None
+            definitions[name] = (partial_model(child_model, child), ...)
+    return create_model(model.__name__, **definitions)
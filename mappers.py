@@ -0,0 +1,176 @@
+import functools
+import operator
+import sqlite3
+from typing import Any, Callable, Generic, Sequence, Type, TypeVar
+
+from pydantic import BaseModel
+
+import fieldsets
+from models import *
+
+T = TypeVar("T", bound=BaseModel)
+
+# The most statements whose layouts each mapper remembers. Statements are
+# built from a handful of optional filters, so there are only a few per query.
+MAX_LAYOUTS = 256
+
+
+class RowMapper(Generic[T]):
+    """
+    Builds a model from the columns of one table in a row, and the model's
+    nested fields from the columns of other tables in the same row. Columns are
+    named like "table.column", as with full_column_names.
+
+    The first time a mapper sees a statement, it works out which positions in
+    the row hold each field, and keeps that layout for every later row of the
+    statement. A row is then mapped by position, without building a dict of
+    the whole row or comparing column names.
+
+    Models of the same kind are collected under the same name when they are
+    side-loaded, such as users and instructors under "users".
+    """
+
+    def __init__(
+        self,
+        model: Type[T],
+        table: str,
+        nested: dict[str, "RowMapper"] | None = None,
+        collection: str | None = None,
+        included: dict[str, "RowMapper"] | None = None,
+    ):
+        self.model = model
+        self.table = table
+        self.nested = nested or {}
+        self.collection = collection or table
+        # The mappers of the models that fields collapsed to ids refer to.
+        self.included = included or {}
+        self.layouts: dict[str, Callable[[sqlite3.Row], dict[str, Any]]] = {}
+
+    def compile(self, columns: Sequence[str]) -> Callable[[sqlite3.Row], dict]:
+        """
+        Returns a function that gathers this mapper's fields from a row with the
+        given columns, as a dict ready to be validated by the model.
+        """
+        prefix = self.table + "."
+        names = []
+        indices = []
+        for i, column in enumerate(columns):
+            name = column[len(prefix) :]
+            if column.startswith(prefix) and name in self.model.model_fields:
+                names.append(name)
+                indices.append(i)
+
+        # itemgetter returns a bare value rather than a tuple for one index, and
+        # needs at least one. A partial model may have only nested fields.
+        if len(indices) == 0:
+            getter: Callable = lambda row: ()
+        elif len(indices) == 1:
+            index = indices[0]
+            getter = lambda row: (row[index],)
+        else:
+            getter = operator.itemgetter(*indices)
+
+        nested = [
+            (field, mapper.compile(columns)) for field, mapper in self.nested.items()
+        ]
+
+        def build(row: sqlite3.Row) -> dict[str, Any]:
+            d = dict(zip(names, getter(row)))
+            for field, build_nested in nested:
+                d[field] = build_nested(row)
+            return d
+
+        return build
+
+    def layout(
+        self,
+        sql: str,
+        row: sqlite3.Row,
+    ) -> Callable[[sqlite3.Row], dict[str, Any]]:
+        """
+        Returns the compiled layout of the statement sql, compiling it from the
+        columns of row if this is the first row of the statement.
+        """
+        build = self.layouts.get(sql)
+        if build is None:
+            if len(self.layouts) >= MAX_LAYOUTS:
+                self.layouts.clear()
+            build = self.layouts[sql] = self.compile(row.keys())
+        return build
+
+    def __call__(self, sql: str, row: sqlite3.Row) -> T:
+        """
+        Maps a row returned by the statement sql. The whole nested model is
+        validated in one call.
+        """
+        return self.model.model_validate(self.layout(sql, row)(row))
+
+    def include(
+        self,
+        sql: str,
+        row: sqlite3.Row,
+        included: dict[str, dict[int, BaseModel]],
+    ):
+        """
+        Adds the models that the row's model refers to, and those that they
+        refer to in turn, to included by collection and id. Each model is
+        built only the first time its id is seen.
+        """
+        for field, mapper in self.included.items():
+            id = row[f"{self.table}.{field}"]
+            models = included.setdefault(mapper.collection, {})
+            if id not in models:
+                models[id] = mapper(sql, row)
+                mapper.include(sql, row, included)
+
+    def tables(self) -> set[str]:
+        """
+        Returns the tables that this mapper and its nested mappers read from.
+        """
+        tables = {self.table}
+        for mapper in self.nested.values():
+            tables |= mapper.tables()
+        return tables
+
+
+@functools.lru_cache(maxsize=fieldsets.MAX_PARTIAL_MODELS)
+def partial(mapper: RowMapper, shape: fieldsets.Shape) -> RowMapper:
+    """
+    Returns a mapper that builds the partial model of shape from the same
+    tables as mapper. Collapsed nested models are read from a column of the
+    parent's table named after the field. The full shape gives back mapper.
+    """
+    model = fieldsets.partial_model(mapper.model, shape)
+    if model is mapper.model:
+        return mapper
+
+    nested = {}
+    included = {}
+    for name, child in shape.nested:
+        if name in shape.refs:
+            included[name] = partial(mapper.nested[name], child)
+        else:
+            nested[name] = partial(mapper.nested[name], child)
+    return RowMapper(model, mapper.table, nested, mapper.collection, included)
+
+
+users = RowMapper(User, "users")
+instructors = RowMapper(User, "instructors", collection="users")
+courses = RowMapper(
+    Course, "courses", {"department": RowMapper(Department, "departments")}
+)
+sections = RowMapper(
+    Section,
+    "sections",
+    {"course": courses, "instructor": instructors},
+)
+enrollments = RowMapper(
+    Enrollment,
+    "enrollments",
+    {"user": users, "section": sections},
+)
+waitlist = RowMapper(
+    Waitlist,
+    "waitlist",
+    {"user": users, "section": sections},
+)
@@ -0,0 +1,394 @@
+import bisect
+import contextlib
+import contextvars
+import hashlib
+import itertools
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# A request that runs the same statement this many times or more is flagged
+# as a likely N+1 pattern, where a loop runs one query per item instead of one
+# query for all of them.
+N_PLUS_ONE_THRESHOLD = 10
+
+# The number of distinct SQL strings whose fingerprints are remembered.
+MAX_FINGERPRINTS = 1024
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1)
+
+# Upper bounds of the statements-per-request histogram buckets.
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+
+class Histogram:
+    """
+    A Prometheus histogram with a fixed set of labels.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...],
+        buckets: tuple[float, ...],
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: dict[tuple[str, ...], list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple[str, ...], value: float):
+        # Observations are counted in the first bucket that holds them, and the
+        # counts are only made cumulative when rendered.
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # Bucket counts, including +Inf, then the sum of observations.
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            pairs = list(zip(self.labels, labels))
+            bounds = [repr(float(bound)) for bound in self.buckets] + ["+Inf"]
+            counts = list(itertools.accumulate(values[:-1]))
+            for bound, count in zip(bounds, counts):
+                le = format_labels(pairs + [("le", bound)])
+                yield f"{self.name}_bucket{le} {count}"
+            yield f"{self.name}_sum{format_labels(pairs)} {values[-1]}"
+            yield f"{self.name}_count{format_labels(pairs)} {counts[-1]}"
+
+
+class Counter:
+    """
+    A Prometheus counter with a fixed set of labels.
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple[str, ...], value: float = 1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            series = dict(self._series)
+        for labels, value in sorted(series.items()):
+            yield f"{self.name}{format_labels(zip(self.labels, labels))} {value}"
+
+
+def format_labels(pairs: Iterable[tuple[str, str]]) -> str:
+    escaped = (
+        '%s="%s"'
+        % (
+            name,
+            value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle a request, until the response body is sent.",
+    ("method", "route", "status"),
+    REQUEST_BUCKETS,
+)
+request_statements = Histogram(
+    "http_request_sql_statements",
+    "SQL statements run to handle a request.",
+    ("method", "route"),
+    STATEMENT_BUCKETS,
+)
+request_sql_duration = Histogram(
+    "http_request_sql_duration_seconds",
+    "Time spent running SQL statements to handle a request.",
+    ("method", "route"),
+    REQUEST_BUCKETS,
+)
+query_duration = Histogram(
+    "sql_query_duration_seconds",
+    "Time to run a statement and fetch its rows, by statement fingerprint.",
+    ("fingerprint",),
+    QUERY_BUCKETS,
+)
+n_plus_one = Counter(
+    "sql_n_plus_one_total",
+    f"Requests that ran one statement {N_PLUS_ONE_THRESHOLD} or more times.",
+    ("method", "route", "fingerprint"),
+)
+enrollment_admissions = Counter(
+    "enrollment_admissions_total",
+    "Attempts to enroll in a section, by outcome.",
+    ("result",),
+)
+busy_retries = Counter(
+    "sql_busy_retries_total",
+    "Write transactions retried because another process held the lock.",
+    ("step",),
+)
+waitlist_promotions = Counter(
+    "waitlist_promotions_total",
+    "Students moved off a waitlist into a free seat, by what found the seat.",
+    ("source",),
+)
+
+# The normalized statement of each fingerprint, exported as labels of an info
+# metric so that the other metrics can use the short fingerprint.
+_statements: dict[str, str] = {}
+_fingerprints: dict[str, str] = {}
+_fingerprints_lock = threading.Lock()
+
+NORMALIZE_PATTERNS = [
+    (re.compile(r"--[^\n]*"), ""),
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"(?<![\w.])\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"[:@$]\w+"), "?"),
+    (re.compile(r"\s+"), " "),
+    # Lists of any length, such as the placeholders of a multi-row insert.
+    (re.compile(r"\?(?: ?, ?\?)+"), "?, ..."),
+]
+
+
+def normalize(sql: str) -> str:
+    """
+    Reduces a statement to its shape, replacing literals and parameters with
+    placeholders, so that statements that differ only in their values match.
+    """
+    for pattern, replacement in NORMALIZE_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(sql: str) -> str:
+    id = _fingerprints.get(sql)
+    if id is None:
+        statement = normalize(sql)
+        id = hashlib.blake2b(statement.encode(), digest_size=4).hexdigest()
+        with _fingerprints_lock:
+            # Statements are built from a fixed set of templates, so this is
+            # only reached if something builds SQL from values.
+            if len(_fingerprints) >= MAX_FINGERPRINTS:
+                _fingerprints.clear()
+            _fingerprints[sql] = id
+            _statements[id] = statement
+    return id
+
+
+@dataclass
+class RequestMetrics:
+    """
+    What one request spent its time on. Statements may be recorded from the
+    executor or writer threads that run the request's queries.
+    """
+
+    statements: dict[str, int] = field(default_factory=dict)
+    sql_seconds: float = 0.0
+    phases: dict[str, float] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @property
+    def statement_count(self) -> int:
+        return sum(self.statements.values())
+
+    def record(self, id: str, seconds: float):
+        with self.lock:
+            self.statements[id] = self.statements.get(id, 0) + 1
+            self.sql_seconds += seconds
+
+    def add_phase(self, name: str, seconds: float):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def repeated(self) -> dict[str, int]:
+        return {
+            id: count
+            for id, count in self.statements.items()
+            if count >= N_PLUS_ONE_THRESHOLD
+        }
+
+    def server_timing(self, total: float) -> str:
+        timings = [
+            'db;dur=%.3f;desc="statements=%d"'
+            % (self.sql_seconds * 1000, self.statement_count)
+        ]
+        for name, seconds in self.phases.items():
+            timings.append(f"{name};dur={seconds * 1000:.3f}")
+        for id, count in self.repeated().items():
+            timings.append(f'n-plus-one;desc="{id} x{count}"')
+        timings.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(timings)
+
+
+current_request: contextvars.ContextVar[RequestMetrics | None] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+# Set while a statement is being timed, so that the connection's own timing of
+# execute doesn't count the statement a second time.
+_timing: contextvars.ContextVar[bool] = contextvars.ContextVar("timing", default=False)
+
+
+class StatementTimer:
+    """
+    Times one statement, which may be executed and fetched in several separate
+    steps, and records it once finished.
+    """
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.seconds = 0.0
+        self._nested = False
+
+    def __enter__(self):
+        self._nested = _timing.get()
+        self._token = _timing.set(True)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds += time.perf_counter() - self._start
+        _timing.reset(self._token)
+
+    def record(self):
+        if self._nested:
+            return
+        id = fingerprint(self.sql)
+        query_duration.observe((id,), self.seconds)
+        request = current_request.get()
+        if request is not None:
+            request.record(id, self.seconds)
+
+
+@contextlib.contextmanager
+def statement(sql: str) -> Iterator[None]:
+    timer = StatementTimer(sql)
+    try:
+        with timer:
+            yield
+    finally:
+        timer.record()
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Adds the time spent in the block to the named phase of the current
+    request, such as hydrating models from rows.
+    """
+    request = current_request.get()
+    if request is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request.add_phase(name, time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    """
+    Collects the statements each request runs, reports them in a Server-Timing
+    header, and records the request in the histograms served by /metrics.
+
+    Server-Timing is sent with the response headers, so it covers everything
+    up to the start of the response. For streamed responses, the histograms
+    also cover the time spent streaming the body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestMetrics()
+        token = current_request.set(request)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = request.server_timing(time.perf_counter() - start)
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timing.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            self.finish(scope, request, status, time.perf_counter() - start)
+
+    def finish(self, scope, request: RequestMetrics, status: int, seconds: float):
+        route = getattr(scope.get("route"), "path", "unmatched")
+        method = scope["method"]
+        request_duration.observe((method, route, str(status)), seconds)
+        request_statements.observe((method, route), request.statement_count)
+        request_sql_duration.observe((method, route), request.sql_seconds)
+        for id, count in request.repeated().items():
+            n_plus_one.inc((method, route, id))
+            logger.warning(
+                "%s %s ran %d times in one request: %s",
+                method,
+                route,
+                count,
+                _statements.get(id, id),
+            )
+
+
+def render() -> str:
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in [
+        request_duration,
+        request_statements,
+        request_sql_duration,
+        query_duration,
+        n_plus_one,
+        enrollment_admissions,
+        busy_retries,
+        waitlist_promotions,
+    ]:
+        lines.extend(metric.render())
+
+    lines.append("# HELP sql_statement_info The statement of each fingerprint.")
+    lines.append("# TYPE sql_statement_info gauge")
+    with _fingerprints_lock:
+        statements = dict(_statements)
+    for id, sql in sorted(statements.items()):
+        labels = format_labels([("fingerprint", id), ("statement", sql)])
+        lines.append(f"sql_statement_info{labels} 1")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,21 @@
+-- Look up a section's roster by status, such as its enrolled students.
+CREATE INDEX enrollments_section_status ON enrollments (section_id, status);
+
+-- Look up a user's enrollments by status. The primary key already covers
+-- lookups by user_id alone.
+CREATE INDEX enrollments_user_status ON enrollments (user_id, status);
+
+-- Look up a section's waitlist in order. The primary key already covers
+-- lookups by user_id.
+CREATE INDEX waitlist_section_position ON waitlist (section_id, position);
+
+CREATE INDEX courses_department ON courses (department_id);
+
+-- These also serve the foreign key checks made when a course or user is
+-- modified, which is why they cannot be partial.
+CREATE INDEX sections_course ON sections (course_id, deleted);
+CREATE INDEX sections_instructor ON sections (instructor_id, deleted);
+
+-- Deleted sections are never listed, so they are left out of this index.
+-- Queries must spell out "sections.deleted = FALSE" for SQLite to use it.
+CREATE INDEX sections_active ON sections (id) WHERE deleted = FALSE;
@@ -0,0 +1,88 @@
+-- Keep running counts of each section's enrolled students and waitlist
+-- entries, and of each user's waitlist entries, so that admission checks read
+-- a single row instead of counting. The triggers below keep them up to date;
+-- ./schema_init.py --check-counters recomputes them from scratch.
+ALTER TABLE sections ADD COLUMN enrolled_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE sections ADD COLUMN waitlist_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN waitlist_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE sections SET
+    enrolled_count = (
+        SELECT COUNT(*) FROM enrollments
+        WHERE
+            enrollments.section_id = sections.id
+            AND enrollments.status = 'Enrolled'
+    ),
+    waitlist_count = (
+        SELECT COUNT(*) FROM waitlist
+        WHERE waitlist.section_id = sections.id
+    );
+
+UPDATE users SET
+    waitlist_count = (
+        SELECT COUNT(*) FROM waitlist
+        WHERE waitlist.user_id = users.id
+    );
+
+CREATE TRIGGER enrollments_count_insert
+AFTER INSERT ON enrollments
+WHEN new.status = 'Enrolled'
+BEGIN
+    UPDATE sections SET enrolled_count = enrolled_count + 1
+    WHERE id = new.section_id;
+END;
+
+CREATE TRIGGER enrollments_count_delete
+AFTER DELETE ON enrollments
+WHEN old.status = 'Enrolled'
+BEGIN
+    UPDATE sections SET enrolled_count = enrolled_count - 1
+    WHERE id = old.section_id;
+END;
+
+CREATE TRIGGER enrollments_count_update
+AFTER UPDATE OF status, section_id ON enrollments
+WHEN old.status = 'Enrolled' OR new.status = 'Enrolled'
+BEGIN
+    UPDATE sections SET enrolled_count = enrolled_count - 1
+    WHERE id = old.section_id AND old.status = 'Enrolled';
+
+    UPDATE sections SET enrolled_count = enrolled_count + 1
+    WHERE id = new.section_id AND new.status = 'Enrolled';
+END;
+
+CREATE TRIGGER waitlist_count_insert
+AFTER INSERT ON waitlist
+BEGIN
+    UPDATE sections SET waitlist_count = waitlist_count + 1
+    WHERE id = new.section_id;
+
+    UPDATE users SET waitlist_count = waitlist_count + 1
+    WHERE id = new.user_id;
+END;
+
+CREATE TRIGGER waitlist_count_delete
+AFTER DELETE ON waitlist
+BEGIN
+    UPDATE sections SET waitlist_count = waitlist_count - 1
+    WHERE id = old.section_id;
+
+    UPDATE users SET waitlist_count = waitlist_count - 1
+    WHERE id = old.user_id;
+END;
+
+CREATE TRIGGER waitlist_count_update
+AFTER UPDATE OF section_id, user_id ON waitlist
+BEGIN
+    UPDATE sections SET waitlist_count = waitlist_count - 1
+    WHERE id = old.section_id;
+
+    UPDATE users SET waitlist_count = waitlist_count - 1
+    WHERE id = old.user_id;
+
+    UPDATE sections SET waitlist_count = waitlist_count + 1
+    WHERE id = new.section_id;
+
+    UPDATE users SET waitlist_count = waitlist_count + 1
+    WHERE id = new.user_id;
+END;
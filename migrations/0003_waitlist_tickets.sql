@@ -0,0 +1,27 @@
+-- Waitlist entries used to store their 1-based position, which meant that
+-- every drop had to renumber the entries after it. They now store a ticket
+-- that only orders entries within a section, and positions are computed when
+-- read by counting the tickets up to and including an entry's own.
+--
+-- Existing positions could contain duplicates, so tickets are first renumbered
+-- in the order the entries were made.
+UPDATE waitlist SET position = ranked.ticket
+FROM (
+    SELECT
+        user_id,
+        section_id,
+        ROW_NUMBER() OVER (
+            PARTITION BY section_id
+            ORDER BY position, date, user_id
+        ) AS ticket
+    FROM waitlist
+) AS ranked
+WHERE
+    waitlist.user_id = ranked.user_id
+    AND waitlist.section_id = ranked.section_id;
+
+ALTER TABLE waitlist RENAME COLUMN position TO ticket;
+
+DROP INDEX waitlist_section_position;
+
+CREATE UNIQUE INDEX waitlist_section_ticket ON waitlist (section_id, ticket);
@@ -0,0 +1,11 @@
+-- List routes page through enrollments ordered by (section_id, user_id), so
+-- the roster indexes carry the other half of the key. That way a page is a
+-- range read on the index rather than a sort of the whole roster.
+DROP INDEX enrollments_section_status;
+DROP INDEX enrollments_user_status;
+
+CREATE INDEX enrollments_section_status
+ON enrollments (section_id, status, user_id);
+
+CREATE INDEX enrollments_user_status
+ON enrollments (user_id, status, section_id);
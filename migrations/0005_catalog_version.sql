@@ -0,0 +1,82 @@
+-- Count changes to the catalog, so that each server process can tell when
+-- another one has changed it and drop its cached catalog responses. Only the
+-- columns that appear in catalog responses count, since the counter triggers
+-- update sections and users on every enrollment.
+CREATE TABLE catalog_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+
+INSERT INTO catalog_version (id, version) VALUES (1, 0);
+
+CREATE TRIGGER catalog_version_departments_insert
+AFTER INSERT ON departments
+BEGIN
+    UPDATE catalog_version SET version = version + 1;
+END;
+
+CREATE TRIGGER catalog_version_departments_update
+AFTER UPDATE ON departments
+BEGIN
+    UPDATE catalog_version SET version = version + 1;
+END;
+
+CREATE TRIGGER catalog_version_departments_delete
+AFTER DELETE ON departments
+BEGIN
+    UPDATE catalog_version SET version = version + 1;
+END;
+
+CREATE TRIGGER catalog_version_courses_insert
+AFTER INSERT ON courses
+BEGIN
+    UPDATE catalog_version SET version = version + 1;
+END;
+
+CREATE TRIGGER catalog_version_courses_update
+AFTER UPDATE ON courses
+BEGIN
+    UPDATE catalog_version SET version = version + 1;
+END;
+
+CREATE TRIGGER catalog_version_courses_delete
+AFTER DELETE ON courses
+BEGIN
+    UPDATE catalog_version SET version = version + 1;
+END;
+
+CREATE TRIGGER catalog_version_sections_insert
+AFTER INSERT ON sections
+BEGIN
+    UPDATE catalog_version SET version = version + 1;
+END;
+
+CREATE TRIGGER catalog_version_sections_update
+AFTER UPDATE OF
+    course_id,
+    classroom,
+    capacity,
+    waitlist_capacity,
+    day,
+    begin_time,
+    end_time,
+    instructor_id,
+    freeze,
+    deleted
+ON sections
+BEGIN
+    UPDATE catalog_version SET version = version + 1;
+END;
+
+CREATE TRIGGER catalog_version_sections_delete
+AFTER DELETE ON sections
+BEGIN
+    UPDATE catalog_version SET version = version + 1;
+END;
+
+-- Sections name their instructor.
+CREATE TRIGGER catalog_version_users_update
+AFTER UPDATE OF first_name, last_name, role ON users
+BEGIN
+    UPDATE catalog_version SET version = version + 1;
+END;
@@ -0,0 +1,84 @@
+-- Keep each section's meeting time as an interval of minutes since Monday
+-- midnight, parsed from its day ('Tuesday') and times ('7pm', '9:45pm' or
+-- '19:00'), so that schedules can be filtered and compared in SQL. The
+-- columns are generated, so every way of adding or changing a section keeps
+-- them current without a trigger, and they are NULL where the text can't be
+-- parsed. A meeting starts and ends on the same day.
+ALTER TABLE sections ADD COLUMN meeting_start INTEGER GENERATED ALWAYS AS (
+    CASE lower(trim(day))
+        WHEN 'monday' THEN 0
+        WHEN 'tuesday' THEN 1
+        WHEN 'wednesday' THEN 2
+        WHEN 'thursday' THEN 3
+        WHEN 'friday' THEN 4
+        WHEN 'saturday' THEN 5
+        WHEN 'sunday' THEN 6
+    END * 1440
+    + CASE
+        WHEN
+            (
+                lower(replace(begin_time, ' ', '')) GLOB '[0-9][ap]m'
+                OR lower(replace(begin_time, ' ', '')) GLOB '[0-9][0-9][ap]m'
+                OR lower(replace(begin_time, ' ', '')) GLOB '[0-9]:[0-5][0-9][ap]m'
+                OR lower(replace(begin_time, ' ', '')) GLOB '[0-9][0-9]:[0-5][0-9][ap]m'
+            )
+            AND CAST(begin_time AS INTEGER) BETWEEN 1 AND 12
+        THEN
+            CAST(begin_time AS INTEGER) % 12 * 60
+            + CAST(substr(begin_time, instr(begin_time, ':') + 1) AS INTEGER)
+                * (instr(begin_time, ':') > 0)
+            + 720 * (lower(begin_time) GLOB '*pm')
+        WHEN
+            (
+                trim(begin_time) GLOB '[0-9]:[0-5][0-9]'
+                OR trim(begin_time) GLOB '[0-9][0-9]:[0-5][0-9]'
+            )
+            AND CAST(begin_time AS INTEGER) < 24
+        THEN
+            CAST(begin_time AS INTEGER) * 60
+            + CAST(substr(begin_time, instr(begin_time, ':') + 1) AS INTEGER)
+    END
+) VIRTUAL;
+
+ALTER TABLE sections ADD COLUMN meeting_end INTEGER GENERATED ALWAYS AS (
+    CASE lower(trim(day))
+        WHEN 'monday' THEN 0
+        WHEN 'tuesday' THEN 1
+        WHEN 'wednesday' THEN 2
+        WHEN 'thursday' THEN 3
+        WHEN 'friday' THEN 4
+        WHEN 'saturday' THEN 5
+        WHEN 'sunday' THEN 6
+    END * 1440
+    + CASE
+        WHEN
+            (
+                lower(replace(end_time, ' ', '')) GLOB '[0-9][ap]m'
+                OR lower(replace(end_time, ' ', '')) GLOB '[0-9][0-9][ap]m'
+                OR lower(replace(end_time, ' ', '')) GLOB '[0-9]:[0-5][0-9][ap]m'
+                OR lower(replace(end_time, ' ', '')) GLOB '[0-9][0-9]:[0-5][0-9][ap]m'
+            )
+            AND CAST(end_time AS INTEGER) BETWEEN 1 AND 12
+        THEN
+            CAST(end_time AS INTEGER) % 12 * 60
+            + CAST(substr(end_time, instr(end_time, ':') + 1) AS INTEGER)
+                * (instr(end_time, ':') > 0)
+            + 720 * (lower(end_time) GLOB '*pm')
+        WHEN
+            (
+                trim(end_time) GLOB '[0-9]:[0-5][0-9]'
+                OR trim(end_time) GLOB '[0-9][0-9]:[0-5][0-9]'
+            )
+            AND CAST(end_time AS INTEGER) < 24
+        THEN
+            CAST(end_time AS INTEGER) * 60
+            + CAST(substr(end_time, instr(end_time, ':') + 1) AS INTEGER)
+    END
+) VIRTUAL;
+
+-- Finds the sections that meet in a window of the week, and those that
+-- overlap a given meeting. The index stores the computed values, so reading
+-- it doesn't parse anything.
+CREATE INDEX sections_meeting
+ON sections (meeting_start, meeting_end)
+WHERE deleted = FALSE;
@@ -0,0 +1,133 @@
+-- Full-text indexes of the catalog, so that a search box can find courses and
+-- sections by code, name, department, instructor or classroom with a single
+-- query. Each row's rowid is the id of its course or section, and the
+-- triggers below keep the text in step with the tables it is copied from.
+-- ./schema_init.py rebuilds both after an import, which skips triggers.
+CREATE VIRTUAL TABLE course_search USING fts5 (
+    code,
+    name,
+    department,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE VIRTUAL TABLE section_search USING fts5 (
+    code,
+    name,
+    department,
+    instructor,
+    classroom,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+INSERT INTO course_search (rowid, code, name, department)
+SELECT courses.id, courses.code, courses.name, departments.name
+FROM courses
+INNER JOIN departments ON departments.id = courses.department_id;
+
+INSERT INTO section_search (rowid, code, name, department, instructor, classroom)
+SELECT
+    sections.id,
+    courses.code,
+    courses.name,
+    departments.name,
+    users.first_name || ' ' || users.last_name,
+    sections.classroom
+FROM sections
+INNER JOIN courses ON courses.id = sections.course_id
+INNER JOIN departments ON departments.id = courses.department_id
+INNER JOIN users ON users.id = sections.instructor_id;
+
+CREATE TRIGGER course_search_insert
+AFTER INSERT ON courses
+BEGIN
+    INSERT INTO course_search (rowid, code, name, department)
+    SELECT new.id, new.code, new.name, departments.name
+    FROM departments
+    WHERE departments.id = new.department_id;
+END;
+
+CREATE TRIGGER course_search_update
+AFTER UPDATE OF code, name, department_id ON courses
+BEGIN
+    UPDATE course_search SET
+        code = new.code,
+        name = new.name,
+        department = (SELECT name FROM departments WHERE id = new.department_id)
+    WHERE rowid = new.id;
+
+    UPDATE section_search SET
+        code = new.code,
+        name = new.name,
+        department = (SELECT name FROM departments WHERE id = new.department_id)
+    WHERE rowid IN (SELECT id FROM sections WHERE course_id = new.id);
+END;
+
+CREATE TRIGGER course_search_delete
+AFTER DELETE ON courses
+BEGIN
+    DELETE FROM course_search WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER section_search_insert
+AFTER INSERT ON sections
+BEGIN
+    INSERT INTO section_search (
+        rowid, code, name, department, instructor, classroom
+    )
+    SELECT
+        new.id,
+        courses.code,
+        courses.name,
+        departments.name,
+        users.first_name || ' ' || users.last_name,
+        new.classroom
+    FROM courses
+    INNER JOIN departments ON departments.id = courses.department_id
+    INNER JOIN users ON users.id = new.instructor_id
+    WHERE courses.id = new.course_id;
+END;
+
+CREATE TRIGGER section_search_update
+AFTER UPDATE OF course_id, instructor_id, classroom ON sections
+BEGIN
+    UPDATE section_search SET
+        code = courses.code,
+        name = courses.name,
+        department = departments.name,
+        instructor = users.first_name || ' ' || users.last_name,
+        classroom = new.classroom
+    FROM courses
+    INNER JOIN departments ON departments.id = courses.department_id
+    INNER JOIN users ON users.id = new.instructor_id
+    WHERE section_search.rowid = new.id AND courses.id = new.course_id;
+END;
+
+CREATE TRIGGER section_search_delete
+AFTER DELETE ON sections
+BEGIN
+    DELETE FROM section_search WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER catalog_search_departments_update
+AFTER UPDATE OF name ON departments
+BEGIN
+    UPDATE course_search SET department = new.name
+    WHERE rowid IN (SELECT id FROM courses WHERE department_id = new.id);
+
+    UPDATE section_search SET department = new.name
+    WHERE rowid IN (
+        SELECT sections.id
+        FROM courses
+        INNER JOIN sections ON sections.course_id = courses.id
+        WHERE courses.department_id = new.id
+    );
+END;
+
+CREATE TRIGGER catalog_search_users_update
+AFTER UPDATE OF first_name, last_name ON users
+BEGIN
+    UPDATE section_search SET instructor = new.first_name || ' ' || new.last_name
+    WHERE rowid IN (SELECT id FROM sections WHERE instructor_id = new.id);
+END;
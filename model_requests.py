@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from models import *
 
 
@@ -16,6 +16,36 @@ class CreateEnrollmentResponse(Enrollment):
     waitlist_position: int | None
 
 
+# The most enrollments that can be requested in one call.
+MAX_BATCH_ENROLLMENTS = 1000
+
+
+class CreateEnrollmentsRequestItem(CreateEnrollmentRequest):
+    user: int
+
+
+class CreateEnrollmentsRequest(BaseModel):
+    enrollments: list[CreateEnrollmentsRequestItem] = Field(
+        min_length=1,
+        max_length=MAX_BATCH_ENROLLMENTS,
+    )
+
+
+class CreateEnrollmentsResult(str, Enum):
+    ENROLLED = "Enrolled"
+    WAITLISTED = "Waitlisted"
+    REJECTED = "Rejected"
+
+
+class CreateEnrollmentsResponseItem(BaseModel):
+    user: int
+    section: int
+    result: CreateEnrollmentsResult
+    reason: str | None
+    waitlist_position: int | None
+    enrollment: Enrollment | None
+
+
 class AddCourseRequest(BaseModel):
     code: str
     name: str
@@ -45,5 +75,14 @@ class ListSectionWaitlistItem(BaseModel):
 
 
 class UpdateSectionRequest(BaseModel):
-    freeze: bool | None
-    instructor_id: int | None
+    freeze: bool | None = None
+    instructor_id: int | None = None
+    capacity: int | None = Field(default=None, ge=0)
+
+
+class DeleteSectionResponse(BaseModel):
+    section: int
+    # Users whose enrollments in the section were dropped.
+    dropped: list[int]
+    # Users who were removed from the section's waitlist.
+    unwaitlisted: list[int]
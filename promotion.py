@@ -0,0 +1,312 @@
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import database
+import metrics
+import writer
+
+logger = logging.getLogger(__name__)
+
+# The most sections promoted from in one transaction.
+PROMOTION_BATCH_SIZE = 256
+
+# How often to look for sections with free seats and a waitlist that no route
+# asked about, in seconds. A worker process that stops between committing a
+# drop and promoting from the waitlist leaves such a section behind.
+PROMOTION_SWEEP_INTERVAL = 60.0
+
+
+@dataclass
+class PromoterStats:
+    pending: int
+    passes: int
+    sweeps: int
+    promoted: int
+    failed_passes: int
+
+
+@dataclass
+class PromotionResult:
+    # The (user_id, section_id) pair of every enrollment made.
+    promoted: list[tuple[int, int]]
+    # Sections that still have seats for users who were promoted elsewhere in
+    # the same pass, and need another.
+    unfinished: list[int]
+
+
+def promote_txn(
+    db: sqlite3.Connection,
+    section_ids: list[int] | None = None,
+) -> PromotionResult:
+    """
+    Fills the free seats of the sections, or of every section if section_ids
+    is None, from the heads of their waitlists, in a handful of statements
+    over all of them at once.
+
+    Frozen and deleted sections are skipped, as are waitlist entries whose
+    section meets at the same time as one their user is enrolled in. A user
+    at the head of several waitlists is promoted into the one they joined
+    first, and the others are reported as unfinished, since the next pass has
+    to check the new enrollment for conflicts.
+    """
+    p: dict[str, Any] = {}
+    if section_ids is None:
+        sections = "sections.waitlist_count > 0"
+    else:
+        sections = "sections.id IN (%s)" % database.json_list(
+            p, "section_ids", section_ids
+        )
+
+    db.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS promotion_candidates (
+            user_id INTEGER NOT NULL,
+            section_id INTEGER NOT NULL,
+            promote BOOLEAN NOT NULL,
+            PRIMARY KEY (user_id, section_id)
+        )
+        """
+    )
+    db.execute("DELETE FROM promotion_candidates")
+
+    # Rank each section's waitlist by ticket, keep as many entries as it has
+    # free seats, then keep each user's earliest entry among those.
+    db.execute(
+        """
+        INSERT INTO promotion_candidates (user_id, section_id, promote)
+        SELECT
+            user_id,
+            section_id,
+            ROW_NUMBER() OVER (
+                PARTITION BY user_id ORDER BY date, section_id
+            ) = 1
+        FROM (
+            SELECT
+                waitlist.user_id,
+                waitlist.section_id,
+                waitlist.date,
+                ROW_NUMBER() OVER (
+                    PARTITION BY waitlist.section_id ORDER BY waitlist.ticket
+                ) AS rank,
+                sections.capacity - sections.enrolled_count AS seats
+            FROM sections
+            INNER JOIN waitlist ON waitlist.section_id = sections.id
+            WHERE
+                %s
+                AND sections.capacity > sections.enrolled_count
+                AND sections.freeze = FALSE
+                AND sections.deleted = FALSE
+                AND NOT EXISTS (%s)
+        )
+        WHERE rank <= seats
+        """
+        % (
+            sections,
+            database.schedule_conflicts_sql("waitlist.user_id", "waitlist.section_id"),
+        ),
+        p,
+    )
+
+    db.execute(
+        """
+        DELETE FROM waitlist
+        WHERE (user_id, section_id) IN (
+            SELECT user_id, section_id FROM promotion_candidates WHERE promote
+        )
+        """
+    )
+    # Waitlisted users have a Waitlisted enrollment, which becomes Enrolled.
+    db.execute(
+        """
+        INSERT INTO enrollments (user_id, section_id, status, grade, date)
+        SELECT user_id, section_id, 'Enrolled', NULL, CURRENT_TIMESTAMP
+        FROM promotion_candidates
+        WHERE promote
+        ON CONFLICT (user_id, section_id) DO UPDATE SET
+            status = 'Enrolled',
+            date = excluded.date
+        """
+    )
+
+    promoted = database.fetch_rows(
+        db,
+        "SELECT user_id, section_id FROM promotion_candidates WHERE promote",
+    )
+    unfinished = database.fetch_rows(
+        db,
+        "SELECT DISTINCT section_id FROM promotion_candidates WHERE NOT promote",
+    )
+    return PromotionResult(
+        promoted=[(row[0], row[1]) for row in promoted],
+        unfinished=[row[0] for row in unfinished],
+    )
+
+
+class Promoter:
+    """
+    Promotes students off waitlists in the background. Routes that free seats
+    name their section with request once their change commits, and respond
+    without waiting for it.
+
+    The promoter's thread gathers every section named since its last pass and
+    promotes from all of them in one operation on the writer, so a burst of
+    drops costs a few transactions rather than one each, and a large capacity
+    increase fills every new seat at once. Every so often, it also sweeps all
+    sections for seats that nobody asked about.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = PROMOTION_BATCH_SIZE,
+        sweep_interval: float = PROMOTION_SWEEP_INTERVAL,
+    ):
+        self.batch_size = batch_size
+        self.sweep_interval = sweep_interval
+        self._pending: set[int] = set()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+        self._passes = 0
+        self._sweeps = 0
+        self._promoted = 0
+        self._failed_passes = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="promoter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Finishes promoting from the sections already requested, then stops the
+        thread.
+        """
+        if self._thread is not None:
+            with self._condition:
+                self._stopping = True
+                self._condition.notify()
+            self._thread.join()
+            self._thread = None
+
+    def request(self, section_id: int):
+        """
+        Asks for the section's free seats to be filled from its waitlist.
+        """
+        with self._condition:
+            if self._stopping:
+                return
+            self._pending.add(section_id)
+            self._condition.notify()
+
+    def _run(self):
+        next_sweep = time.monotonic()
+        while True:
+            with self._condition:
+                while not (self._pending or self._stopping):
+                    timeout = next_sweep - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+                section_ids = sorted(self._pending)
+                self._pending.clear()
+                stopping = self._stopping
+
+            if time.monotonic() >= next_sweep and not stopping:
+                next_sweep = time.monotonic() + self.sweep_interval
+                with self._condition:
+                    self._sweeps += 1
+                self._promote(None)
+
+            for i in range(0, len(section_ids), self.batch_size):
+                self._promote(section_ids[i : i + self.batch_size])
+            if stopping:
+                return
+
+    def _promote(self, section_ids: list[int] | None):
+        try:
+            result = writer.get_writer()(promote_txn, section_ids)
+        except Exception:
+            # A failed pass leaves its seats for the next request or sweep.
+            logger.exception("Failed to promote from waitlists")
+            with self._condition:
+                self._passes += 1
+                self._failed_passes += 1
+            return
+
+        if result.promoted:
+            source = "sweep" if section_ids is None else "request"
+            metrics.waitlist_promotions.inc((source,), len(result.promoted))
+        with self._condition:
+            self._passes += 1
+            self._promoted += len(result.promoted)
+            self._pending.update(result.unfinished)
+
+    def stats(self) -> PromoterStats:
+        with self._condition:
+            return PromoterStats(
+                pending=len(self._pending),
+                passes=self._passes,
+                sweeps=self._sweeps,
+                promoted=self._promoted,
+                failed_passes=self._failed_passes,
+            )
+
+
+_promoter: Promoter | None = None
+_promoter_lock = threading.Lock()
+# Set by stop_promoter, so that changes committed during shutdown don't start
+# a new promoter. The sweep on the next start finds their seats.
+_stopped = False
+
+
+def start_promoter() -> Promoter:
+    """
+    Starts the promoter, if it isn't running, and returns it. Starting it
+    sweeps every section, so seats freed while no worker was running are
+    filled without waiting for a request.
+    """
+    global _promoter, _stopped
+    with _promoter_lock:
+        _stopped = False
+        if _promoter is None:
+            _promoter = Promoter()
+            _promoter.start()
+        return _promoter
+
+
+def get_promoter() -> Promoter | None:
+    """
+    Returns the promoter, starting it on first use, or None once it has been
+    stopped.
+    """
+    global _promoter
+    with _promoter_lock:
+        if _promoter is None and not _stopped:
+            _promoter = Promoter()
+            _promoter.start()
+        return _promoter
+
+
+def request_promotion(section_id: int):
+    """
+    Asks the promoter to fill the section's free seats from its waitlist, or
+    does nothing if it has been stopped.
+    """
+    promoter = get_promoter()
+    if promoter is not None:
+        promoter.request(section_id)
+
+
+def stop_promoter():
+    global _promoter, _stopped
+    # The promoter's thread may be waiting on the writer, whose commit hooks
+    # call get_promoter, so it is joined without holding the lock.
+    with _promoter_lock:
+        promoter = _promoter
+        _promoter = None
+        _stopped = True
+    if promoter is not None:
+        promoter.stop()
@@ -1,39 +1,469 @@
 #!/usr/bin/env python3
 import argparse
+import csv
+import itertools
+import json
 import sqlite3
 import os
+import sys
+import time
+from typing import Any, Iterator
 
-parser = argparse.ArgumentParser(
-    prog="schema_init.py",
-    description="Initialize the SQLite database schema",
-)
-parser.add_argument("-i", "--input", help="Input schema file", default="schema.sql")
-parser.add_argument("-f", "--file", help="SQLite database file", default="database.db")
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
 
-args = parser.parse_args()
+# Every counter kept up to date by triggers, along with the expression that
+# recomputes it from scratch.
+COUNTERS = [
+    (
+        "sections",
+        "enrolled_count",
+        """
+        SELECT COUNT(*) FROM enrollments
+        WHERE
+            enrollments.section_id = sections.id
+            AND enrollments.status = 'Enrolled'
+        """,
+    ),
+    (
+        "sections",
+        "waitlist_count",
+        "SELECT COUNT(*) FROM waitlist WHERE waitlist.section_id = sections.id",
+    ),
+    (
+        "users",
+        "waitlist_count",
+        "SELECT COUNT(*) FROM waitlist WHERE waitlist.user_id = users.id",
+    ),
+]
 
-schema_sql_file = open(args.input, "r")
-schema_sql = schema_sql_file.read()
 
-schema_testdata_sql_file = open(args.input.replace(".sql", "_testdata.sql"), "r")
-schema_testdata_sql = schema_testdata_sql_file.read()
+# Every full-text index kept up to date by triggers, along with the query that
+# fills it from scratch. Each row's rowid is the id of the row it indexes.
+SEARCH_INDEXES = [
+    (
+        "course_search",
+        """
+        INSERT INTO course_search (rowid, code, name, department)
+        SELECT courses.id, courses.code, courses.name, departments.name
+        FROM courses
+        INNER JOIN departments ON departments.id = courses.department_id
+        """,
+    ),
+    (
+        "section_search",
+        """
+        INSERT INTO section_search (
+            rowid, code, name, department, instructor, classroom
+        )
+        SELECT
+            sections.id,
+            courses.code,
+            courses.name,
+            departments.name,
+            users.first_name || ' ' || users.last_name,
+            sections.classroom
+        FROM sections
+        INNER JOIN courses ON courses.id = sections.course_id
+        INNER JOIN departments ON departments.id = courses.department_id
+        INNER JOIN users ON users.id = sections.instructor_id
+        """,
+    ),
+]
 
-if os.path.isfile(args.file):
-    answer = input("Database file already exists. Overwrite? (y/n) ")
-    if answer.lower() == "y":
-        os.remove(args.file)
-    else:
-        print("Aborting...")
-        exit(1)
 
-conn = sqlite3.connect(args.file)
+def list_migrations() -> list[tuple[int, str]]:
+    """
+    Returns the version and path of every migration, in order. Migrations are
+    named like 0001_description.sql, and the version of the schema in
+    schema.sql is 0.
+    """
+    migrations = []
+    for name in os.listdir(MIGRATIONS_DIR):
+        if name.endswith(".sql"):
+            version = int(name.split("_", 1)[0])
+            migrations.append((version, os.path.join(MIGRATIONS_DIR, name)))
+    return sorted(migrations)
 
-c = conn.cursor()
-c.executescript(schema_sql)
 
-insertTestData = input("Insert test data? (y/n) ")
-if insertTestData.lower() == "y":
-    c.executescript(schema_testdata_sql)
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
 
-conn.commit()
-conn.close()
+
+def migrate(conn: sqlite3.Connection) -> list[int]:
+    """
+    Applies every migration newer than the database's user_version, each in its
+    own transaction, and returns the versions that were applied.
+    """
+    applied = []
+    for version, path in list_migrations():
+        if version <= schema_version(conn):
+            continue
+
+        with open(path, "r") as f:
+            migration_sql = f.read()
+
+        try:
+            conn.executescript(
+                "BEGIN;\n"
+                + migration_sql
+                + f"\nPRAGMA user_version = {version};\nCOMMIT;"
+            )
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+        applied.append(version)
+    return applied
+
+
+def recompute_counters(conn: sqlite3.Connection):
+    """
+    Recomputes every counter from scratch, without committing.
+    """
+    for table, column, count_sql in COUNTERS:
+        conn.execute(f"UPDATE {table} SET {column} = ({count_sql})")
+
+
+def rebuild_search_indexes(conn: sqlite3.Connection):
+    """
+    Refills every full-text index from scratch, without committing.
+    """
+    for table, fill_sql in SEARCH_INDEXES:
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(fill_sql)
+
+
+def check_counters(conn: sqlite3.Connection, fix: bool = False) -> int:
+    """
+    Recomputes every counter and prints each row whose stored count disagrees.
+    Returns the number of such rows. If fix is set, their counts are corrected.
+    """
+    mismatches = 0
+    for table, column, count_sql in COUNTERS:
+        rows = conn.execute(
+            f"""
+            SELECT id, {column}, ({count_sql})
+            FROM {table}
+            WHERE {column} != ({count_sql})
+            """
+        ).fetchall()
+        for id, stored, actual in rows:
+            print(f"{table}.{column} of {id} is {stored}, should be {actual}")
+        mismatches += len(rows)
+
+        if fix and rows:
+            conn.execute(
+                f"""
+                UPDATE {table}
+                SET {column} = ({count_sql})
+                WHERE {column} != ({count_sql})
+                """
+            )
+
+    conn.commit()
+    return mismatches
+
+
+# The tables that can be imported, in an order that satisfies their foreign
+# keys.
+IMPORT_TABLES = ["departments", "users", "courses", "sections", "enrollments"]
+
+# The number of rows inserted by each executemany call.
+IMPORT_CHUNK_SIZE = 10000
+
+# Settings for the import connection only. Each table is imported in one
+# transaction, so a crash can lose at most the import itself, and it is safe
+# to skip syncing to disk until the end.
+IMPORT_PRAGMA = """
+PRAGMA synchronous = OFF;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -262144;
+"""
+
+
+def read_records(path: str) -> Iterator[dict[str, Any]]:
+    """
+    Yields each record of a CSV file with a header row, or of an NDJSON file
+    with one object per line, without reading the whole file at once.
+    """
+    with open(path, "r", newline="") as f:
+        if path.endswith(".csv"):
+            for record in csv.DictReader(f):
+                # CSV can't tell an empty string from a missing value, and
+                # there are no columns where an empty string makes sense.
+                yield {k: (v if v != "" else None) for k, v in record.items()}
+        elif path.endswith(".ndjson") or path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            raise ValueError(f"{path} is not a .csv, .ndjson or .jsonl file")
+
+
+def convert_boolean(value: Any) -> Any:
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    return value
+
+
+def import_table(
+    conn: sqlite3.Connection,
+    table: str,
+    path: str,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+) -> int:
+    """
+    Appends the records in the file at path to table. See import_records.
+    """
+    return import_records(conn, table, read_records(path), chunk_size, path)
+
+
+def import_records(
+    conn: sqlite3.Connection,
+    table: str,
+    records: Iterator[dict[str, Any]],
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    source: str = "<records>",
+) -> int:
+    """
+    Appends records to table in a single transaction, and returns the number
+    of rows imported. Every record must have the same fields as the first.
+
+    The table's indexes and triggers are dropped for the duration and
+    recreated afterwards, since building an index once is far cheaper than
+    updating it for every row. Counters and full-text indexes that the
+    triggers would have maintained are rebuilt instead.
+
+    Foreign keys are checked once all rows are in, and the import is rolled
+    back if any of them refer to missing rows.
+    """
+    types = {
+        row[1]: row[2].upper()
+        for row in conn.execute(f"PRAGMA table_info({table})").fetchall()
+    }
+    first = next(records, None)
+    if first is None:
+        return 0
+
+    columns = list(first.keys())
+    unknown = [column for column in columns if column not in types]
+    if unknown:
+        raise ValueError(f"{source}: unknown columns in {table}: {', '.join(unknown)}")
+    booleans = [i for i, column in enumerate(columns) if types[column] == "BOOLEAN"]
+
+    insert_sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        table,
+        ", ".join(columns),
+        ", ".join("?" for _ in columns),
+    )
+
+    deferred = conn.execute(
+        """
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+        """,
+        (table,),
+    ).fetchall()
+
+    start = time.perf_counter()
+    count = 0
+    conn.execute("BEGIN")
+    try:
+        for kind, name, sql in deferred:
+            conn.execute(f"DROP {kind} {name}")
+
+        chunk: list[tuple] = []
+        for record in itertools.chain([first], records):
+            row = [record.get(column) for column in columns]
+            for i in booleans:
+                row[i] = convert_boolean(row[i])
+            chunk.append(tuple(row))
+
+            if len(chunk) >= chunk_size:
+                conn.executemany(insert_sql, chunk)
+                count += len(chunk)
+                chunk.clear()
+                print_progress(table, count, start)
+        if chunk:
+            conn.executemany(insert_sql, chunk)
+            count += len(chunk)
+        print_progress(table, count, start)
+        print(file=sys.stderr)
+
+        print(f"{table}: rebuilding {len(deferred)} index(es) and trigger(s)")
+        for kind, name, sql in deferred:
+            conn.execute(sql)
+        if any(kind == "trigger" for kind, name, sql in deferred):
+            recompute_counters(conn)
+            rebuild_search_indexes(conn)
+        if any(name.startswith("catalog_version_") for _, name, _ in deferred):
+            # The triggers that count catalog changes didn't see these rows.
+            conn.execute("UPDATE catalog_version SET version = version + 1")
+
+        violations = conn.execute(f"PRAGMA foreign_key_check({table})").fetchall()
+        if violations:
+            for _, rowid, parent, _ in violations[:10]:
+                print(f"{table} row {rowid} refers to a missing row in {parent}")
+            raise ValueError(
+                f"{source}: {len(violations)} row(s) violate foreign keys of {table}"
+            )
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    elapsed = time.perf_counter() - start
+    print(f"{table}: imported {count} rows in {elapsed:.1f}s")
+    return count
+
+
+def print_progress(table: str, count: int, start: float):
+    rate = count / max(time.perf_counter() - start, 1e-9)
+    print(f"\r{table}: {count:,} rows, {rate:,.0f} rows/s", end="", file=sys.stderr)
+
+
+def create_database(path: str, schema_sql: str):
+    """
+    Creates a database from the schema without test data, and brings it up to
+    date with the migrations.
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript(schema_sql)
+    conn.commit()
+    migrate(conn)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="schema_init.py",
+        description="Initialize the SQLite database schema",
+    )
+    parser.add_argument("-i", "--input", help="Input schema file", default="schema.sql")
+    parser.add_argument(
+        "-f", "--file", help="SQLite database file", default="database.db"
+    )
+    parser.add_argument(
+        "-m",
+        "--migrate",
+        help="Upgrade an existing database in place instead of recreating it",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--check-counters",
+        help="Recompute the enrollment and waitlist counters and report drift",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fix",
+        help="With --check-counters, correct any counters that have drifted",
+        action="store_true",
+    )
+
+    imports = parser.add_argument_group(
+        "import",
+        "Append rows from CSV (with a header row) or NDJSON files, whose fields "
+        "are named after the table's columns. The database is created if it "
+        "doesn't exist, or migrated if it does, without asking.",
+    )
+    for table in IMPORT_TABLES:
+        imports.add_argument(f"--{table}", help=f"File of {table} to import")
+    imports.add_argument(
+        "--chunk-size",
+        help="Rows inserted per statement batch",
+        type=int,
+        default=IMPORT_CHUNK_SIZE,
+    )
+
+    args = parser.parse_args()
+
+    if args.check_counters:
+        if not os.path.isfile(args.file):
+            print("Database file does not exist.")
+            exit(1)
+
+        conn = sqlite3.connect(args.file)
+        mismatches = check_counters(conn, fix=args.fix)
+        conn.close()
+
+        if mismatches == 0:
+            print("All counters are consistent.")
+        elif args.fix:
+            print(f"Fixed {mismatches} counter(s).")
+        else:
+            print(f"{mismatches} counter(s) are inconsistent.")
+            exit(1)
+        return
+
+    if args.migrate:
+        if not os.path.isfile(args.file):
+            print("Database file does not exist.")
+            exit(1)
+
+        conn = sqlite3.connect(args.file)
+        applied = migrate(conn)
+        if applied:
+            print("Applied migrations:", ", ".join(str(v) for v in applied))
+        else:
+            print("Database is already up to date.")
+        print("Schema version:", schema_version(conn))
+        conn.close()
+        return
+
+    schema_sql_file = open(args.input, "r")
+    schema_sql = schema_sql_file.read()
+
+    files = [(t, getattr(args, t)) for t in IMPORT_TABLES if getattr(args, t)]
+    if files:
+        if os.path.isfile(args.file):
+            conn = sqlite3.connect(args.file)
+            migrate(conn)
+            conn.close()
+        else:
+            create_database(args.file, schema_sql)
+
+        conn = sqlite3.connect(args.file)
+        conn.executescript(IMPORT_PRAGMA)
+        try:
+            for table, path in files:
+                import_table(conn, table, path, args.chunk_size)
+        except (ValueError, sqlite3.Error) as e:
+            print("Import failed:", e)
+            exit(1)
+        finally:
+            conn.close()
+        return
+
+    schema_testdata_sql_file = open(args.input.replace(".sql", "_testdata.sql"), "r")
+    schema_testdata_sql = schema_testdata_sql_file.read()
+
+    if os.path.isfile(args.file):
+        answer = input("Database file already exists. Overwrite? (y/n) ")
+        if answer.lower() == "y":
+            os.remove(args.file)
+        else:
+            print("Aborting...")
+            exit(1)
+
+    conn = sqlite3.connect(args.file)
+
+    c = conn.cursor()
+    c.executescript(schema_sql)
+
+    insertTestData = input("Insert test data? (y/n) ")
+    if insertTestData.lower() == "y":
+        c.executescript(schema_testdata_sql)
+
+    conn.commit()
+
+    # The test data is written against schema.sql, so migrations are applied
+    # afterwards, the same way they would be for an existing database.
+    migrate(conn)
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import api
+import database
+import schema_init
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """
+    A client of the app, serving a scratch database with the schema, every
+    migration and the test data.
+    """
+    path = str(tmp_path / "database.db")
+    conn = sqlite3.connect(path)
+    for name in ["schema.sql", "schema_testdata.sql"]:
+        with open(os.path.join(ROOT, name)) as f:
+            conn.executescript(f.read())
+    conn.commit()
+    monkeypatch.chdir(ROOT)
+    schema_init.migrate(conn)
+    conn.close()
+
+    monkeypatch.setattr(database, "SQLITE_DATABASE", path)
+    api.catalog_cache.clear()
+    with TestClient(api.app) as client:
+        yield client
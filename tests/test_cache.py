@@ -0,0 +1,31 @@
+import sqlite3
+
+import api
+import database
+
+
+def test_hits_are_served_without_reading_the_database(client):
+    response = client.get("/courses/1")
+    assert response.status_code == 200
+    acquisitions = database.get_pool(read_only=True).stats().acquisitions
+
+    for _ in range(3):
+        assert client.get("/courses/1").status_code == 200
+        etag = response.headers["ETag"]
+        assert (
+            client.get("/courses/1", headers={"If-None-Match": etag}).status_code == 304
+        )
+
+    assert database.get_pool(read_only=True).stats().acquisitions == acquisitions
+
+
+def test_changes_by_another_process_show_after_the_interval(client, monkeypatch):
+    assert client.get("/courses/1").json()["name"] == "Web Back-End Engineering"
+
+    other = sqlite3.connect(database.SQLITE_DATABASE)
+    other.execute("UPDATE courses SET name = 'Renamed' WHERE id = 1")
+    other.commit()
+    other.close()
+
+    monkeypatch.setattr(api, "CATALOG_VERSION_INTERVAL", 0.0)
+    assert client.get("/courses/1").json()["name"] == "Renamed"
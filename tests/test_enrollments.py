@@ -0,0 +1,81 @@
+def add_section(client, day, begin_time, end_time):
+    response = client.post(
+        "/sections",
+        json={
+            "course_id": 1,
+            "classroom": "CS101",
+            "capacity": 30,
+            "day": day,
+            "begin_time": begin_time,
+            "end_time": end_time,
+            "freeze": False,
+            "instructor_id": 2,
+        },
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_batch_rejects_conflicts_within_the_batch(client):
+    # Section 1 meets on Tuesday from 7pm to 9:45pm.
+    overlapping = add_section(client, "Tuesday", "8pm", "9pm")
+    separate = add_section(client, "Tuesday", "10pm", "11pm")
+
+    response = client.post(
+        "/enrollments",
+        json={
+            "enrollments": [
+                {"user": 1, "section": 1},
+                {"user": 1, "section": overlapping},
+                {"user": 1, "section": separate},
+                {"user": 5, "section": overlapping},
+            ]
+        },
+    )
+    assert response.status_code == 200, response.text
+    results = [(item["result"], item["reason"]) for item in response.json()]
+    assert results == [
+        ("Enrolled", None),
+        (
+            "Rejected",
+            "Section meets at the same time as one requested for the user "
+            "earlier in the batch.",
+        ),
+        ("Enrolled", None),
+        # User 5 is already enrolled in section 1.
+        (
+            "Rejected",
+            "Section meets at the same time as one the user is enrolled in.",
+        ),
+    ]
+
+
+def admissions(client):
+    counts = {}
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith("enrollment_admissions_total{"):
+            labels, value = line.split(" ")
+            counts[labels.split('"')[1]] = float(value)
+    return counts
+
+
+def test_batch_outcomes_are_counted(client):
+    before = admissions(client)
+    response = client.post(
+        "/enrollments",
+        json={
+            "enrollments": [
+                {"user": 1, "section": 2},
+                {"user": 1, "section": 2},
+                {"user": 999, "section": 2},
+            ]
+        },
+    )
+    assert response.status_code == 200, response.text
+    after = admissions(client)
+    changes = {
+        result: after[result] - before.get(result, 0)
+        for result in after
+        if after[result] != before.get(result, 0)
+    }
+    assert changes == {"enrolled": 1, "duplicate": 1, "not_found": 1}
@@ -0,0 +1,27 @@
+import pytest
+
+
+def test_fields_and_expand_pick_the_response(client):
+    response = client.get(
+        "/users/5/enrollments",
+        params={"fields": "grade,section", "expand": "section.course"},
+    )
+    assert response.status_code == 200
+    enrollment = response.json()[0]
+    assert set(enrollment) == {"grade", "section"}
+    assert enrollment["section"]["course"]["id"] == 1
+    assert isinstance(enrollment["section"]["instructor"], int)
+
+
+@pytest.mark.parametrize(
+    "fields, expand",
+    [("grade", "section"), ("grade,section.day", "section.course")],
+)
+def test_expanding_a_field_left_out_of_fields_is_rejected(client, fields, expand):
+    response = client.get(
+        "/users/5/enrollments", params={"fields": fields, "expand": expand}
+    )
+    assert response.status_code == 400
+    assert response.json() == {
+        "detail": f"Field {expand} is expanded but not in fields."
+    }
@@ -0,0 +1,31 @@
+import base64
+import json
+
+import pytest
+
+
+def make_cursor(values):
+    data = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+@pytest.mark.parametrize(
+    "url", ["/users", "/users/5/enrollments", "/sections/1/enrollments"]
+)
+@pytest.mark.parametrize("values", [[{}], [[1]], [2**64], "x", [1, 2], []])
+def test_malformed_cursor_is_rejected(client, url, values):
+    response = client.get(url, params={"limit": 1, "after": make_cursor(values)})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor."}
+
+
+def test_cursor_pages_through_results(client):
+    response = client.get("/users", params={"limit": 2})
+    assert response.status_code == 200
+    first = response.json()
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get("/users", params={"limit": 2, "after": cursor})
+    assert response.status_code == 200
+    second = response.json()
+    assert [user["id"] for user in first + second] == [1, 2, 3, 4]
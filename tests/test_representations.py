@@ -0,0 +1,29 @@
+import pytest
+
+SIDELOADED = "application/x-sideloaded+json"
+
+
+@pytest.mark.parametrize(
+    "url, accept",
+    [
+        ("/users", "application/json"),
+        ("/users", "application/x-ndjson"),
+        ("/users", SIDELOADED),
+        ("/users?limit=2", "application/x-ndjson"),
+        ("/sections/1/enrollments", "application/json"),
+        ("/courses", "application/json"),
+        ("/courses", SIDELOADED),
+        ("/sections/1", "application/json"),
+    ],
+)
+def test_responses_vary_on_accept(client, url, accept):
+    response = client.get(url, headers={"Accept": accept})
+    assert response.status_code == 200
+    assert response.headers["Vary"] == "Accept"
+
+
+def test_not_modified_varies_on_accept(client):
+    etag = client.get("/courses").headers["ETag"]
+    response = client.get("/courses", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["Vary"] == "Accept"
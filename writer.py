@@ -0,0 +1,250 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import queue
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, TypeVar
+
+import database
+import metrics
+
+# The most operations committed together in one transaction.
+WRITER_BATCH_SIZE = 64
+
+# How often to retry a transaction that another process kept from taking the
+# write lock within the busy timeout, and the base of the exponential backoff
+# between attempts, in seconds.
+WRITER_BUSY_RETRIES = 5
+WRITER_BUSY_BACKOFF = 0.05
+
+T = TypeVar("T")
+
+
+@dataclass
+class WriterStats:
+    queue_depth: int
+    batches: int
+    operations: int
+    failed_operations: int
+    failed_batches: int
+    busy_retries: int
+    last_batch_size: int
+    max_batch_size: int
+    mean_batch_size: float
+
+
+@dataclass
+class Operation:
+    run: Callable[[sqlite3.Connection], Any]
+    future: concurrent.futures.Future
+    # The submitter's context, so that the operation's statements are
+    # attributed to its request.
+    context: contextvars.Context
+
+
+class Writer:
+    """
+    Runs every write on one connection from a dedicated thread. Operations
+    are queued, and whatever is waiting when the writer becomes free is run in
+    one transaction and committed at once, so a burst of writes shares a single
+    lock acquisition and WAL sync rather than contending for them.
+
+    Each operation runs in its own savepoint. An operation that raises is
+    rolled back on its own and its caller gets the exception, while the rest of
+    the batch still commits.
+    """
+
+    def __init__(
+        self,
+        pool: database.ConnectionPool,
+        batch_size: int = WRITER_BATCH_SIZE,
+    ):
+        self.pool = pool
+        self.batch_size = batch_size
+        self._queue: queue.Queue[Operation | None] = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._operations = 0
+        self._failed_operations = 0
+        self._failed_batches = 0
+        self._busy_retries = 0
+        self._last_batch_size = 0
+        self._max_batch_size = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Finishes the operations already queued, then stops the thread.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(
+        self,
+        run: Callable[..., T],
+        *args: Any,
+        **kwargs: Any,
+    ) -> "concurrent.futures.Future[T]":
+        """
+        Queues run(db, *args, **kwargs) and returns a future for its result.
+        """
+        future: concurrent.futures.Future[T] = concurrent.futures.Future()
+        self._queue.put(
+            Operation(
+                lambda db: run(db, *args, **kwargs),
+                future,
+                contextvars.copy_context(),
+            )
+        )
+        return future
+
+    def __call__(self, run: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Runs run(db, *args, **kwargs) on the writer and waits for it to commit,
+        returning its result or raising its exception.
+        """
+        return self.submit(run, *args, **kwargs).result()
+
+    async def run(self, run: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Like calling the writer, but awaits the result instead of blocking a
+        thread on it.
+        """
+        return await asyncio.wrap_future(self.submit(run, *args, **kwargs))
+
+    def _run(self):
+        with self.pool.connection() as db:
+            while True:
+                operation = self._queue.get()
+                if operation is None:
+                    return
+
+                batch = [operation]
+                stopping = False
+                while len(batch) < self.batch_size:
+                    try:
+                        operation = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if operation is None:
+                        stopping = True
+                        break
+                    batch.append(operation)
+
+                self._run_batch(db, batch)
+                if stopping:
+                    return
+
+    def _run_batch(self, db: sqlite3.Connection, batch: list[Operation]):
+        results: list[tuple[Operation, Any]] = []
+        failed = 0
+        try:
+            # Take the write lock up front, so that an operation's reads and
+            # the writes that depend on them can't be split by another
+            # process's write.
+            self._retry_busy("begin", lambda: db.execute("BEGIN IMMEDIATE"))
+            for operation in batch:
+                hooks = len(db.commit_hooks)
+                db.execute("SAVEPOINT operation")
+                try:
+                    result = operation.context.run(operation.run, db)
+                except Exception as e:
+                    db.execute("ROLLBACK TO operation")
+                    db.execute("RELEASE operation")
+                    # Hooks belong to the changes that were just undone.
+                    del db.commit_hooks[hooks:]
+                    operation.future.set_exception(e)
+                    failed += 1
+                else:
+                    db.execute("RELEASE operation")
+                    results.append((operation, result))
+            self._retry_busy("commit", db.commit)
+        except Exception as e:
+            # The transaction itself failed, so nothing in it was committed.
+            if db.in_transaction:
+                db.rollback()
+            for operation in batch:
+                if not operation.future.done():
+                    operation.future.set_exception(e)
+            with self._lock:
+                self._failed_batches += 1
+            return
+        finally:
+            with self._lock:
+                self._batches += 1
+                self._operations += len(batch)
+                self._last_batch_size = len(batch)
+                self._max_batch_size = max(self._max_batch_size, len(batch))
+
+        # Results are only handed out once they are durable.
+        for operation, result in results:
+            operation.future.set_result(result)
+        with self._lock:
+            self._failed_operations += failed
+
+    def _retry_busy(self, name: str, step: Callable[[], Any]):
+        """
+        Runs step, retrying it with jittered exponential backoff while SQLite
+        reports that another process holds the lock it needs. Retries are
+        counted in /metrics under name.
+        """
+        for attempt in range(WRITER_BUSY_RETRIES + 1):
+            try:
+                return step()
+            except sqlite3.OperationalError as e:
+                if not database.is_busy(e) or attempt == WRITER_BUSY_RETRIES:
+                    raise
+            with self._lock:
+                self._busy_retries += 1
+            metrics.busy_retries.inc((name,))
+            time.sleep(random.uniform(0, WRITER_BUSY_BACKOFF * 2**attempt))
+
+    def stats(self) -> WriterStats:
+        with self._lock:
+            return WriterStats(
+                queue_depth=self._queue.qsize(),
+                batches=self._batches,
+                operations=self._operations,
+                failed_operations=self._failed_operations,
+                failed_batches=self._failed_batches,
+                busy_retries=self._busy_retries,
+                last_batch_size=self._last_batch_size,
+                max_batch_size=self._max_batch_size,
+                mean_batch_size=(
+                    self._operations / self._batches if self._batches else 0.0
+                ),
+            )
+
+
+_writer: Writer | None = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> Writer:
+    """
+    Returns the writer for the read-write pool, starting it on first use.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = Writer(database.get_pool())
+            _writer.start()
+        return _writer
+
+
+def stop_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop()
+            _writer = None